@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+    Micro-benchmark of columnar = yes against the row path.
+
+    The same random tokenized rows are serialized to COPY text and
+    binary data by the row path (compile_row_converter() with the
+    conversion caches, then pgcopy.CopySerializer) and by
+    columnar.ColumnSerializer, per package of `package` rows.
+
+    usage: python -m benchmarks.columnar [rows] [columns] [package]
+"""
+import sys, time, random
+from txt2sql import conversions, cache, pgcopy, columnar
+from benchmarks import generate
+from benchmarks.convert import TYPECONV
+
+SQLTYPES = {'I': 'integer', 'F': 'numeric', 'P': 'numeric', 'C': 'text',
+    'D': 'date', 'T': 'time', 'N': 'text'}
+
+def row_path(packages, fields, converters, serializer):
+    converters, dummy0 = cache.wrap_converters(fields, converters, 100000)
+    convert_row = conversions.compile_row_converter(converters)
+    return [serializer.serialize_rows([convert_row(row_) for row_ in rows])
+        for rows in packages]
+
+def column_path(packages, serializer):
+    return [serializer.serialize(rows)[0] for rows in packages]
+
+if __name__ == "__main__":
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    ncols = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    package = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+    rng = random.Random(0)
+    fields = generate.default_fields(ncols)
+    rows = [[generate.sample_value(field[1], rng) for field in fields]
+        for dummy0 in xrange(nrows)]
+    packages = [rows[i:i+package] for i in xrange(0, nrows, package)]
+    converters = [TYPECONV[field[1]] for field in fields]
+    sqltypes = [SQLTYPES[field[1]] for field in fields]
+    print "{} rows x {} columns ({}), packages of {} rows".format(nrows,
+        ncols, ''.join(field[1] for field in fields), package)
+    print "{:<8}{:>16}{:>16}{:>10}".format('format', 'row path rows/s',
+        'columnar rows/s', 'speedup')
+    for copyformat in ('text', 'binary'):
+        start = time.time()
+        expected = row_path(packages, fields, converters,
+            pgcopy.CopySerializer(sqltypes, copyformat, 'utf8'))
+        rowtime = time.time() - start
+        start = time.time()
+        data = column_path(packages, columnar.ColumnSerializer(converters,
+            sqltypes, copyformat, 'utf8'))
+        columntime = time.time() - start
+        if copyformat == 'binary':
+            assert data == expected
+        print "{:<8}{:>16.0f}{:>16.0f}{:>9.1f}x".format(copyformat,
+            nrows / rowtime, nrows / columntime, rowtime / columntime)
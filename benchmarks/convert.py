@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+    Micro-benchmark of the field conversion step, per ABAP type.
+
+    'before' is the original per-cell loop of import_txt_to_sql.py
+    (typeconv dict lookup, == u'' check and try/except per cell, with
+    the original regex-based conversion functions); 'after' is the
+    row converter from conversions.compile_row_converter().
+
+    usage: python -m benchmarks.convert [rows] [columns]
+"""
+import sys, re, time, random, decimal, datetime
+from txt2sql import conversions
+
+# the original conversion functions
+def legacy_conv_to_pydate(abap_date):
+    abap_date = abap_date.replace('-','')
+    if len(abap_date) < 8:
+        result = None
+    elif abap_date[0:8] == '00000000':
+        result = None
+    else:
+        try:
+            result = datetime.date(int(abap_date[0:4]),
+                int(abap_date[4:6]), int(abap_date[6:8]))
+        except:
+            result = None
+    return result
+
+def legacy_conv_to_pytime(abap_time):
+    abap_time = abap_time.replace(':','')
+    if len(abap_time) != 6:
+        result = None
+    else:
+        hour = int(abap_time[:2])
+        minute = int(abap_time[2:4])
+        second = int(abap_time[4:])
+        if hour >= 24 or minute >= 60 or second >= 60:
+            result = datetime.time(0,0,0)
+        else:
+            result = datetime.time(hour, minute, second)
+    return result
+
+def legacy_conv_to_pydec(abap_packed):
+    abap_packed = re.sub(',','',abap_packed)
+    if abap_packed[-1] == '-':
+        result = -1 * decimal.Decimal(abap_packed[:-1])
+    else:
+        result = decimal.Decimal(abap_packed)
+    return result
+
+LEGACY_TYPECONV = {'I': int,
+                   'F': decimal.Decimal,
+                   'P': legacy_conv_to_pydec,
+                   'C': unicode,
+                   'D': legacy_conv_to_pydate,
+                   'T': legacy_conv_to_pytime,
+                   'N': unicode}
+
+TYPECONV = {'I': int,
+            'F': decimal.Decimal,
+            'P': conversions.conv_to_pydec,
+            'C': unicode,
+            'D': conversions.conv_to_pydate,
+            'T': conversions.conv_to_pytime,
+            'N': unicode}
+
+def sample_value(abap_type, rng):
+    if abap_type == 'I':
+        return unicode(rng.randint(-100000, 100000))
+    elif abap_type == 'F':
+        return u'{:.3f}'.format(rng.uniform(0, 100000))
+    elif abap_type == 'P':
+        return rng.choice([u'1,234.50-', u'12345.678', u'0.00', u'7-'])
+    elif abap_type == 'C':
+        return rng.choice([u'1000', u'EUR', u'Material description'])
+    elif abap_type == 'D':
+        return rng.choice([u'20150330', u'2015-03-31', u'00000000'])
+    elif abap_type == 'T':
+        return rng.choice([u'123000', u'23:59:59', u'000000'])
+    elif abap_type == 'N':
+        return u'{:010d}'.format(rng.randint(0, 10**9))
+
+def legacy_convert(rows, fields):
+    """
+    The original conversion loop of import_txt_to_sql.py
+    """
+    typeconv = dict((key, [None, value])
+        for key, value in LEGACY_TYPECONV.items())
+    insertdata = []
+    for row_ in rows:
+        insertrow = []
+        for i in xrange(len(fields)):
+            try:
+                if row_[i] == u'':
+                    insertrow.append(None)
+                else:
+                    insertrow.append(typeconv[fields[i][1]][1](row_[i]))
+            except IndexError:
+                break
+        if len(insertrow) == len(fields):
+            insertdata.append(tuple(insertrow))
+    return insertdata
+
+def compiled_convert(rows, fields):
+    convert_row = conversions.compile_row_converter(
+        [TYPECONV[field[1]] for field in fields])
+    return [convert_row(row_) for row_ in rows]
+
+def timed(function, *args):
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+if __name__ == "__main__":
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    ncols = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    rng = random.Random(0)
+    print "{} rows x {} columns of each type".format(nrows, ncols)
+    print "{:<6}{:>16}{:>16}{:>10}".format(
+        'type', 'before rows/s', 'after rows/s', 'speedup')
+    for abap_type in 'IFPCDTN':
+        fields = [['f%d' % i, abap_type] for i in xrange(ncols)]
+        rows = [[sample_value(abap_type, rng) if rng.random() > 0.05
+            else u'' for i in xrange(ncols)] for j in xrange(nrows)]
+        assert legacy_convert(rows, fields) == compiled_convert(rows, fields)
+        before = timed(legacy_convert, rows, fields)
+        after = timed(compiled_convert, rows, fields)
+        print "{:<6}{:>16.0f}{:>16.0f}{:>9.1f}x".format(abap_type,
+            nrows / before, nrows / after, before / after)
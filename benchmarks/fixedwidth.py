@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+    Micro-benchmark of the fixed-width tokenizer against the
+    delimited one.
+
+    The same random rows are written as delimited lines, without and
+    with qualified text fields, and as fixed-width lines, and each
+    set of lines is split with its tokenizer from txt2sql.tokenizer
+    and converted with compile_row_converter().
+
+    usage: python -m benchmarks.fixedwidth [rows] [columns]
+"""
+import sys, time, random
+from txt2sql import tokenizer, conversions, cache
+from benchmarks import generate
+from benchmarks.convert import TYPECONV
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+def tokenize_all(tokenize, lines):
+    return [tokenize(line) for line in lines]
+
+def convert_all(convert_row, rows):
+    return [convert_row(row_) for row_ in rows]
+
+if __name__ == "__main__":
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    ncols = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rng = random.Random(0)
+    fields = generate.fixed_fields(generate.default_fields(ncols))
+    values = [[generate.sample_value(field[1], rng)[:field[2]]
+        for field in fields] for dummy0 in xrange(nrows)]
+    qual = u'\x02'
+    formats = [
+        ('delimited', tokenizer.make_tokenizer(u'|', u'', u''),
+            [u'|'.join(row) for row in values]),
+        ('qualified', tokenizer.make_tokenizer(u'|', qual, u''),
+            [u'|'.join(qual + value + qual if field[1] == 'C' else value
+                for field, value in zip(fields, row)) for row in values]),
+        ('fixed', tokenizer.make_fixed_tokenizer(
+            tokenizer.fixed_layout(fields)),
+            [u''.join(generate.fixed_value(value, field)
+                for field, value in zip(fields, row)) for row in values]),
+        ]
+    print "{} rows x {} columns".format(nrows, ncols)
+    print "{:<12}{:>16}{:>10}{:>16}".format('format', 'tokenize rows/s',
+        'MB/s', '+convert rows/s')
+    expected = None
+    for name, tokenize, lines in formats:
+        nbytes = sum(len(line) for line in lines)
+        seconds, rows = timed(tokenize_all, tokenize, lines)
+        if expected is None:
+            expected = rows
+        # fixed-width values lose their padding, the rest is equal
+        assert [[value.strip() for value in row] for row in rows] == [
+            [value.strip() for value in row] for row in expected]
+        # every format starts with empty conversion caches
+        converters, dummy0 = cache.wrap_converters(fields,
+            [TYPECONV.get(field[1], unicode) for field in fields], 100000)
+        convert_row = conversions.compile_row_converter(converters)
+        converted, dummy0 = timed(convert_all, convert_row, rows)
+        print "{:<12}{:>16.0f}{:>10.1f}{:>16.0f}".format(name,
+            nrows / seconds, nbytes / 1048576.0 / seconds,
+            nrows / (seconds + converted))
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+    Synthetic SAP-style flat file generator
+
+    Writes a header line and `rows` delimited lines matching a field
+    spec in the fields= syntax of the config file (FIELD TYPE, ...).
+    Values look like table extracts: few distinct dates, currencies
+    and company codes, zero padded numbers, amounts with a trailing
+    minus. Text fields are qualified with probability qual_density
+    (always if they contain the delimiter) and contain an escaped
+    qualifier with probability escape_density. A bad_rows fraction
+    of the lines is cut short or, for ASCII-compatible encodings,
+    starts with a byte that neither cp1252 nor utf8 can decode, so
+    both exception paths of the import get exercised. An encoding of
+    raw writes ASCII only.
+
+    With --fixed-width the values are padded to the WIDTH of their
+    field instead (text left-aligned, everything else right-aligned),
+    without delimiters and qualifiers; fields without a WIDTH get the
+    one in WIDTHS.
+
+    usage: python -m benchmarks.generate [options] OUTPUT
+"""
+import sys, io, random, argparse
+
+TYPES = 'NCDPCTIFC'
+
+# fixed-width columns of the generated values
+WIDTHS = {'N': 10, 'C': 40, 'D': 8, 'T': 6, 'P': 16, 'I': 8, 'F': 12}
+
+WORDS = [u'Material', u'Schraube', u'M8x40', u'Lager', u'Nord', u'\xd6l',
+    u'Gr\xfc\xdfe', u'caf\xe9', u'pi\xe8ce', u'Stra\xdfe', u'Kunde', u'A-Z']
+CURRENCIES = [u'EUR', u'USD', u'GBP', u'CHF', u'JPY']
+
+def default_fields(columns):
+    """
+    Field spec of `columns` fields cycling through the ABAP types
+    """
+    return [['F%03d' % i, TYPES[i % len(TYPES)]] for i in xrange(columns)]
+
+def parse_fields(spec):
+    """
+    Parses FIELD TYPE [WIDTH], ... like readconfig.get_flatfile()
+    """
+    fields = [field.split() for field in spec.split(',') if field.strip()]
+    for field in fields:
+        if len(field) not in (2, 3):
+            raise SystemExit("Field spec {} must be in format: FIELD TYPE "
+                "[WIDTH]".format(field))
+        if len(field) == 3:
+            field[2] = int(field[2])
+    return fields
+
+def fixed_fields(fields):
+    """
+    fields with a WIDTH for every field
+    """
+    return [field[:2] + [field[2] if len(field) > 2 else
+        WIDTHS.get(field[1], 20)] for field in fields]
+
+def fixed_value(value, field):
+    if field[1] in ('C', 'STRING'):
+        return value[:field[2]].ljust(field[2])
+    return value[:field[2]].rjust(field[2])
+
+def sample_value(abap_type, rng):
+    if abap_type == 'N':
+        return u'%010d' % rng.randint(0, 99999)
+    elif abap_type == 'C':
+        if rng.random() < 0.5:
+            return rng.choice(CURRENCIES)
+        return u' '.join(rng.choice(WORDS)
+            for dummy0 in xrange(rng.randint(1, 4)))
+    elif abap_type == 'D':
+        if rng.random() < 0.02:
+            return u'00000000'
+        return u'2015%02d%02d' % (rng.randint(1, 12), rng.randint(1, 28))
+    elif abap_type == 'T':
+        return u'%02d%02d00' % (rng.randint(0, 23), rng.randint(0, 59))
+    elif abap_type == 'P':
+        amount = u'{:,.2f}'.format(rng.randint(0, 10**7) / 100.0)
+        return amount + u'-' if rng.random() < 0.2 else amount
+    elif abap_type == 'I':
+        return unicode(rng.randint(-10**6, 10**6))
+    elif abap_type == 'F':
+        return u'{:.3f}'.format(rng.uniform(0, 10**5))
+    return rng.choice(WORDS)
+
+def format_value(value, abap_type, rng, delim, qual, escape,
+        qual_density, escape_density):
+    if abap_type != 'C' or not qual:
+        return value.replace(delim, u' ')
+    if escape and rng.random() < escape_density:
+        value = value + escape + qual + rng.choice(WORDS)
+        return qual + value + qual
+    if delim in value or rng.random() < qual_density:
+        return qual + value + qual
+    return value
+
+def generate(path, fields, rows, delim=u'|', qual=u'\x02', escape=u'',
+        encoding='cp1252', qual_density=0.1, escape_density=0.0,
+        bad_rows=0.0, seed=0, fixed=False):
+    """
+    Writes the file, returns a dict of what was written. fixed
+    writes a fixed-width file of fixed_fields(fields).
+    """
+    rng = random.Random(seed)
+    errors = 'strict'
+    if encoding.lower() == 'raw':
+        # imported without decoding, keep it to ASCII
+        encoding, errors = 'ascii', 'replace'
+    ascii_compatible = errors == 'strict' and (
+        u'a\n'.encode(encoding) == 'a\n')
+    stats = {'rows': rows, 'bad_rows': 0, 'bytes': 0}
+    if fixed:
+        fields = fixed_fields(fields)
+        delim = qual = escape = u''
+        header = u''.join(fixed_value(field[0], field)
+            for field in fields) + u'\r\n'
+    else:
+        header = delim.join(field[0] for field in fields) + u'\r\n'
+    with io.open(path, 'wb') as out:
+        if encoding.lower().replace('-', '') in ('utf16', 'utf_16'):
+            # one BOM for the whole file
+            out.write(header.encode(encoding))
+            encoding = 'utf-16-le' if sys.byteorder == 'little' else (
+                'utf-16-be')
+        else:
+            out.write(header.encode(encoding))
+        for dummy0 in xrange(rows):
+            if fixed:
+                values = [fixed_value(sample_value(field[1], rng), field)
+                    for field in fields]
+            else:
+                values = [format_value(sample_value(field[1], rng),
+                    field[1], rng, delim, qual, escape, qual_density,
+                    escape_density) for field in fields]
+            undecodable = False
+            truncated = False
+            if rng.random() < bad_rows:
+                if ascii_compatible and (len(fields) < 2 or
+                        rng.random() < 0.5):
+                    undecodable = True
+                    stats['bad_rows'] += 1
+                elif len(fields) > 1:
+                    values = values[:rng.randint(1, len(fields) - 1)]
+                    truncated = True
+                    stats['bad_rows'] += 1
+            line = delim.join(values)
+            if truncated and fixed:
+                # end within the last value that is kept, before
+                # the last field starts
+                line = line[:rng.randint(len(line) - len(values[-1]),
+                    len(line) - 1)]
+            line = (line + u'\r\n').encode(encoding, errors)
+            if undecodable:
+                line = '\x81' + line
+            out.write(line)
+        stats['bytes'] = out.tell()
+    return stats
+
+def add_arguments(parser):
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--columns', type=int, default=20,
+        help='number of fields if --fields is not given')
+    parser.add_argument('--fields',
+        help='field spec like the config file, e.g. "MANDT N, BUKRS C"')
+    parser.add_argument('--delim', default=u'|')
+    parser.add_argument('--qual', default=u'\x02')
+    parser.add_argument('--escape', default=u'')
+    parser.add_argument('--encoding', default='cp1252')
+    parser.add_argument('--qual-density', type=float, default=0.1,
+        help='fraction of text values that are qualified')
+    parser.add_argument('--escape-density', type=float, default=0.0,
+        help='fraction of text values with an escaped qualifier')
+    parser.add_argument('--bad-rows', type=float, default=0.0,
+        help='fraction of truncated or undecodable lines')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fixed-width', action='store_true',
+        dest='fixed_width',
+        help='write a fixed-width file instead of a delimited one')
+
+def fields_from_args(args):
+    if args.fields:
+        fields = parse_fields(args.fields)
+    else:
+        fields = default_fields(args.columns)
+    if args.fixed_width:
+        return fixed_fields(fields)
+    return fields
+
+def decode_arg(text):
+    """
+    Command line delimiters may use escapes like \\x02
+    """
+    if isinstance(text, str):
+        return text.decode('string_escape').decode('utf8')
+    return text
+
+def generate_from_args(path, args):
+    return generate(path, fields_from_args(args), args.rows,
+        decode_arg(args.delim), decode_arg(args.qual), decode_arg(args.escape),
+        args.encoding, args.qual_density, args.escape_density,
+        args.bad_rows, args.seed, args.fixed_width)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic SAP-style flat file')
+    add_arguments(parser)
+    parser.add_argument('output')
+    args = parser.parse_args()
+    fields = fields_from_args(args)
+    stats = generate_from_args(args.output, args)
+    print "fields= " + ', '.join(' '.join(str(item) for item in field)
+        for field in fields)
+    print "{rows} rows, {bad_rows} bad, {bytes} bytes".format(**stats)
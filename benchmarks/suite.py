@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+    Stage benchmark of the import pipeline on a synthetic extract.
+
+    Generates a flat file with benchmarks.generate and times each
+    stage of import_txt_to_sql.py on it separately, holding the
+    output of one stage in memory as the input of the next:
+
+    read      LineReader/MmapLineReader, decode every line
+    tokenize  tokenizer.make_tokenizer(), or make_fixed_tokenizer()
+              with --fixed-width
+    convert   conversion caches and compile_row_converter()
+    load      PackageLoader executemany() packages of --pkgsize rows
+              into an in-memory SQLite table or a fake DBAPI sink
+
+    For each stage rows/s, MB/s of source file and the peak RSS of
+    the process so far are reported. --output saves the results as
+    JSON, --compare prints the speedup in rows/s against a saved
+    result, e.g. between two versions:
+
+        python -m benchmarks.suite --output before.json
+        git checkout ...
+        python -m benchmarks.suite --compare before.json
+
+    or between the delimited and the fixed-width parser:
+
+        python -m benchmarks.suite --output delimited.json
+        python -m benchmarks.suite --fixed-width --compare delimited.json
+"""
+import os, sys, time, json, shutil, decimal, datetime, platform
+import argparse, tempfile, subprocess
+from txt2sql import reader, tokenizer, conversions, cache, loaders, fakedb
+from benchmarks import generate
+from benchmarks.convert import TYPECONV
+
+STAGES = ['read', 'tokenize', 'convert', 'load']
+
+def peak_rss():
+    """
+    Peak resident set size of this process in bytes, None if unknown
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on OS X
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def version():
+    """
+    Short git commit of the tree being measured, None if unknown
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', '--short',
+                'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def sqlite_sink(columns):
+    import sqlite3
+    sqlite3.register_adapter(decimal.Decimal, str)
+    sqlite3.register_adapter(datetime.time, datetime.time.isoformat)
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE bench (%s)' % ','.join(columns))
+    return conn
+
+def fake_sink(columns):
+    return fakedb.Connection()
+
+SINKS = {'sqlite': sqlite_sink, 'fake': fake_sink}
+
+def run(path, fields, encoding, delim, qual, escape, sink='sqlite',
+        pkgsize=10000, cachesize=100000, skiplines=1, fixed=False):
+    """
+    Times the stages on the file at path. Returns {stage: seconds},
+    {stage: peak RSS after the stage} and the counts of rows,
+    exceptions and source bytes
+    """
+    seconds = {}
+    rss = {}
+    counts = {'bytes': os.path.getsize(path), 'exceptions': 0}
+
+    start = time.time()
+    stream, size = reader.open_source(path)
+    lines_in = reader.open_lines(stream, size, encoding, 'strict')
+    for dummy0 in xrange(skiplines):
+        lines_in.skip()
+    lines = []
+    while True:
+        try:
+            lines.append(lines_in.next().rstrip('\r\n'))
+        except UnicodeDecodeError:
+            counts['exceptions'] += 1
+        except StopIteration:
+            break
+    lines_in.close()
+    seconds['read'] = time.time() - start
+    rss['read'] = peak_rss()
+
+    start = time.time()
+    if fixed:
+        tokenize = tokenizer.make_fixed_tokenizer(
+            tokenizer.fixed_layout(fields))
+    else:
+        tokenize = tokenizer.make_tokenizer(delim, qual, escape)
+    tokenized = [tokenize(line) for line in lines]
+    seconds['tokenize'] = time.time() - start
+    rss['tokenize'] = peak_rss()
+    del lines
+
+    start = time.time()
+    converters, caches = cache.wrap_converters(fields,
+        [TYPECONV.get(field[1], unicode) for field in fields], cachesize)
+    convert_row = conversions.compile_row_converter(converters,
+        encoding is not None)
+    nfields = len(fields)
+    rows = [convert_row(row_) for row_ in tokenized if len(row_) >= nfields]
+    counts['exceptions'] += len(tokenized) - len(rows)
+    seconds['convert'] = time.time() - start
+    rss['convert'] = peak_rss()
+    del tokenized
+
+    columns = [field[0] for field in fields]
+    conn = SINKS[sink](columns)
+    start = time.time()
+    cursor = conn.cursor()
+    packageloader = loaders.PackageLoader(cursor, 'bench', columns, '?')
+    for pos in xrange(0, len(rows), pkgsize):
+        packageloader.load(rows[pos:pos + pkgsize])
+        if sink == 'fake':
+            # do not keep the recorded rows around
+            del conn.calls[:]
+    conn.commit()
+    seconds['load'] = time.time() - start
+    rss['load'] = peak_rss()
+    conn.close()
+
+    counts['rows'] = len(rows)
+    return seconds, rss, counts
+
+def results(seconds, counts, rss):
+    stages = {}
+    for stage in STAGES:
+        elapsed = seconds[stage]
+        stages[stage] = {'seconds': elapsed,
+            'rows_per_sec': counts['rows'] / elapsed if elapsed else None,
+            'mb_per_sec': (counts['bytes'] / 1048576.0 / elapsed
+                if elapsed else None),
+            'peak_rss': rss[stage]}
+    return stages
+
+def report(result, baseline=None):
+    print "{rows} rows, {exceptions} exceptions, {bytes} bytes".format(
+        **result['counts'])
+    header = "{:<10}{:>10}{:>14}{:>10}{:>14}".format('stage', 'seconds',
+        'rows/s', 'MB/s', 'peak RSS MB')
+    if baseline is not None:
+        header += "{:>10}".format('speedup')
+    print header
+    total = 0.0
+    for stage in STAGES:
+        timing = result['stages'][stage]
+        total += timing['seconds']
+        line = "{:<10}{:>10.2f}{:>14.0f}{:>10.1f}{:>14}".format(stage,
+            timing['seconds'], timing['rows_per_sec'] or 0,
+            timing['mb_per_sec'] or 0, '-' if timing['peak_rss'] is None
+            else '{:.1f}'.format(timing['peak_rss'] / 1048576.0))
+        if baseline is not None and stage in baseline['stages']:
+            before = baseline['stages'][stage]['rows_per_sec']
+            line += "{:>9.2f}x".format(timing['rows_per_sec'] / before
+                if timing['rows_per_sec'] and before else 0)
+        print line
+    line = "{:<10}{:>10.2f}{:>14.0f}".format('total', total,
+        result['counts']['rows'] / total if total else 0)
+    if baseline is not None:
+        before = sum(timing['seconds']
+            for timing in baseline['stages'].values())
+        before = baseline['counts']['rows'] / before if before else 0
+        after = result['counts']['rows'] / total if total else 0
+        line += " " * 24 + "{:>9.2f}x".format(after / before
+            if before else 0)
+    print line
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Time the import stages on a synthetic extract')
+    generate.add_arguments(parser)
+    parser.add_argument('--sink', choices=sorted(SINKS), default='sqlite')
+    parser.add_argument('--pkgsize', type=int, default=10000)
+    parser.add_argument('--cache-size', type=int, default=100000,
+        dest='cachesize')
+    parser.add_argument('--output', help='save the results as JSON')
+    parser.add_argument('--compare',
+        help='JSON results of an earlier run to compare against')
+    parser.add_argument('--keep', action='store_true',
+        help='keep the generated file and print its path')
+    args = parser.parse_args()
+
+    fields = generate.fields_from_args(args)
+    directory = tempfile.mkdtemp(prefix='txt2sql-bench-')
+    path = os.path.join(directory, 'extract.txt')
+    try:
+        generated = generate.generate_from_args(path, args)
+        encoding = None if args.encoding.lower() == 'raw' else (
+            args.encoding.lower())
+        seconds, rss, counts = run(path, fields, encoding,
+            generate.decode_arg(args.delim), generate.decode_arg(args.qual),
+            generate.decode_arg(args.escape), args.sink, args.pkgsize,
+            args.cachesize, fixed=args.fixed_width)
+    finally:
+        if args.keep:
+            print "Generated file: " + path
+        else:
+            shutil.rmtree(directory)
+
+    result = {'version': version(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': datetime.datetime.now().isoformat(),
+              'parameters': dict(vars(args), fields=fields),
+              'generated': generated,
+              'counts': counts,
+              'stages': results(seconds, counts, rss)}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as saved:
+            baseline = json.load(saved)
+        print "Compared to {} ({})".format(args.compare,
+            baseline.get('version'))
+    print "Generated {rows} rows, {bad_rows} bad".format(**generated)
+    report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(result, out, indent=2, sort_keys=True)
@@ -1,5 +1,5 @@
 import argparse, ConfigParser, ast, logging
-import os, sys
+import os, re, sys, tempfile
 
 # http://stackoverflow.com/questions/3853722/python-argparse-how-to-insert-newline-in-the-help-text
 # mutate argparse.HelpFormatter._split_lines
@@ -19,8 +19,14 @@ parser.add_argument('-y', '--yes', action='store_true')
 parser.add_argument('--extra-line-breaks', action='store_true',
     dest='extra_line_breaks',
     help=(
-        'Use this flag when legitimate input fiels may have '
-        'line breaks inserted in the middle of the row.'))
+        'Use this flag when legitimate input fields may have '
+        'line breaks inserted in the middle of the row. Lines are '
+        'joined while a qualified field is open or the row has '
+        'fewer fields than the field spec.'))
+parser.add_argument('--fixed-width', dest='fixed_width',
+    action='store_true',
+    help=('The source is a fixed-width file, the WIDTH of every field '
+          'in fields= is its number of characters'))
 parser.add_argument('--delim', dest='delim')
 parser.add_argument('--qual', dest='qual')
 parser.add_argument('--escape', dest='escape')
@@ -30,6 +36,46 @@ parser.add_argument('--skip', dest='skiplines',
             'e.g. 1 to skip the first row that is a column header'))
 parser.add_argument('--pkgsize', dest='pkgsize',
     help=('Number of bulk rows to try to read and insert per transaction'))
+parser.add_argument('--memory-limit', dest='memory_limit',
+    help=('Approximate memory in bytes used for the rows of one '
+          'package when --pkgsize is not given, default is 10485760'))
+parser.add_argument('--workers', dest='workers',
+    help=('Number of worker processes that decode, parse and convert '
+          'the source file in parallel, default is 1 (no workers)'))
+parser.add_argument('--cache-size', dest='cachesize',
+    help=('Number of entries in each of the LRU caches in front of '
+          'the date, time and decimal conversions, 0 disables them. '
+          'Default is 100000'))
+parser.add_argument('--intern-fields', dest='intern_fields',
+    help=('Comma separated list of low-cardinality text fields whose '
+          'repeated values should share a single string object'))
+parser.add_argument('--columnar', dest='columnar', action='store_true',
+    help=('Convert the I, F, P, D and T fields column by column with '
+          'numpy for --load-method copy, see txt2sql/columnar.py'))
+parser.add_argument('--infer-fields', dest='infer_fields', nargs='?',
+    const='1000', metavar='ROWS',
+    help=('Sample ROWS lines at the start and ROWS lines across the '
+          'source file (default 1000), infer the type and width of '
+          'every field and print a fields= line for the config file '
+          'instead of importing'))
+parser.add_argument('--reject-file', dest='reject_file',
+    help=('Write rejected lines with their line number and the reason '
+          'to this file instead of printing them, {table} is replaced '
+          'by the target table'))
+parser.add_argument('--max-errors', dest='max_errors',
+    help=('Abort and roll back the import when more than this number '
+          'of lines were rejected, default is no limit'))
+parser.add_argument('--key-fields', dest='key_fields',
+    help=('Comma separated list of the key fields of an incremental '
+          'import, which merges the rows into the target table '
+          'instead of replacing it, see txt2sql/upsert.py'))
+parser.add_argument('--row-hash', dest='row_hash', action='store_true',
+    help=('With --key-fields, keep a hash of every row in the target '
+          'table and leave rows whose hash did not change alone'))
+parser.add_argument('--index', dest='indexes', action='append',
+    metavar='FIELDS',
+    help=('Comma separated fields of an index built after the load, '
+          'e.g. "UNIQUE BUKRS,BELNR,GJAHR". Can be repeated'))
 parser.add_argument('--override',action='store_true')
 parser.add_argument('--decoding-error-handler', default='strict',
     choices = ['strict','ignore','replace'],
@@ -44,22 +90,110 @@ parser.add_argument('--decoding-error-handler', default='strict',
         'ignore - ignore character\n'
         'replace - replace with U+FFFD (<?>)'))
 parser.add_argument('--log', dest='logging', action='store_true')
+parser.add_argument('--profile', dest='profile', nargs='?', const='0',
+    metavar='BATCHES',
+    help=('Profile the import with cProfile, for the whole run or only '
+          'the first BATCHES packages, and write <script>.prof and '
+          '<script>.profile.txt next to the log file'))
+parser.add_argument('--metrics-file', dest='metrics_file',
+    help=('Write stage timings and throughput of every package as '
+          'JSON lines to this file. With --log and no metrics file '
+          'they are written to the log'))
+parser.add_argument('--load-method', dest='load_method',
+    choices=['insert', 'copy', 'bulk'],
+    help=(
+        'How converted rows are sent to the target table:\n'
+        'insert - default, parameterized INSERT via executemany\n'
+        'copy - COPY ... FROM STDIN (servertype = postgres only)\n'
+        'bulk - BULK INSERT from staging files (servertype = mssql only)'))
+parser.add_argument('--bulk-dir', dest='bulk_dir',
+    help=('Directory for the BULK INSERT staging files of '
+          '--load-method bulk, must be readable by the server. '
+          'Default is the system temp directory'))
+parser.add_argument('--copy-format', dest='copy_format',
+    choices=['text', 'binary'],
+    help=('COPY data format used with --load-method copy, '
+          'default is text'))
+parser.add_argument('--unlogged', dest='unlogged',
+    choices=['no', 'yes', 'keep'],
+    help=('postgres: load a new table as an UNLOGGED table. yes makes it '
+          'logged before it replaces the target table, keep leaves the '
+          'target table unlogged. Default is no'))
+parser.add_argument('--connections', dest='connections',
+    help=('Number of database connections loading the target table '
+          'in parallel through staging tables, default is 1'))
+parser.add_argument('--checkpoint', dest='checkpoint', metavar='PACKAGES',
+    help=('Commit every PACKAGES packages and record the position in '
+          'the source in the txt2sql_checkpoint table, so that an '
+          'import that fails can be continued with --resume. '
+          'Default is 0, a single commit at the end'))
+parser.add_argument('--resume', action='store_true',
+    help=('Continue an import from its last checkpoint, see '
+          '--checkpoint. Starts from the beginning if there is none. '
+          'Without --checkpoint it takes a checkpoint every 10 packages'))
+parser.add_argument('--force', action='store_true',
+    help=('Import the source even if it did not change since the last '
+          'import into the target table, see txt2sql/fingerprint.py'))
+parser.add_argument('--batch', dest='batch', action='append',
+    metavar='PATH',
+    help=('Import every file in directory PATH, or every file matching '
+          'the glob PATH, each into its own table. Can be repeated'))
+parser.add_argument('--manifest', dest='manifest',
+    help=('Batch manifest mapping files or globs to config files and '
+          'target tables, see txt2sql/batch.py'))
+parser.add_argument('--parallel', dest='parallel',
+    help=('Number of files imported at the same time in batch mode, '
+          'default is 2'))
 parser.add_argument('src_data_', metavar='SRC_DATA', nargs='?',
     default='')
 parser.add_argument('target_table_', metavar='TARGET_TABLE', nargs='?',
     default='')
-args = parser.parse_args()
-fullconfig = os.path.splitext(sys.argv[0])[0] + '.ini'
-localconfig = os.path.splitext(os.path.basename(
-    sys.argv[0]))[0] + '.ini'
-
-config = ConfigParser.RawConfigParser(allow_no_value=True)
-if args.config:
-    config.read([args.config])
-else:
-    config.read([fullconfig, localconfig])
-
-def get_flatfile():
+
+# the command line and the config file are only read on first use
+# of the functions below (or with load()), so that this module can
+# be imported by programs with a command line of their own
+args = None
+config = None
+
+def load(argv=None):
+    """
+    Parses argv (default: the command line) and reads the config file
+    given with -c, or <script>.ini next to the script or in the current
+    directory. Returns the parsed arguments.
+    """
+    global args, config
+    args = parser.parse_args(argv)
+    fullconfig = os.path.splitext(sys.argv[0])[0] + '.ini'
+    localconfig = os.path.splitext(os.path.basename(
+        sys.argv[0]))[0] + '.ini'
+
+    config = ConfigParser.RawConfigParser(allow_no_value=True)
+    if args.config:
+        config.read([args.config])
+    else:
+        config.read([fullconfig, localconfig])
+    return args
+
+def ensure_loaded():
+    if args is None:
+        load()
+
+def field_list(flatfile, text, what):
+    """
+    The comma separated field names in text as named in fields=
+    """
+    names = [name.strip() for name in text.split(',') if name.strip()]
+    if not names or flatfile['fields'] is None:
+        return names
+    fields = dict((field[0].lower(), field[0])
+        for field in flatfile['fields'])
+    for name in names:
+        if name.lower() not in fields:
+            raise SystemExit('{} {} is not in fields='.format(what, name))
+    return [fields[name.lower()] for name in names]
+
+def get_flatfile(require_source=True, require_fields=True):
+    ensure_loaded()
     errors = 0
     flatfile = {}
 
@@ -67,12 +201,21 @@ def get_flatfile():
     for item in config.items('flatfile'):
         flatfile[item[0]] = item[1]
 
+    # delimited or fixed-width source
+    if 'format' not in flatfile:
+        flatfile['format'] = 'fixed' if args.fixed_width else 'delimited'
+    flatfile['format'] = flatfile['format'].strip().lower()
+    if flatfile['format'] not in ('delimited', 'fixed'):
+        raise SystemExit("format in [flatfile] must be one of "
+            "'delimited' or 'fixed'")
+    fixed = flatfile['format'] == 'fixed'
+
     # try to find a suitable delimiter
     try:
         delim0 = flatfile['delimiter']
     except KeyError:
         delim0 = args.delim
-        if delim0 is None and not args.override:
+        if delim0 is None and not args.override and not fixed:
             raise SystemExit('No Delimited specified in the config file under the [flatfile] section nor with --delim')
     if delim0 is None:
         delim = ''
@@ -126,8 +269,12 @@ def get_flatfile():
     flatfile['qualifier'] = qual
 
     # try to parse a list of field identifiers with data types
-    # syntax is FIELDNAME, ABAP_TYPE
-    # example: fields= MANDT N, BUKRS C
+    # syntax is FIELDNAME ABAP_TYPE [WIDTH], WIDTH is the length
+    # of a text field
+    # example: fields= MANDT N 3, BUKRS C 4, BUTXT C
+    # fixed-width files need the WIDTH of every field and can give
+    # the 1-based START column of a field after it
+    # example: fields= MANDT N 3, BUKRS C 4, BUTXT C 25 10
     try:
         fields = [field.strip() for field in
             flatfile['fields'].split(',')]
@@ -135,13 +282,28 @@ def get_flatfile():
             raise SystemExit('No fields defined in config to map')
         fields_ = [field.split() for field in fields]
         for field in fields_:
-            if len(field) != 2:
+            if fixed and len(field) not in (3, 4):
                 raise SystemExit(
-                    "Field spec {} must be in format: FIELD TYPE".format(
-                    field))
+                    "Field spec {} must be in format: FIELD TYPE "
+                    "WIDTH [START] for format = fixed".format(field))
+            if not fixed and len(field) not in (2, 3):
+                raise SystemExit(
+                    "Field spec {} must be in format: FIELD TYPE "
+                    "[WIDTH]".format(field))
+            for i in xrange(2, len(field)):
+                try:
+                    field[i] = int(field[i])
+                except ValueError:
+                    field[i] = 0
+                if field[i] < 1:
+                    raise SystemExit(
+                        "Width and start in field spec {} must be "
+                        "positive integers".format(field))
         flatfile['fields'] = fields_
     except KeyError:
-        raise SystemExit('No fields defined in config to map')
+        if require_fields:
+            raise SystemExit('No fields defined in config to map')
+        flatfile['fields'] = None
     
     if 'escape' not in flatfile:
         if args.escape is None:
@@ -167,6 +329,8 @@ def get_flatfile():
             flatfile['source'] = args.src_data
         elif args.src_data_:
             flatfile['source'] = args.src_data_
+        elif not require_source:
+            flatfile['source'] = None
         else:
             raise SystemExit('Source data file path must be '
                 'specified in the .ini file, using -f or as an '
@@ -205,9 +369,95 @@ def get_flatfile():
             # pkgsize was provided but wasn't an integer
             flatfile['pkgsize'] = 1
 
+    # memory budget of a package when pkgsize is not set,
+    # packages are then sized automatically
+    if 'memory_limit' not in flatfile:
+        flatfile['memory_limit'] = args.memory_limit or 10485760
+    try:
+        flatfile['memory_limit'] = max(1, int(flatfile['memory_limit']))
+    except ValueError:
+        # memory_limit was provided but wasn't an integer
+        flatfile['memory_limit'] = 10485760
+
+    # number of parse/convert worker processes
+    # 1 parses in the main process
+    if 'workers' not in flatfile:
+        flatfile['workers'] = args.workers or 1
+    try:
+        flatfile['workers'] = max(1, int(flatfile['workers']))
+    except ValueError:
+        # workers was provided but wasn't an integer
+        flatfile['workers'] = 1
+
+    # size of the conversion caches, 0 turns them off
+    if 'cachesize' not in flatfile:
+        flatfile['cachesize'] = args.cachesize or 100000
+    try:
+        flatfile['cachesize'] = max(0, int(flatfile['cachesize']))
+    except ValueError:
+        # cachesize was provided but wasn't an integer
+        flatfile['cachesize'] = 100000
+
+    # text fields to dictionary-encode
+    # example: intern_fields= BUKRS, WAERS
+    if 'intern_fields' not in flatfile:
+        flatfile['intern_fields'] = args.intern_fields or ''
+    flatfile['intern_fields'] = [field.strip() for field in
+        flatfile['intern_fields'].split(',') if field.strip()]
+
+    # columnar conversion for loadmethod = copy, needs numpy
+    if 'columnar' not in flatfile:
+        flatfile['columnar'] = 'yes' if args.columnar else 'no'
+    flatfile['columnar'] = flatfile['columnar'].strip().lower() in ('yes',
+        'true', 'on', '1')
+
+    # rejected lines are written to this file, see txt2sql/rejects.py
+    if 'reject_file' not in flatfile:
+        flatfile['reject_file'] = args.reject_file or ''
+    flatfile['reject_file'] = flatfile['reject_file'].strip() or None
+
+    # number of rejected lines after which the import is aborted,
+    # no limit if not set
+    if 'max_errors' not in flatfile:
+        flatfile['max_errors'] = args.max_errors or ''
+    try:
+        flatfile['max_errors'] = max(0, int(flatfile['max_errors']))
+    except ValueError:
+        # max_errors was not set or wasn't an integer
+        flatfile['max_errors'] = None
+
+    # key fields of an incremental import, which merges the rows
+    # into the target table, see txt2sql/upsert.py
+    # example: key_fields= BUKRS, BELNR, GJAHR
+    if 'key_fields' not in flatfile:
+        flatfile['key_fields'] = args.key_fields or ''
+    flatfile['key_fields'] = field_list(flatfile, flatfile['key_fields'],
+        'Key field')
+
+    # indexes built after the load, separated by ';', each a comma
+    # separated list of fields optionally starting with UNIQUE
+    # example: indexes= UNIQUE BUKRS, BELNR, GJAHR; BUDAT
+    if 'indexes' in flatfile:
+        specs = flatfile['indexes'].split(';')
+    else:
+        specs = args.indexes or []
+    flatfile['indexes'] = []
+    for spec in specs:
+        unique = re.match(r'\s*unique\s', spec, re.IGNORECASE)
+        if unique:
+            spec = spec[unique.end():]
+        columns = field_list(flatfile, spec, 'Index field')
+        if columns:
+            flatfile['indexes'].append((bool(unique), columns))
+    if 'row_hash' not in flatfile:
+        flatfile['row_hash'] = 'yes' if args.row_hash else 'no'
+    flatfile['row_hash'] = flatfile['row_hash'].strip().lower() in ('yes',
+        'true', 'on', '1')
+
     return flatfile
 
 def get_pgquery():
+    ensure_loaded()
     pgquery = {}
 
     # mostly exists so that target table can be defined in
@@ -229,14 +479,78 @@ def get_pgquery():
 
 # logon credentials and target db for target sql server
 def get_sqlserver():
+    ensure_loaded()
     sqlserver = {}
 
     for item in config.items('sqlserver'):
         sqlserver[item[0]] = item[1]
+
+    # the load method in the .ini file overrides --load-method
+    if 'loadmethod' not in sqlserver:
+        sqlserver['loadmethod'] = args.load_method or 'insert'
+    sqlserver['loadmethod'] = sqlserver['loadmethod'].strip().lower()
+    if sqlserver['loadmethod'] not in ('insert', 'copy', 'bulk'):
+        raise SystemExit("loadmethod in the [sqlserver] section must be "
+            "one of 'insert', 'copy' or 'bulk'")
+
+    if 'copyformat' not in sqlserver:
+        sqlserver['copyformat'] = args.copy_format or 'text'
+    sqlserver['copyformat'] = sqlserver['copyformat'].strip().lower()
+    if sqlserver['copyformat'] not in ('text', 'binary'):
+        raise SystemExit("copyformat in the [sqlserver] section must be "
+            "one of 'text' or 'binary'")
+
+    # number of parallel loader connections
+    # 1 loads the target table directly
+    if 'connections' not in sqlserver:
+        sqlserver['connections'] = args.connections or 1
+    try:
+        sqlserver['connections'] = max(1, int(sqlserver['connections']))
+    except ValueError:
+        # connections was provided but wasn't an integer
+        sqlserver['connections'] = 1
+
+    # commit every checkpoint packages, 0 commits once at the end
+    # --resume needs checkpoints, it defaults them to 10 packages
+    if 'checkpoint' not in sqlserver:
+        sqlserver['checkpoint'] = args.checkpoint or 0
+    try:
+        sqlserver['checkpoint'] = max(0, int(sqlserver['checkpoint']))
+    except ValueError:
+        # checkpoint was provided but wasn't an integer
+        sqlserver['checkpoint'] = 0
+    if args.resume and not sqlserver['checkpoint']:
+        print ("--resume without checkpoint = N in [sqlserver] or "
+            "--checkpoint, using a checkpoint every 10 packages")
+        sqlserver['checkpoint'] = 10
+
+    # postgres only: UNLOGGED new tables, see --unlogged
+    if 'unlogged' not in sqlserver:
+        sqlserver['unlogged'] = args.unlogged or 'no'
+    sqlserver['unlogged'] = sqlserver['unlogged'].strip().lower()
+    if sqlserver['unlogged'] not in ('no', 'yes', 'keep'):
+        raise SystemExit("unlogged in the [sqlserver] section must be "
+            "one of 'no', 'yes' or 'keep'")
+
+    # record a fingerprint of every imported file and skip files
+    # that did not change since the last import, see --force
+    sqlserver['skip_unchanged'] = (sqlserver.get('skip_unchanged')
+        or 'yes').strip().lower() in ('yes', 'true', 'on', '1')
+
+    # mssql only: ODBC driver, fast_executemany for loadmethod = insert
+    # and the staging file directory for loadmethod = bulk
+    if not sqlserver.get('driver'):
+        sqlserver['driver'] = 'SQL Server'
+    sqlserver['driver'] = sqlserver['driver'].strip().strip('{}')
+    sqlserver['fast_executemany'] = (sqlserver.get('fast_executemany')
+        or 'yes').strip().lower() in ('yes', 'true', 'on', '1')
+    if not sqlserver.get('bulkdir'):
+        sqlserver['bulkdir'] = args.bulk_dir or tempfile.gettempdir()
     return sqlserver
 
 # logon credentials and target instance for SAP (RFC)
 def get_saplogon():
+    ensure_loaded()
     saplogon = {}
 
     for item in config.items('saplogon'):
@@ -247,6 +561,7 @@ def get_saplogon():
 
 # configure the Read Table Query for SAP RFC_READ_TABLE
 def get_sapreadtable():
+    ensure_loaded()
     sapquery = {}
 
     for item in config.items('sap_rfc_read_table'):
@@ -260,6 +575,7 @@ def get_sapreadtable():
     return sapquery
 
 def debug_config():
+    ensure_loaded()
     debug = {}
 
     # read debug config from .ini
@@ -280,18 +596,47 @@ def debug_config():
     return debug
 
 def yes_config():
+    ensure_loaded()
     yes_flag = 0
     if args.yes:
         yes_flag = 1
     return yes_flag
 
 def append_config():
+    ensure_loaded()
     append_flag = 0
     if args.append:
         append_flag = 1
     return append_flag
 
+def infer_fields_config():
+    """
+    Number of lines to sample for --infer-fields, None if not given
+    """
+    ensure_loaded()
+    if args.infer_fields is None:
+        return None
+    try:
+        return max(1, int(args.infer_fields))
+    except ValueError:
+        return 1000
+
+def resume_config():
+    ensure_loaded()
+    resume_flag = 0
+    if args.resume:
+        resume_flag = 1
+    return resume_flag
+
+def force_config():
+    ensure_loaded()
+    force_flag = 0
+    if args.force:
+        force_flag = 1
+    return force_flag
+
 def validator_config():
+    ensure_loaded()
     errors = 0
     validator = {}
 
@@ -314,6 +659,7 @@ def validator_config():
         raise SystemExit('No fields defined in config to map')
 
 def get_logging():
+    ensure_loaded()
     logging = {}
     try:
         for item in config.items('logging'):
@@ -322,14 +668,101 @@ def get_logging():
         pass
     if 'logging' not in logging:
         logging['logging'] = args.logging
+    if not logging.get('metrics_file'):
+        logging['metrics_file'] = args.metrics_file
+
+    # number of packages to profile, 0 for all of them,
+    # None to not profile at all
+    if 'profile' not in logging:
+        logging['profile'] = args.profile
+    if logging['profile'] is not None:
+        try:
+            logging['profile'] = max(0, int(logging['profile'] or 0))
+        except ValueError:
+            # profile was provided but wasn't an integer
+            logging['profile'] = 0
     return logging
 
+# multi-file batch mode, see txt2sql/batch.py
+def get_batch():
+    ensure_loaded()
+    batch = {}
+    try:
+        for item in config.items('batch'):
+            batch[item[0]] = item[1]
+    except ConfigParser.NoSectionError:
+        pass
+
+    # sources = comma separated directories or globs
+    if 'sources' in batch:
+        batch['sources'] = [source.strip() for source in
+            batch['sources'].split(',') if source.strip()]
+    else:
+        batch['sources'] = args.batch or []
+    if not batch.get('manifest'):
+        batch['manifest'] = args.manifest
+
+    # number of files imported at the same time
+    if 'parallel' not in batch:
+        batch['parallel'] = args.parallel or 2
+    try:
+        batch['parallel'] = max(1, int(batch['parallel']))
+    except ValueError:
+        # parallel was provided but wasn't an integer
+        batch['parallel'] = 2
+
+    batch['batch'] = bool(batch['sources'] or batch['manifest'])
+    return batch
+
 def get_extra_line_breaks():
+    ensure_loaded()
     if args.extra_line_breaks:
         return True
     else:
         return False
 
+class Config(object):
+    """
+    All settings of one import, read with the functions above.
+    Used by txt2sql.importer.Importer.
+    """
+    def __init__(self, require_source=True):
+        self.infer_fields = infer_fields_config()
+        self.flatfile = get_flatfile(require_source,
+            self.infer_fields is None)
+        self.pgquery = get_pgquery()
+        self.sqlserver = get_sqlserver()
+        self.logging = get_logging()
+        self.debug = debug_config()
+        self.yes = yes_config()
+        self.append = append_config()
+        self.resume = resume_config()
+        self.force = force_config()
+        self.extra_line_breaks = get_extra_line_breaks()
+
+def read_config(argv=None, require_source=True):
+    """
+    Reads a Config from argv, which takes the same options as the
+    command line, e.g. ['-c', 'extracts.ini', '--workers', '4'].
+    With require_source=False the source file can be left out and
+    given to Importer.run() instead.
+    """
+    load(argv)
+    return Config(require_source)
+
+def read_config_file(path, require_source=True):
+    """
+    Reads a Config from the config file at path and the command
+    line already parsed by load(). Used for the per-file configs
+    of batch mode.
+    """
+    global config
+    ensure_loaded()
+    config = ConfigParser.RawConfigParser(allow_no_value=True)
+    if not config.read([path]):
+        raise SystemExit('Config file {} not found'.format(path))
+    return Config(require_source)
+
 # Unit tests
 #if __name__ == "__main__":
     #flatfile_config = get_flatfile()
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+    Multi-file batch mode of import_txt_to_sql.py
+
+    Imports many files in one run, each into its own table:
+
+        python import_txt_to_sql.py -y --batch 'extracts/*.txt'
+        python import_txt_to_sql.py -y --manifest nightly.manifest
+
+    --batch takes a directory (all files in it) or a glob and can be
+    repeated; these files use the config file given with -c. The
+    manifest is an ini file with one section per file or glob,
+    relative to the manifest, naming the config file and optionally
+    the target table of the files it matches. A file matched by more
+    than one section uses the first one:
+
+        [DEFAULT]
+        config = sap_cp1252.ini
+
+        [extracts/BKPF_*.txt]
+        config = bkpf.ini
+        table = bkpf
+
+        [extracts/*.txt]
+
+        [ledger/GLT0.csv]
+        config = glt0.ini
+        append = yes
+
+    Without a table the table is named after the file as usual. The
+    files are imported by --parallel threads at a time, largest file
+    first, so the longest import starts right away and small files
+    fill the gaps. Threads borrow their connection from a pool that
+    keeps connections open between files. Every file is committed on
+    its own; a file that fails is rolled back and reported, and the
+    other files are still imported.
+
+    Output lines of each file are prefixed with its table name. At
+    the end a table of rows, seconds and throughput per file and in
+    total is printed.
+"""
+import os, sys, glob, time, threading, collections, ConfigParser, Queue
+from txt2sql import db, importer
+
+# a job of the batch: (source path, Config, target table, replace)
+Job = collections.namedtuple('Job', ['source', 'config', 'table',
+    'replace'])
+
+def expand(pattern, base=''):
+    """
+    Files in directory pattern, or matching glob pattern,
+    relative to base
+    """
+    pattern = os.path.join(base, pattern)
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name)
+            for name in os.listdir(pattern) if not name.startswith('.')]
+    else:
+        paths = glob.glob(pattern)
+    return sorted(path for path in paths if os.path.isfile(path))
+
+def read_manifest(path):
+    """
+    [(glob, {config, table, append})] in the order of the manifest
+    """
+    manifest = ConfigParser.RawConfigParser()
+    if not manifest.read([path]):
+        raise SystemExit('Manifest {} not found'.format(path))
+    entries = []
+    for section in manifest.sections():
+        entry = dict(manifest.items(section))
+        entry['append'] = (entry.get('append') or 'no').strip().lower() in (
+            'yes', 'true', 'on', '1')
+        entries.append((section, entry))
+    return entries
+
+def plan(config, batch_config, read_config_file):
+    """
+    Jobs of the batch, largest file first. config is the Config of
+    -c, used for files without a manifest entry. read_config_file
+    reads the Config of a manifest entry, see
+    readconfig.read_config_file()
+    """
+    sources = {} # path -> (config file or None, table, append)
+    for pattern in batch_config['sources']:
+        for path in expand(pattern):
+            sources.setdefault(os.path.abspath(path), (None, '', False))
+    if batch_config['manifest']:
+        base = os.path.dirname(os.path.abspath(batch_config['manifest']))
+        for pattern, entry in read_manifest(batch_config['manifest']):
+            paths = expand(pattern, base)
+            if not paths:
+                print "Manifest entry [{}] matches no files".format(pattern)
+            if entry.get('table') and len(paths) > 1:
+                raise SystemExit('Manifest entry [{}] names table {} but '
+                    'matches {} files'.format(pattern, entry['table'],
+                    len(paths)))
+            configfile = entry.get('config')
+            if configfile:
+                configfile = os.path.join(base, configfile)
+            for path in paths:
+                path = os.path.abspath(path)
+                # the first section matching a file wins
+                if sources.get(path, (None,))[0] is None:
+                    sources[path] = (configfile, entry.get('table') or '',
+                        entry['append'])
+    if not sources:
+        raise SystemExit('No files to import in batch mode')
+
+    # every config file is read once
+    configs = {None: config}
+    jobs = []
+    tables = {}
+    for path, (configfile, table, append) in sources.items():
+        if configfile not in configs:
+            configs[configfile] = read_config_file(configfile, False)
+        fileconfig = configs[configfile]
+        table = importer.table_name(path,
+            table or fileconfig.pgquery['target_table'],
+            fileconfig.debug['debug'])
+        if table in tables:
+            raise SystemExit('{} and {} would both be imported into table '
+                '{}'.format(tables[table], path, table))
+        tables[table] = path
+        jobs.append(Job(path, fileconfig, table,
+            not (append or fileconfig.append)))
+    jobs.sort(key=lambda job: os.path.getsize(job.source), reverse=True)
+    return jobs
+
+class ConnectionPool(object):
+    """
+    Connections kept open between the files of a batch, by server.
+    At most `size` idle connections are kept.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.idle = [] # [(key, connection)], oldest first
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    @staticmethod
+    def key(sqlserver):
+        return tuple(sqlserver.get(name) for name in ('servertype', 'host',
+            'port', 'dbname', 'user', 'driver'))
+
+    def get(self, sqlserver):
+        key = self.key(sqlserver)
+        with self.lock:
+            for i, (idlekey, connection) in enumerate(self.idle):
+                if idlekey == key:
+                    del self.idle[i]
+                    return connection
+            self.opened += 1
+        print "Connecting to database..."
+        return db.connect(sqlserver)
+
+    def put(self, sqlserver, connection):
+        with self.lock:
+            self.idle.append((self.key(sqlserver), connection))
+            if len(self.idle) > self.size:
+                dummy0, connection = self.idle.pop(0)
+            else:
+                connection = None
+        if connection is not None:
+            connection.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for dummy0, connection in idle:
+            connection.close()
+
+class PrefixWriter(object):
+    """
+    Stands in for sys.stdout while threads import files and prefixes
+    each complete line with the prefix set by the writing thread
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def set_prefix(self, prefix):
+        self.local.prefix = prefix
+        self.local.buffer = ''
+
+    def write(self, text):
+        prefix = getattr(self.local, 'prefix', None)
+        if prefix is None:
+            with self.lock:
+                self.stream.write(text)
+            return
+        lines = (self.local.buffer + text).split('\n')
+        self.local.buffer = lines.pop()
+        if lines:
+            with self.lock:
+                for line in lines:
+                    self.stream.write(prefix + line + '\n')
+
+    def flush(self):
+        if getattr(self.local, 'buffer', ''):
+            self.write('\n')
+        with self.lock:
+            if hasattr(self.stream, 'flush'):
+                self.stream.flush()
+
+def import_file(job, pool, logbase, out):
+    """
+    Imports one job with a pooled connection. Returns the
+    ImportResult, or the exception if the import failed.
+    """
+    out.set_prefix('[{}] '.format(job.table))
+    sqlserver = job.config.sqlserver
+    started = time.time()
+    try:
+        connection = pool.get(sqlserver)
+    except Exception as e:
+        print "Cannot connect: {!r}".format(e)
+        return e
+    try:
+        imp = importer.Importer(job.config, connection,
+            '{}.{}'.format(logbase, job.table))
+        result = imp.run(job.source, job.table, job.replace)
+    except KeyboardInterrupt:
+        raise
+    except BaseException as e:
+        # SystemExit too: bad input of one file must not end the
+        # thread, which still has files to import
+        print "Import of {} failed after {:.1f}s: {!r}".format(job.source,
+            time.time() - started, e)
+        # the connection may be broken, do not hand it out again
+        try:
+            connection.close()
+        except Exception:
+            pass
+        return e
+    finally:
+        out.flush()
+    pool.put(sqlserver, connection)
+    return result
+
+def run(jobs, parallel, logbase='import_txt_to_sql'):
+    """
+    Imports the jobs, `parallel` at a time, in the given order.
+    Returns [(job, ImportResult or exception)] and the wall seconds.
+    """
+    pending = Queue.Queue()
+    for job in jobs:
+        pending.put(job)
+    results = {}
+    pool = ConnectionPool(parallel)
+    out = PrefixWriter(sys.stdout)
+
+    def work():
+        while True:
+            try:
+                job = pending.get_nowait()
+            except Queue.Empty:
+                return
+            results[job.table] = import_file(job, pool, logbase, out)
+
+    started = time.time()
+    sys.stdout = out
+    try:
+        threads = [threading.Thread(target=work)
+            for dummy0 in xrange(min(parallel, len(jobs)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        # join with a timeout so that Ctrl-C reaches the main thread
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+    finally:
+        sys.stdout = out.stream
+        pool.close()
+    wall = time.time() - started
+    print "Opened {} connections for {} files".format(pool.opened,
+        len(jobs))
+    return [(job, results.get(job.table)) for job in jobs], wall
+
+def report(results, wall):
+    """
+    Prints rows and throughput per file and in total.
+    Returns the number of failed files.
+    """
+    print "{:<30}{:>12}{:>6}{:>10}{:>12}{:>8}  {}".format('Table', 'rows',
+        'exc', 'seconds', 'rows/s', 'MB/s', 'File')
+    rows = nbytes = failed = 0
+    busy = 0.0
+    for job, result in results:
+        if not isinstance(result, importer.ImportResult):
+            failed += 1
+            print "{:<30}{:>48}  {}".format(job.table, 'FAILED',
+                job.source)
+            continue
+        rows += result.rows
+        nbytes += result.bytes
+        busy += result.seconds
+        print "{:<30}{:>12}{:>6}{:>10.1f}{:>12.0f}{:>8.2f}  {}".format(
+            result.table, result.rows, result.exceptions, result.seconds,
+            result.rows / result.seconds if result.seconds else 0,
+            result.bytes / 1048576.0 / result.seconds
+                if result.seconds else 0, job.source)
+    print "{:<30}{:>12}{:>6}{:>10.1f}{:>12.0f}{:>8.2f}  {} files".format(
+        'total', rows, '', wall, rows / wall if wall else 0,
+        nbytes / 1048576.0 / wall if wall else 0, len(results))
+    print "Concurrency: {:.1f} files on average, {} failed".format(
+        busy / wall if wall else 0, failed)
+    return failed
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+    Package (batch) sizing for import_txt_to_sql.py
+
+    An explicit pkgsize is always honored. Otherwise the first package
+    is small and every following one is sized from what was measured
+    on the packages before it:
+
+    - memory: rows that fit in memory_limit, using the larger of the
+      source bytes per row and the memory held per row by the last
+      package (python rows are a lot bigger than their text)
+    - latency: rows that can be loaded in about target_seconds at the
+      observed load rate, so a slow server gets smaller transactions
+
+    The memory per row is averaged over the packages seen so far to
+    keep the size from oscillating, and the package grows by at most
+    a factor of 2 per step but shrinks right away. Size changes are
+    printed, so they end up in the log.
+"""
+import sys
+
+def package_memory(package, sample=20):
+    """
+    Approximate bytes of memory held by a package: the length of a
+    serialized COPY package, or the size of the row tuples and their
+    values (sampled over the first `sample` rows) for a list of rows
+    """
+    if isinstance(package, str):
+        return len(package)
+    rows = package[:sample]
+    if not rows:
+        return 0
+    size = sys.getsizeof(package)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value)
+            for value in row)
+    return int(float(size) * len(package) / len(rows))
+
+class BatchController(object):
+    """
+    Chooses the number of rows per package, see the module docstring.
+    Call update() after every package and next_size() (rows) or
+    next_bytes() (source bytes, for the parallel chunk reader) before
+    building the next one.
+    memory_limit is in bytes, target_seconds is the load time aimed
+    at per package.
+    """
+    def __init__(self, pkgsize=None, memory_limit=10485760,
+            target_seconds=5.0, start=1000, verbose=True):
+        self.pkgsize = pkgsize
+        self.memory_limit = max(1, memory_limit)
+        self.target_seconds = target_seconds
+        self.size = pkgsize or start
+        self.verbose = verbose
+        self.bytes_per_row = None
+        self.row_memory = None
+        self.reason = 'pkgsize' if pkgsize else 'start'
+        if self.verbose:
+            print "Package size: {} rows ({})".format(self.size, self.reason)
+
+    def next_size(self):
+        return self.size
+
+    def next_bytes(self, default):
+        """
+        Source bytes holding about next_size() rows,
+        default before anything was measured
+        """
+        if self.bytes_per_row is None:
+            return default
+        return max(1, int(self.size * self.bytes_per_row))
+
+    def update(self, package, rows, seconds, rows_read, bytes_read):
+        """
+        Records a loaded package of `rows` rows that took `seconds` to
+        load. rows_read and bytes_read are the source lines and bytes
+        consumed so far.
+        """
+        if rows_read > 0 and bytes_read > 0:
+            self.bytes_per_row = float(bytes_read) / rows_read
+        if self.pkgsize or rows <= 0 or self.bytes_per_row is None:
+            return self.size
+
+        row_memory = max(self.bytes_per_row,
+            float(package_memory(package)) / rows)
+        if self.row_memory is not None:
+            row_memory = (self.row_memory + row_memory) / 2
+        self.row_memory = row_memory
+        size = int(self.memory_limit / row_memory)
+        reason = 'memory_limit'
+        if seconds > 0:
+            latency_size = int(rows * self.target_seconds / seconds)
+            if latency_size < size:
+                size = latency_size
+                reason = 'load latency'
+        if size > 2 * self.size:
+            size = 2 * self.size
+            reason = 'growing'
+        size = max(1, size)
+
+        if self.verbose and (size > 1.25 * self.size or
+                size < 0.8 * self.size):
+            print ("Package size: {} rows ({}, {:.0f} bytes/row, "
+                "{:.2f}s for {} rows)").format(size, reason, row_memory,
+                seconds, rows)
+        self.size = size
+        self.reason = reason
+        return size
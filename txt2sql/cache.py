@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+    Memoizing caches for the conversion functions
+
+    SAP extracts repeat the same posting dates, times and amounts
+    over and over, so the date, time and decimal converters are put
+    behind bounded LRU caches. Text columns with few distinct values
+    can be dictionary-encoded so that every repeated value shares
+    one string object instead of allocating a new one per row.
+
+    Caches are not thread-safe; every import (and every parse
+    worker process) builds its own with wrap_converters().
+"""
+import collections, decimal
+from txt2sql import conversions
+
+CacheInfo = collections.namedtuple('CacheInfo',
+    ['hits', 'misses', 'maxsize', 'currsize'])
+
+# converters worth memoizing, they build a new object per call
+CACHED_CONVERTERS = (conversions.conv_to_pydate,
+                     conversions.conv_to_pytime,
+                     conversions.conv_to_pydec,
+                     decimal.Decimal)
+
+def lru_cache(function, maxsize):
+    """
+    Wraps a one-argument function with a least-recently-used cache
+    of at most maxsize results. Calls that raise are not cached.
+    wrapper.cache_info() returns a CacheInfo like functools.lru_cache
+    in python 3, which this follows.
+    """
+    PREV, NEXT, KEY, RESULT = 0, 1, 2, 3
+    cache = {}
+    cache_get = cache.get
+    stats = [0, 0] # hits, misses
+    # circular doubly linked list of [PREV, NEXT, KEY, RESULT]
+    # links, oldest right after the root
+    root = []
+    root[:] = [root, root, None, None]
+    nonlocal_root = [root]
+
+    def wrapper(key):
+        link = cache_get(key)
+        if link is not None:
+            # move the link to the most recently used end
+            root = nonlocal_root[0]
+            link_prev, link_next, dummy0, result = link
+            link_prev[NEXT] = link_next
+            link_next[PREV] = link_prev
+            last = root[PREV]
+            last[NEXT] = root[PREV] = link
+            link[PREV] = last
+            link[NEXT] = root
+            stats[0] += 1
+            return result
+        result = function(key)
+        stats[1] += 1
+        root = nonlocal_root[0]
+        if len(cache) >= maxsize:
+            # reuse the root as the new link and
+            # turn the oldest link into the new root
+            oldroot = root
+            oldroot[KEY] = key
+            oldroot[RESULT] = result
+            root = nonlocal_root[0] = oldroot[NEXT]
+            del cache[root[KEY]]
+            cache[key] = oldroot
+            root[KEY] = root[RESULT] = None
+        else:
+            last = root[PREV]
+            link = [last, root, key, result]
+            last[NEXT] = root[PREV] = cache[key] = link
+        return result
+
+    def cache_info():
+        return CacheInfo(stats[0], stats[1], maxsize, len(cache))
+
+    wrapper.cache_info = cache_info
+    wrapper.__name__ = getattr(function, '__name__', 'converter')
+    return wrapper
+
+def interner(function, maxsize):
+    """
+    Per-column dictionary encoding: remembers the converted value of
+    the first maxsize distinct inputs and returns the same object for
+    every repeat. Inputs beyond maxsize are converted but not kept.
+    """
+    table = {}
+    table_get = table.get
+    stats = [0, 0] # hits, misses
+
+    def wrapper(value):
+        result = table_get(value)
+        if result is not None:
+            stats[0] += 1
+            return result
+        stats[1] += 1
+        result = function(value)
+        if len(table) < maxsize:
+            table[value] = result
+        return result
+
+    def cache_info():
+        return CacheInfo(stats[0], stats[1], maxsize, len(table))
+
+    wrapper.cache_info = cache_info
+    return wrapper
+
+def wrap_converters(fields, converters, cachesize, intern_fields=()):
+    """
+    Puts the memoizable converters behind LRU caches of cachesize
+    entries (one cache per conversion function, shared by all columns
+    using it) and the fields named in intern_fields behind a
+    per-column interner. Returns (converters, caches) where caches
+    maps a display name to each cache.
+    """
+    if cachesize <= 0:
+        return list(converters), {}
+    caches = {}
+    shared = {}
+    wrapped = []
+    intern_fields = set(name.lower() for name in intern_fields)
+    for field, converter in zip(fields, converters):
+        if field[0].lower() in intern_fields:
+            converter = interner(converter, cachesize)
+            caches['intern ' + field[0]] = converter
+        elif converter in CACHED_CONVERTERS:
+            if converter not in shared:
+                shared[converter] = lru_cache(converter, cachesize)
+                caches[shared[converter].__name__] = shared[converter]
+            converter = shared[converter]
+        wrapped.append(converter)
+    return wrapped, caches
+
+def cache_stats(caches):
+    """
+    Snapshot of every cache as {name: CacheInfo}
+    """
+    return dict((name, cache.cache_info())
+        for name, cache in caches.items())
+
+def merge_stats(snapshots):
+    """
+    Adds up cache_stats() snapshots, e.g. one per worker process
+    """
+    total = {}
+    for snapshot in snapshots:
+        for name, info in snapshot.items():
+            if name in total:
+                info = CacheInfo(*[a + b for a, b in zip(total[name], info)])
+            total[name] = info
+    return total
+
+def report(stats):
+    """
+    Prints hits and misses of every cache
+    """
+    for name in sorted(stats):
+        info = stats[name]
+        lookups = info.hits + info.misses
+        print ("Cache {}: {} hits, {} misses ({:.1f}% hit rate), "
+            "{} of {} entries used").format(name, info.hits, info.misses,
+            100.0 * info.hits / lookups if lookups else 0.0,
+            info.currsize, info.maxsize)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+    Checkpoints of resumable imports
+
+    With checkpoint = N the import commits every N packages and, in
+    the same transaction, records how far it got in the table
+    txt2sql_checkpoint of the target database: the byte offset and
+    the line number in the source after the last committed package,
+    the rows and exceptions so far and the table being loaded. A
+    rerun with --resume continues from there, unless the size of the
+    source or its fingerprint (modification time and sampled blocks,
+    see fingerprint.py) changed. The checkpoint is deleted by the
+    final commit of the import.
+"""
+import collections
+
+CHECKPOINT_TABLE = 'txt2sql_checkpoint'
+
+Checkpoint = collections.namedtuple('Checkpoint', ['load_table', 'source',
+    'source_size', 'byte_offset', 'rowcounter', 'total_rows', 'exceptions',
+    'source_hash'])
+
+COLUMNS = ('(target_table varchar(128) PRIMARY KEY, load_table varchar(128), '
+    'source varchar(1024), source_size bigint, byte_offset bigint, '
+    'rowcounter bigint, total_rows bigint, exceptions bigint, '
+    'source_hash char(32), updated {})')
+
+def create_sql(servertype):
+    """
+    CREATE TABLE statement for the checkpoint table that does
+    nothing if the table already exists
+    """
+    if servertype == 'postgres':
+        return 'CREATE TABLE IF NOT EXISTS {} {}'.format(CHECKPOINT_TABLE,
+            COLUMNS.format('timestamp'))
+    return ("IF NOT EXISTS (SELECT 1 "
+        "from INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = '{0}') "
+        "CREATE TABLE {0} {1}").format(CHECKPOINT_TABLE,
+            COLUMNS.format('datetime2'))
+
+class Checkpoints(object):
+    """
+    Reads and writes the checkpoints of target tables over `cursor`.
+    Nothing is committed here, save() and clear() are committed
+    together with the rows they describe.
+    """
+    def __init__(self, cursor, servertype, ph):
+        self.cursor = cursor
+        self.servertype = servertype
+        self.ph = ph
+
+    def create(self):
+        self.cursor.execute(create_sql(self.servertype))
+
+    def get(self, target_table):
+        """
+        The Checkpoint of target_table, None if there is none
+        """
+        self.cursor.execute(('SELECT {} FROM {} WHERE target_table = {}'
+            ).format(','.join(Checkpoint._fields), CHECKPOINT_TABLE,
+            self.ph), (target_table,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return Checkpoint(*row)
+
+    def save(self, target_table, checkpoint):
+        self.clear(target_table)
+        columns = ('target_table',) + Checkpoint._fields
+        self.cursor.execute(('INSERT INTO {} ({},updated) '
+            'VALUES ({},CURRENT_TIMESTAMP)').format(CHECKPOINT_TABLE,
+            ','.join(columns), ','.join(self.ph for column in columns)),
+            (target_table,) + tuple(checkpoint))
+
+    def clear(self, target_table):
+        self.cursor.execute('DELETE FROM {} WHERE target_table = {}'.format(
+            CHECKPOINT_TABLE, self.ph), (target_table,))
@@ -0,0 +1,615 @@
+# -*- coding: utf-8 -*-
+"""
+    Columnar conversion for loadmethod = copy with columnar = yes
+
+    The row path converts every field of every row on its own, to an
+    int, a Decimal, a datetime.date, ..., which CopySerializer then
+    turns back into COPY text or binary. With columnar = yes the
+    tokenized rows of a package are transposed into columns instead,
+    and the I, F, P, D and T columns are parsed and serialized with
+    numpy array operations on the bytes of the whole column:
+
+    I  -?digits, up to 18 digits
+    F  -?digits.digits
+    P  the same, with thousands separators and the trailing minus
+       of SAP packed numbers (1.234,56- style is not SAP output)
+    D  YYYYMMDD or YYYY-MM-DD, invalid dates are NULL as with
+       conv_to_pydate
+    T  HHMMSS or HH:MM:SS, invalid times are 00:00:00 as with
+       conv_to_pytime
+
+    Text columns are encoded and escaped as one string per column.
+    The serialized columns of all rows are then interleaved into the
+    COPY data of the package in one step, without a tuple or a python
+    value per row.
+
+    Values of any other form (exponents, blanks, a plus sign, ...)
+    go through the converter of the row path and the CopySerializer
+    formatters, so both paths load the same values and reject the
+    same lines. Rows with a value that cannot be converted are
+    dropped from all columns.
+
+    numpy is only imported when columnar = yes is set.
+"""
+import struct, decimal, itertools
+from txt2sql import conversions, pgcopy
+
+np = None
+
+def import_numpy():
+    """
+    Imports numpy on first use, only columnar = yes needs it
+    """
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise SystemExit('columnar = yes needs numpy, pip install numpy')
+        np = numpy
+    return np
+
+# column kinds by the converter of the row path, see
+# importer.type_conversions()
+KINDS = {int: 'integer',
+         decimal.Decimal: 'decimal',
+         conversions.conv_to_pydec: 'packed',
+         conversions.conv_to_pydate: 'date',
+         conversions.conv_to_pytime: 'time',
+         unicode: 'text'}
+
+# most digits of an I value parsed into an int64
+MAXDIGITS = 18
+
+# days from 1970-01-01, the numpy epoch, to 2000-01-01, the epoch of
+# COPY binary dates
+PG_EPOCH_DAYS = 10957
+
+MINUS, DOT, COMMA, DASH, COLON = (ord(c) for c in '-.,-:')
+
+# A piece is the serialized form of one part of a column, for every
+# row: (uint8 array of the bytes of all rows, int64 array of the
+# number of bytes of each row). interleave() puts the pieces of a
+# package together row by row.
+
+def frombytes(data):
+    return np.frombuffer(data, np.uint8)
+
+def piece_from_strings(values):
+    """
+    Piece of a list of byte strings
+    """
+    return (frombytes(''.join(values)),
+        np.fromiter(itertools.imap(len, values), np.int64, len(values)))
+
+def piece_from_matrix(matrix, lengths=None):
+    """
+    Piece of a (rows, width) uint8 matrix, of the first lengths
+    bytes of each row if lengths is given
+    """
+    if lengths is None:
+        return (matrix.ravel(),
+            np.full(len(matrix), matrix.shape[1], np.int64))
+    inside = np.arange(matrix.shape[1]) < lengths[:, None]
+    return matrix[inside], lengths
+
+def constant_piece(data, mask):
+    """
+    Piece with data in the rows of mask, empty elsewhere
+    """
+    return (np.tile(frombytes(data), int(mask.sum())),
+        mask.astype(np.int64) * len(data))
+
+def expand(piece, mask):
+    """
+    Piece of all rows from a piece of the rows in mask
+    """
+    lengths = np.zeros(len(mask), np.int64)
+    lengths[mask] = piece[1]
+    return piece[0], lengths
+
+def select(piece, keep):
+    """
+    Piece of the rows in keep
+    """
+    return piece[0][np.repeat(keep, piece[1])], piece[1][keep]
+
+def interleave(pieces):
+    """
+    Byte string of the first row of every piece, followed by the
+    second row of every piece, ...
+    """
+    lengths = np.column_stack([piece[1] for piece in pieces])
+    ends = np.cumsum(lengths.ravel()).reshape(lengths.shape)
+    starts = ends - lengths
+    out = np.empty(ends[-1, -1] if ends.size else 0, np.uint8)
+    for i, (data, piece_lengths) in enumerate(pieces):
+        if not len(data):
+            continue
+        offsets = starts[:, i] - (np.cumsum(piece_lengths) - piece_lengths)
+        out[np.arange(len(data)) + np.repeat(offsets, piece_lengths)] = data
+    return out.tostring()
+
+def to_matrix(data, lengths, width):
+    """
+    (rows, width) matrix of the bytes of a piece, NUL padded
+    """
+    matrix = np.zeros((len(lengths), width), np.uint8)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    columns = np.arange(len(data)) - np.repeat(np.cumsum(lengths) - lengths,
+        lengths)
+    matrix[rows, columns] = data
+    return matrix
+
+def byte_matrix(values):
+    """
+    (rows, width) uint8 matrix of the values, NUL padded.
+    Characters outside of ASCII become '?', which none of the column
+    kinds accept.
+    """
+    try:
+        array = np.array(values, np.string_)
+    except UnicodeError:
+        array = np.array([value.encode('ascii', 'replace')
+            if isinstance(value, unicode) else value for value in values],
+            np.string_)
+    return array.view(np.uint8).reshape(len(values), array.itemsize)
+
+def widen(matrix, width):
+    """
+    The matrix, NUL padded to at least width columns
+    """
+    if matrix.shape[1] >= width:
+        return matrix
+    return np.hstack([matrix, np.zeros((len(matrix),
+        width - matrix.shape[1]), np.uint8)])
+
+def is_digit(matrix):
+    return (matrix >= 48) & (matrix <= 57)
+
+def be(values, dtype):
+    """
+    (rows, size) uint8 matrix of the big-endian values
+    """
+    values = np.ascontiguousarray(values, dtype)
+    return values.view(np.uint8).reshape(len(values), -1)
+
+def fixed_field(payload, binary):
+    """
+    Piece of a fixed-size value, with its length in binary format
+    """
+    if binary:
+        header = np.tile(frombytes(struct.pack('!i', payload.shape[1])),
+            (len(payload), 1))
+        payload = np.hstack([header, payload])
+    return piece_from_matrix(payload)
+
+def integer_pieces(matrix, lengths, binary):
+    """
+    (valid, pieces of the valid rows, NULL among the valid rows)
+    of an I column
+    """
+    width = matrix.shape[1]
+    pos = np.arange(width)
+    inside = pos < lengths[:, None]
+    negative = matrix[:, 0] == MINUS
+    digit = is_digit(matrix) & inside
+    ndigits = digit.sum(1)
+    valid = ((lengths - negative == ndigits) & (ndigits >= 1) &
+        (ndigits <= MAXDIGITS))
+    matrix, lengths, digit = matrix[valid], lengths[valid], digit[valid]
+    null = np.zeros(len(matrix), bool)
+    if not binary:
+        # the digits as they are, COPY parses them
+        return valid, [piece_from_matrix(matrix, lengths)], null
+    powers = 10 ** np.clip(lengths[:, None] - 1 - pos, 0, MAXDIGITS)
+    values = np.where(digit, (matrix.astype(np.int64) - 48) * powers,
+        0).sum(1)
+    values = np.where(negative[valid], -values, values)
+    fits = (values >= -2**31) & (values < 2**31)
+    if not fits.all():
+        # out of range for integer, the row path fails the same way
+        valid[np.flatnonzero(valid)[~fits]] = False
+        values, null = values[fits], null[fits]
+    return valid, [fixed_field(be(values, '>i4'), binary)], null
+
+def decimal_pieces(matrix, lengths, binary, packed):
+    """
+    (valid, pieces of the valid rows, NULL among the valid rows)
+    of an F or, with packed, a P column
+    """
+    nrows, width = matrix.shape
+    pos = np.arange(width)
+    if packed and (matrix == COMMA).any():
+        # thousands separators are dropped, wherever they are
+        keep = (pos < lengths[:, None]) & (matrix != COMMA)
+        lengths = keep.sum(1)
+        matrix = to_matrix(matrix[keep], lengths, width)
+    negative = matrix[:, 0] == MINUS
+    start = negative.astype(np.int64)
+    end = lengths.copy()
+    valid = np.ones(nrows, bool)
+    if packed:
+        last = matrix[np.arange(nrows), np.maximum(lengths - 1, 0)]
+        trailing = (last == MINUS) & (lengths > 1)
+        # -1- is positive in conv_to_pydec, it takes the row path
+        valid &= ~(trailing & negative)
+        end -= trailing
+        negative |= trailing
+    body = (pos >= start[:, None]) & (pos < end[:, None])
+    digit = is_digit(matrix) & body
+    dot = (matrix == DOT) & body
+    ndigits = digit.sum(1)
+    ndots = dot.sum(1)
+    valid &= (ndigits + ndots == end - start) & (ndots <= 1) & (ndigits >= 1)
+    if not valid.any():
+        return valid, [], np.zeros(0, bool)
+    matrix, negative, start, end = (matrix[valid], negative[valid],
+        start[valid], end[valid])
+    nrows = len(matrix)
+    null = np.zeros(nrows, bool)
+    if not binary:
+        # [-]digits[.digits], COPY parses them
+        body = (pos >= start[:, None]) & (pos < end[:, None])
+        return valid, [constant_piece('-', negative),
+            (matrix[body], end - start)], null
+    dot = dot[valid]
+    point = np.where(dot.any(1), dot.argmax(1), end)
+    intdigits = point - start
+    fracdigits = np.where(dot.any(1), end - point - 1, 0)
+    # base-10000 digit groups: the integer digits right-aligned to
+    # the point, the fraction digits left-aligned after it
+    intgroups = -(-intdigits.max() // 4)
+    fracgroups = -(-fracdigits.max() // 4)
+    rows = np.arange(nrows)[:, None]
+    source = point[:, None] - 4 * intgroups + np.arange(4 * intgroups)
+    intpart = np.where(source >= start[:, None],
+        matrix[rows, np.clip(source, 0, width - 1)].astype(np.int64) - 48,
+        0)
+    source = point[:, None] + 1 + np.arange(4 * fracgroups)
+    fracpart = np.where(source < end[:, None],
+        matrix[rows, np.clip(source, 0, width - 1)].astype(np.int64) - 48,
+        0)
+    groups = np.hstack([intpart, fracpart]).reshape(nrows, -1, 4).dot(
+        [1000, 100, 10, 1])
+    # leading and trailing zero groups are left out, see
+    # pgcopy.numeric_to_binary()
+    ngroups = groups.shape[1]
+    nonzero = groups != 0
+    anydigit = nonzero.any(1)
+    first = nonzero.argmax(1)
+    last = ngroups - 1 - nonzero[:, ::-1].argmax(1)
+    count = np.where(anydigit, last - first + 1, 0)
+    weight = np.where(anydigit, intgroups - 1 - first, 0)
+    column = np.arange(ngroups)
+    kept = ((column >= first[:, None]) & (column <= last[:, None]) &
+        anydigit[:, None])
+    header = np.hstack([be(8 + 2 * count, '>i4'),
+        be(np.column_stack([count, weight, np.where(negative, 0x4000, 0),
+            fracdigits]).ravel(), '>i2').reshape(nrows, 8)])
+    digits = np.ascontiguousarray(groups, '>u2')[kept].view(np.uint8)
+    return valid, [piece_from_matrix(header), (digits, 2 * count)], null
+
+def date_pieces(matrix, lengths, binary):
+    """
+    (valid, pieces of the valid rows, NULL among the valid rows)
+    of a D column
+    """
+    nrows = len(matrix)
+    matrix = widen(matrix, 10)
+    dashed = ((lengths == 10) & (matrix[:, 4] == DASH) &
+        (matrix[:, 7] == DASH))
+    index = np.where(dashed[:, None], [0, 1, 2, 3, 5, 6, 8, 9],
+        [0, 1, 2, 3, 4, 5, 6, 7])
+    digits = matrix[np.arange(nrows)[:, None], index]
+    valid = (is_digit(digits).all(1) & ((lengths == 8) & ~dashed | dashed))
+    digits = digits[valid].astype(np.int64) - 48
+    year = digits[:, :4].dot([1000, 100, 10, 1])
+    month = digits[:, 4:6].dot([10, 1])
+    day = digits[:, 6:].dot([10, 1])
+    ok = (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1)
+    months = np.where(ok, (year - 1970) * 12 + month - 1, 0).astype(
+        'datetime64[M]')
+    days = months.astype('datetime64[D]') + np.where(ok, day - 1, 0)
+    ok &= days.astype('datetime64[M]') == months
+    # 00000000 and invalid dates are NULL
+    null = ~ok
+    if binary:
+        payload = be(days[ok].astype(np.int64) - PG_EPOCH_DAYS, '>i4')
+    else:
+        # YYYY-MM-DD
+        payload = np.empty((int(ok.sum()), 10), np.uint8)
+        payload[:, [0, 1, 2, 3, 5, 6, 8, 9]] = digits[ok] + 48
+        payload[:, [4, 7]] = DASH
+    return valid, [expand(fixed_field(payload, binary), ok)], null
+
+def time_pieces(matrix, lengths, binary):
+    """
+    (valid, pieces of the valid rows, NULL among the valid rows)
+    of a T column
+    """
+    nrows = len(matrix)
+    matrix = widen(matrix, 8)
+    colons = ((lengths == 8) & (matrix[:, 2] == COLON) &
+        (matrix[:, 5] == COLON))
+    index = np.where(colons[:, None], [0, 1, 3, 4, 6, 7],
+        [0, 1, 2, 3, 4, 5])
+    digits = matrix[np.arange(nrows)[:, None], index]
+    valid = is_digit(digits).all(1) & ((lengths == 6) & ~colons | colons)
+    digits = digits[valid].astype(np.int64) - 48
+    hms = digits.reshape(-1, 3, 2).dot([10, 1])
+    # out of range times are 00:00:00
+    hms[(hms >= [24, 60, 60]).any(1)] = 0
+    if binary:
+        payload = be(hms.dot([3600, 60, 1]) * 1000000, '>i8')
+    else:
+        # HH:MM:SS
+        payload = np.empty((len(hms), 8), np.uint8)
+        payload[:, [0, 3, 6]] = hms // 10 + 48
+        payload[:, [1, 4, 7]] = hms % 10 + 48
+        payload[:, [2, 5]] = COLON
+    return valid, [fixed_field(payload, binary)], np.zeros(len(hms), bool)
+
+class ColumnSerializer(object):
+    """
+    Converts packages of tokenized rows column by column and
+    serializes them to COPY `copyformat` ('text' or 'binary') data.
+    converters are the conversion functions of the row path,
+    sqltypes and encoding as for pgcopy.CopySerializer. decoded is
+    False if the fields are undecoded byte strings.
+    """
+    def __init__(self, converters, sqltypes, copyformat='text',
+            encoding='utf8', decoded=True):
+        import_numpy()
+        self.converters = converters
+        self.kinds = [KINDS.get(converter) for converter in converters]
+        self.binary = copyformat == 'binary'
+        self.encoding = encoding
+        self.decoded = decoded
+        serializer = pgcopy.CopySerializer(sqltypes, copyformat, encoding)
+        self.formatters = serializer.formatters
+        self.header = serializer.header
+        self.trailer = serializer.trailer
+        self.null = pgcopy.BINARY_NULL if self.binary else pgcopy.NULL_TEXT
+
+    def convert_cells(self, values, converter, formatter, rows, errors):
+        """
+        Piece of the values converted one by one with the row path
+        converter. Values that cannot be converted are added to
+        errors as {row: message}.
+        """
+        serialized = []
+        for row, value in zip(rows, values):
+            try:
+                if self.decoded and converter is unicode:
+                    value = value or None
+                else:
+                    value = converter(value) if value else None
+                if value is None:
+                    serialized.append(self.null)
+                elif self.binary:
+                    data = formatter(value)
+                    serialized.append(struct.pack('!i', len(data)) + data)
+                else:
+                    serialized.append(formatter(value))
+            except (ValueError, ArithmeticError) as e:
+                errors.setdefault(row, 'conversion error: {}'.format(e))
+                serialized.append('')
+        return piece_from_strings(serialized)
+
+    def text_pieces(self, values):
+        """
+        Pieces of a text column, None if it has to be serialized
+        value by value
+        """
+        if self.decoded:
+            data = u'\x00'.join(values).encode(self.encoding)
+        else:
+            data = '\x00'.join(values)
+        if data.count('\x00') != len(values) - 1:
+            # a value contains a NUL, which the separator cannot tell
+            return None
+        flat = frombytes(data)
+        if not self.decoded and (flat >= 128).any():
+            # the row path decodes byte strings as ASCII
+            return None
+        if not self.binary:
+            flat = frombytes(pgcopy.escape_text(data))
+        separator = flat == 0
+        ends = np.flatnonzero(separator)
+        nbytes = np.diff(np.concatenate([[-1], ends, [len(flat)]])) - 1
+        text = (flat[~separator], nbytes)
+        nonempty = nbytes > 0
+        if self.binary:
+            header = be(np.where(nonempty, nbytes, -1), '>i4')
+            return [piece_from_matrix(header), text]
+        return [text, constant_piece(self.null, ~nonempty)]
+
+    def column_pieces(self, values, kind, converter, formatter, errors):
+        """
+        Pieces of a column, values that cannot be converted are
+        added to errors as {row: message}
+        """
+        nrows = len(values)
+        if kind == 'text':
+            pieces = self.text_pieces(values)
+            if pieces is not None:
+                return pieces
+            kind = None
+        if kind is not None:
+            matrix = byte_matrix(values)
+            nonzero = matrix != 0
+            lengths = np.where(nonzero.any(1),
+                matrix.shape[1] - nonzero[:, ::-1].argmax(1), 0)
+        empty = u'' if self.decoded else ''
+        if kind is None or '\x00' in empty.join(values):
+            # byte_matrix() drops NUL characters at the end of a value
+            lengths = np.fromiter(itertools.imap(len, values), np.int64,
+                nrows)
+        pieces = []
+        nonempty = lengths > 0
+        null = ~nonempty
+        converted = np.zeros(nrows, bool)
+        if kind is not None and nonempty.any():
+            fits = lengths <= matrix.shape[1]
+            if kind == 'integer':
+                valid, fast, fastnull = integer_pieces(matrix, lengths,
+                    self.binary)
+            elif kind in ('decimal', 'packed'):
+                valid, fast, fastnull = decimal_pieces(matrix, lengths,
+                    self.binary, kind == 'packed')
+            elif kind == 'date':
+                valid, fast, fastnull = date_pieces(matrix, lengths,
+                    self.binary)
+            else:
+                valid, fast, fastnull = time_pieces(matrix, lengths,
+                    self.binary)
+            converted = valid & nonempty & fits
+            if not converted.all():
+                # keep the pieces of the converted rows only
+                keep = (nonempty & fits)[valid]
+                fast = [select(piece, keep) for piece in fast]
+                fastnull = fastnull[keep]
+            pieces.extend(expand(piece, converted) for piece in fast)
+            null[np.flatnonzero(converted)[fastnull]] = True
+        others = np.flatnonzero(nonempty & ~converted)
+        if len(others):
+            pieces.append(expand(self.convert_cells(
+                [values[row] for row in others], converter, formatter,
+                others, errors), nonempty & ~converted))
+        pieces.append(constant_piece(self.null, null))
+        return pieces
+
+    def serialize(self, rows):
+        """
+        Serializes tokenized rows, which have at least one field per
+        converter, without header and trailer. Returns the data and
+        a sorted list of (index of the row, message) of the rows that
+        were dropped because a value cannot be converted.
+        """
+        nrows = len(rows)
+        ncolumns = len(self.converters)
+        if not nrows:
+            return '', []
+        errors = {}
+        pieces = []
+        everyrow = np.ones(nrows, bool)
+        if self.binary:
+            pieces.append(constant_piece(struct.pack('!h', ncolumns),
+                everyrow))
+        for i, values in enumerate(zip(*rows)[:ncolumns]):
+            if i and not self.binary:
+                pieces.append(constant_piece('\t', everyrow))
+            pieces.extend(self.column_pieces(values, self.kinds[i],
+                self.converters[i], self.formatters[i], errors))
+        if not self.binary:
+            pieces.append(constant_piece('\n', everyrow))
+        if errors:
+            keep = everyrow.copy()
+            keep[errors.keys()] = False
+            pieces = [select(piece, keep) for piece in pieces]
+        return interleave(pieces), sorted(errors.items())
+
+# Consistency tests
+# compares the columnar COPY data to the row path on random values
+# of every column kind, in text and binary format
+# usage: python -m txt2sql.columnar [rows]
+if __name__ == "__main__":
+    import sys, random
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(0)
+    converters = [int, decimal.Decimal, conversions.conv_to_pydec,
+        conversions.conv_to_pydate, conversions.conv_to_pytime, unicode]
+    sqltypes = ['integer', 'numeric', 'numeric', 'date', 'time', 'text']
+
+    def digits(low, high):
+        return ''.join(rng.choice('0123456789')
+            for dummy0 in xrange(rng.randint(low, high)))
+
+    def value(kind):
+        choice = rng.random()
+        if choice < 0.05:
+            return u''
+        if choice < 0.15:
+            # odd forms and garbage for the row path
+            return rng.choice([u' 12', u'+5', u'1e5', u'-', u'.', u'1-2',
+                u'-5-', u'1,000', u'00000000', u'2015-1009', u'12:3456',
+                u'2015130', u'-0', u'0.000', u'abc',
+                u'\xe9', u'1\x002', u'12\x00', u'\x00', u'\\', u'a\tb', u'NaN',
+                u'24:00:00',
+                u'20150230', u'20000229', u'0.0000001', u'5.', u'-.5'])
+        if kind == 'I':
+            return rng.choice([u'', u'-']) + digits(1, 9)
+        if kind in 'FP':
+            value = digits(0, 12) + rng.choice([u'', u'.' + digits(0, 9)])
+            value = value or u'0'
+            if kind == 'P' and rng.random() < 0.3:
+                return value + u'-'
+            if kind == 'P' and rng.random() < 0.2:
+                return u'{:,}'.format(int(digits(4, 10))) + u'.' + digits(2, 2)
+            return rng.choice([u'', u'-']) + value
+        if kind == 'D':
+            value = u'{:04d}{:02d}{:02d}'.format(rng.randint(0, 9999),
+                rng.randint(0, 13), rng.randint(0, 32))
+            if rng.random() < 0.5:
+                return value[:4] + u'-' + value[4:6] + u'-' + value[6:]
+            return value
+        if kind == 'T':
+            value = u'{:02d}{:02d}{:02d}'.format(rng.randint(0, 25),
+                rng.randint(0, 61), rng.randint(0, 61))
+            if rng.random() < 0.5:
+                return value[:2] + u':' + value[2:4] + u':' + value[4:]
+            return value
+        return rng.choice([u'Stra\xdfe', u'a\\b', u'x\ty', u'line\nbreak',
+            u'caf\xe9 ' + digits(0, 5), u'plain'])
+
+    def row_path(rows, serializer):
+        convert_row = conversions.compile_row_converter(converters)
+        data, errors = [], []
+        for i, row in enumerate(rows):
+            try:
+                data.append(serializer.serialize(convert_row(row)))
+            except (ValueError, ArithmeticError) as e:
+                errors.append((i, 'conversion error: {}'.format(e)))
+        return ''.join(data), errors
+
+    def fields(data):
+        return [line.split('\t') for line in data.split('\n')]
+
+    failures = 0
+    for batch in xrange(4):
+        sample = [[value(kind) for kind in 'IFPDTC']
+            for dummy0 in xrange(rows // 4)]
+        for copyformat in ('text', 'binary'):
+            serializer = pgcopy.CopySerializer(sqltypes, copyformat, 'utf8')
+            expected, expected_errors = row_path(sample, serializer)
+            columns = ColumnSerializer(converters, sqltypes, copyformat,
+                'utf8')
+            data, errors = columns.serialize(sample)
+            if errors != expected_errors:
+                failures += 1
+                print "{} errors differ: {} {}".format(copyformat,
+                    [e for e in errors if e not in expected_errors][:5],
+                    [e for e in expected_errors if e not in errors][:5])
+            if copyformat == 'binary':
+                same = data == expected
+            else:
+                # equal values, digits may be written differently
+                same = True
+                for got, want in zip(fields(data), fields(expected)):
+                    for a, b in zip(got, want):
+                        if a != b and (a == pgcopy.NULL_TEXT or
+                                b == pgcopy.NULL_TEXT or
+                                decimal.Decimal(a) != decimal.Decimal(b) or
+                                decimal.Decimal(a).as_tuple()[2] !=
+                                decimal.Decimal(b).as_tuple()[2]):
+                            if same:
+                                print "text {!r} != {!r}".format(a, b)
+                            same = False
+                same = same and len(data) > 0
+            if not same:
+                failures += 1
+                print "{} data differs".format(copyformat)
+        print "batch {}: {} rows".format(batch, len(sample))
+    print "Failures: {}".format(failures)
+    sys.exit(1 if failures else 0)
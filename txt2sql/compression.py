@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+    Compressed sources for import_txt_to_sql.py
+
+    gzip, bzip2, xz and zip sources are recognized by their first
+    bytes, or by their extension, and decompressed on the fly while
+    the source is read, so no uncompressed copy is ever written:
+
+        python import_txt_to_sql.py -y BKPF.txt.gz
+        zcat BKPF.txt.gz | python import_txt_to_sql.py -y - bkpf
+
+    tell() and the progress of the import count compressed bytes, so
+    the percentage is of the compressed file. Concatenated gzip,
+    bzip2 and xz streams are read one after the other. A zip archive
+    must contain exactly one file and cannot be read from a pipe.
+    xz needs the lzma module (backports.lzma on python 2).
+"""
+import os, io, zlib, bz2
+
+# bytes of compressed data read at a time
+BLOCKSIZE = 65536
+
+MAGIC = [('\x1f\x8b', 'gzip'),
+         ('BZh', 'bz2'),
+         ('\xfd7zXZ\x00', 'xz'),
+         ('PK\x03\x04', 'zip')]
+
+EXTENSIONS = {'.gz': 'gzip', '.gzip': 'gzip', '.bz2': 'bz2', '.xz': 'xz',
+    '.zip': 'zip'}
+
+# bytes needed to recognize any of the formats
+HEADSIZE = max(len(magic) for magic, dummy0 in MAGIC)
+
+def detect(head, name=''):
+    """
+    Compression format of a source starting with the bytes head
+    and named name, None if it is not compressed
+    """
+    for magic, kind in MAGIC:
+        if head.startswith(magic):
+            if kind == 'bz2' and head[3:4] not in '123456789':
+                # text that happens to start with BZh
+                continue
+            return kind
+    return EXTENSIONS.get(os.path.splitext(name)[1].lower())
+
+def decompressor(kind):
+    """
+    Returns a function creating a new decompressor object of kind
+    """
+    if kind == 'gzip':
+        # 16 + MAX_WBITS: expect a gzip header and trailer
+        return lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif kind == 'bz2':
+        return bz2.BZ2Decompressor
+    elif kind == 'xz':
+        try:
+            import lzma
+        except ImportError:
+            try:
+                from backports import lzma
+            except ImportError:
+                raise SystemExit('xz compressed sources need the lzma '
+                    'module, pip install backports.lzma')
+        return lzma.LZMADecompressor
+    raise ValueError('unknown compression {!r}'.format(kind))
+
+class DecompressedStream(object):
+    """
+    Binary stream of the decompressed contents of the ByteCounter
+    `raw`. bytes_read counts the compressed bytes consumed.
+    """
+    def __init__(self, raw, kind):
+        self.raw = raw
+        self.kind = kind
+        self.new_decompressor = decompressor(kind)
+        self.decompressor = self.new_decompressor()
+        self.buffer = ''
+        self.pos = 0
+
+    @property
+    def bytes_read(self):
+        return self.raw.bytes_read
+
+    def decompress(self, data):
+        out = []
+        while data:
+            try:
+                out.append(self.decompressor.decompress(data))
+            except EOFError:
+                # bz2 and xz: the previous stream ended right at
+                # the end of the last block, data is the next one
+                self.decompressor = self.new_decompressor()
+                continue
+            data = self.decompressor.unused_data
+            if data:
+                # the next of several concatenated streams
+                self.decompressor = self.new_decompressor()
+        return ''.join(out)
+
+    def fill(self):
+        """
+        Adds decompressed data to the buffer, False at the end
+        """
+        while True:
+            data = self.raw.read(BLOCKSIZE)
+            if not data:
+                return False
+            data = self.decompress(data)
+            if data:
+                self.buffer = self.buffer[self.pos:] + data
+                self.pos = 0
+                return True
+
+    def read(self, size=-1):
+        if size < 0:
+            while self.fill():
+                pass
+            size = len(self.buffer) - self.pos
+        else:
+            while len(self.buffer) - self.pos < size and self.fill():
+                pass
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def readline(self, size=-1):
+        while True:
+            end = self.buffer.find('\n', self.pos)
+            if end >= 0 or not self.fill():
+                break
+        if end < 0:
+            end = len(self.buffer)
+        else:
+            end += 1
+        if 0 <= size < end - self.pos:
+            end = self.pos + size
+        data = self.buffer[self.pos:end]
+        self.pos = end
+        return data
+
+    def fileno(self):
+        raise io.UnsupportedOperation('decompressed streams have no '
+            'file descriptor')
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        self.raw.close()
+
+class ZipMemberStream(object):
+    """
+    Binary stream of the only file in the zip archive `stream`.
+    bytes_read counts the compressed bytes consumed.
+    """
+    def __init__(self, stream):
+        import zipfile
+        try:
+            self.archive = zipfile.ZipFile(stream)
+        except (IOError, zipfile.BadZipfile) as e:
+            raise SystemExit('Cannot read zip archive, zip archives must '
+                'be regular files: {}'.format(e))
+        members = [info for info in self.archive.infolist()
+            if not info.filename.endswith('/')]
+        if len(members) != 1:
+            raise SystemExit('A zip archive must contain exactly one file, '
+                'this one contains {}'.format(', '.join(info.filename
+                for info in members) or 'none'))
+        self.info = members[0]
+        self.stream = stream
+        self.member = self.archive.open(self.info)
+        self.start = stream.tell()
+
+    @property
+    def bytes_read(self):
+        return self.stream.tell() - self.start
+
+    def read(self, size=-1):
+        return self.member.read(size)
+
+    def readline(self, size=-1):
+        return self.member.readline(size)
+
+    def fileno(self):
+        raise io.UnsupportedOperation('zip members have no '
+            'file descriptor')
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        self.member.close()
+        self.archive.close()
+        self.stream.close()
+
+def open_compressed(raw, stream, kind, size):
+    """
+    Decompressing stream of kind over the ByteCounter raw of the
+    binary stream. Returns (stream, compressed size or None)
+    """
+    print "Reading {} compressed source".format(kind)
+    if kind == 'zip':
+        member = ZipMemberStream(stream)
+        return member, member.info.compress_size
+    return DecompressedStream(raw, kind), size
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+    ABAP data type conversion functions used by the typeconv
+    lookup tables in import_txt_to_sql.py
+"""
+import decimal, datetime
+
+def conv_to_pydate(abap_date):
+    """
+    Converts 'YYYYMMDD' or 'YYYY-MM-DD'-style dates
+    to python datetime.date
+    """
+    if '-' in abap_date:
+        abap_date = abap_date.replace('-','')
+    if len(abap_date) < 8 or abap_date.startswith('00000000'):
+        return None
+    try:
+        return datetime.date(int(abap_date[:4]),
+            int(abap_date[4:6]), int(abap_date[6:8]))
+    except:
+        return None
+
+def conv_to_pytime(abap_time):
+    """
+    Converts 'HHMMSS' or 'HH:MM:SS'-style times
+    to python datetime.time
+    """
+    if ':' in abap_time:
+        abap_time = abap_time.replace(':','')
+    if len(abap_time) != 6:
+        return None
+    hour = int(abap_time[:2])
+    minute = int(abap_time[2:4])
+    second = int(abap_time[4:])
+    if hour >= 24 or minute >= 60 or second >= 60:
+        return datetime.time(0,0,0)
+    return datetime.time(hour, minute, second)
+
+def conv_to_pydec(abap_packed):
+    """
+    Converts the argument to a python decimal.Decimal type.
+    If the argument is a BCD-packed signed decimal (\d+-),
+    then parse it correctly.
+    """
+    #strip comma
+    if ',' in abap_packed:
+        abap_packed = abap_packed.replace(',','')
+    #check last char of abap_packed
+    if abap_packed.endswith('-'):
+        #negative bcd
+        return decimal.Decimal(abap_packed[:-1]).copy_negate()
+    return decimal.Decimal(abap_packed)
+
+def compile_row_converter(converters, decoded=True):
+    """
+    Compiles the per-field conversion functions into a single
+    function that converts a whole tokenized row to a tuple: empty
+    fields become None, every other field goes through its
+    converter. If the fields are already unicode (decoded=True),
+    unicode() converters are skipped.
+
+    The returned function expects at least len(converters) fields,
+    callers check for short rows first.
+    """
+    namespace = {}
+    values = []
+    for i, converter in enumerate(converters):
+        if decoded and converter is unicode:
+            values.append('r{0} or None'.format(i))
+        else:
+            namespace['c{0}'.format(i)] = converter
+            values.append('c{0}(r{0}) if r{0} else None'.format(i))
+    source = ('def convert_row(row_):\n'
+        '    {}, = row_[:{}]\n'
+        '    return ({},)\n').format(
+            ', '.join('r{}'.format(i) for i in xrange(len(converters))),
+            len(converters),
+            ', '.join('(' + value + ')' for value in values))
+    exec source in namespace
+    return namespace['convert_row']
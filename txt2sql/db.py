@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+    Database connection helpers for import_txt_to_sql.py
+"""
+
+def connect(sqlserver):
+    """
+    Opens a new DBAPI connection from the [sqlserver] settings
+    returned by readconfig.get_sqlserver()
+    """
+    if sqlserver['servertype'] == 'postgres':
+        import psycopg2
+        pglogon = {}
+        for each in ['host','port','dbname','user','password']:
+            pglogon[each] = sqlserver[each]
+        return psycopg2.connect(**pglogon)
+
+    elif sqlserver['servertype'] == 'mssql':
+        import pyodbc
+        sqldsn = ('DRIVER={%s};'
+            'SERVER=%s;DATABASE=%s;UID=%s;PWD=%s;PORT=%s') % (
+                sqlserver.get('driver') or 'SQL Server',
+                sqlserver['host'],sqlserver['dbname'],sqlserver['user'],
+                sqlserver['password'],sqlserver['port'] or '')
+        return pyodbc.connect(sqldsn)
+
+    else:
+        raise RuntimeError("servertype in config file's "
+                           "[sqlserver] section must be one of "
+                           "'postgres' or 'mssql'")
+
+def swap_table_name(table):
+    """
+    Table that is loaded and then renamed to `table`
+    """
+    return table[:59] + '_new'
+
+def stage_table_name(table):
+    """
+    Table that is loaded and then merged into `table`
+    """
+    return table[:57] + '_stage'
+
+def index_name(table, suffix):
+    """
+    Name of the index `suffix` of `table`, e.g. ix1 for the first
+    configured index
+    """
+    return '%s_%s' % (table[:62 - len(suffix)], suffix)
+
+def create_table_sql(servertype, table, columndefs, unlogged=False):
+    """
+    CREATE TABLE statement, on postgres UNLOGGED if unlogged is set
+    """
+    if unlogged and servertype == 'postgres':
+        return 'CREATE UNLOGGED TABLE %s %s' % (table, columndefs)
+    return 'CREATE TABLE %s %s' % (table, columndefs)
+
+def create_index_sql(servertype, name, table, columns, unique=False):
+    """
+    CREATE INDEX statement that does nothing if the index exists
+    """
+    create = 'CREATE %sINDEX' % ('UNIQUE ' if unique else '')
+    if servertype == 'postgres':
+        return '%s IF NOT EXISTS %s ON %s (%s)' % (create, name, table,
+            ','.join(columns))
+    return ("IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{0}' "
+        "AND object_id = OBJECT_ID('{1}')) "
+        "{2} {0} ON {1} ({3})").format(name, table, create,
+        ','.join(columns))
+
+def rename_index_sql(servertype, table, name, newname):
+    if servertype == 'postgres':
+        return 'ALTER INDEX %s RENAME TO %s' % (name, newname)
+    return "EXEC sp_rename '%s.%s', '%s', 'INDEX'" % (table, name, newname)
+
+def analyze_sql(servertype, table):
+    """
+    Statement updating the planner statistics of table
+    """
+    if servertype == 'postgres':
+        return 'ANALYZE %s' % table
+    return 'UPDATE STATISTICS %s' % table
+
+def rename_table_sql(servertype, table, newname):
+    if servertype == 'postgres':
+        return 'ALTER TABLE %s RENAME TO %s' % (table, newname)
+    return "EXEC sp_rename '%s', '%s'" % (table, newname)
+
+def drop_table_sql(servertype, table):
+    """
+    DROP TABLE statement that does not fail if the table is missing
+    """
+    if servertype == 'postgres':
+        return 'DROP TABLE IF EXISTS ' + table
+    return ("IF EXISTS (SELECT 1 "
+        "from INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = '{0}') "
+        "DROP TABLE {0}").format(table)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+    Recording stand-in for a pyodbc connection, to check the load
+    paths without a server. Every cursor call is appended to
+    Connection.calls, executemany() checks the parameters against
+    the setinputsizes() hints like a driver binding parameter arrays
+    would, and BULK INSERT reads its staging file back.
+
+    python -m txt2sql.fakedb runs the self-check of the mssql
+    load paths in txt2sql/mssql.py
+"""
+import io, re, decimal, datetime
+from txt2sql import mssql
+
+class Connection(object):
+    def __init__(self):
+        self.calls = []
+        self.commits = 0
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+def check_value(value, size):
+    """
+    Raises TypeError if value cannot be bound with the
+    (sql_type, column_size, decimal_digits) hint `size`
+    """
+    sqltype, column_size, digits = size
+    if value is None:
+        return
+    if sqltype == mssql.SQL_INTEGER:
+        ok = isinstance(value, (int, long)) and -2**31 <= value < 2**31
+    elif sqltype == mssql.SQL_NUMERIC:
+        ok = isinstance(value, decimal.Decimal)
+        if ok and value.is_finite():
+            exponent = value.as_tuple().exponent
+            ok = -exponent <= digits and (
+                value.adjusted() < column_size - digits)
+    elif sqltype == mssql.SQL_TYPE_DATE:
+        ok = isinstance(value, datetime.date)
+    elif sqltype == mssql.SQL_TYPE_TIME:
+        ok = isinstance(value, datetime.time)
+    elif sqltype == mssql.SQL_WVARCHAR:
+        ok = isinstance(value, unicode) and (
+            column_size == 0 or len(value) <= column_size)
+    else:
+        ok = False
+    if not ok:
+        raise TypeError('cannot bind {!r} as {!r}'.format(value, size))
+
+class Cursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.calls = connection.calls
+        self.fast_executemany = False
+        self.inputsizes = None
+
+    def setinputsizes(self, sizes):
+        self.inputsizes = list(sizes)
+        self.calls.append(('setinputsizes', self.inputsizes))
+
+    def execute(self, sql, params=None):
+        match = re.match(r"BULK INSERT (\S+) FROM '(.*)' WITH", sql)
+        if match:
+            path = match.group(2).replace("''", "'")
+            with io.open(path, encoding='utf-16-le', newline='') as data:
+                lines = data.read().split(mssql.ROW_TERMINATOR)
+            rows = [tuple(value or None for value in
+                line.split(mssql.FIELD_TERMINATOR)) for line in lines[:-1]]
+            self.calls.append(('bulk insert', match.group(1), rows))
+        else:
+            self.calls.append(('execute', sql, params))
+
+    def executemany(self, sql, rows):
+        rows = list(rows)
+        if self.inputsizes is not None:
+            for row in rows:
+                if len(row) != len(self.inputsizes):
+                    raise TypeError('row has {} values for {} '
+                        'parameters'.format(len(row), len(self.inputsizes)))
+                for value, size in zip(row, self.inputsizes):
+                    check_value(value, size)
+        self.calls.append(('executemany', sql, rows, self.fast_executemany))
+        self.inputsizes = None
+
+    def close(self):
+        pass
+
+if __name__ == "__main__":
+    import sys, os, shutil, tempfile
+    from txt2sql import loaders
+    failures = []
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+            print "FAILED: " + message
+
+    columns = ['id', 'amount', 'posted', 'at', 'name']
+    sqltypes = ['integer', 'numeric(15,2)', 'date', 'time', 'nvarchar(max)']
+    rows = [(i, decimal.Decimal('%d.25' % i), datetime.date(2015, 1, 1 + i),
+        datetime.time(12, 0, i), u'name \xe9 %d' % i) for i in xrange(25)]
+    rows.append((None, None, None, None, None))
+
+    # fast_executemany: one call per package, typed parameters
+    conn = Connection()
+    loader = loaders.PackageLoader(conn.cursor(), 'target', columns, '?',
+        None, (sqltypes, None))
+    loader.load(rows[:10])
+    loader.load(rows[10:])
+    check(loader.sql == 'INSERT INTO target (id,amount,posted,at,name) '
+        'VALUES (?,?,?,?,?)', 'insert sql')
+    check([call[0] for call in conn.calls] == ['setinputsizes',
+        'executemany'] * 2, 'one setinputsizes/executemany per package')
+    check(conn.calls[0][1] == [(mssql.SQL_INTEGER, 0, 0),
+        (mssql.SQL_NUMERIC, 15, 2), (mssql.SQL_TYPE_DATE, 10, 0),
+        (mssql.SQL_TYPE_TIME, 8, 0), (mssql.SQL_WVARCHAR, 0, 0)],
+        'parameter size hints')
+    check([len(call[2]) for call in conn.calls[1::2]] == [10, 16],
+        'package sizes')
+    check(all(call[3] for call in conn.calls[1::2]), 'fast_executemany')
+    check(conn.calls[1][2] + conn.calls[3][2] == rows, 'rows')
+    try:
+        loader.load([(u'1', None, None, None, None)])
+        check(False, 'text value bound as integer')
+    except TypeError:
+        pass
+
+    # BULK INSERT staging files
+    bulkdir = tempfile.mkdtemp()
+    try:
+        conn = Connection()
+        loader = loaders.PackageLoader(conn.cursor(), 'target', columns,
+            '?', None, (sqltypes, bulkdir))
+        loader.load(rows)
+        check([call[0] for call in conn.calls] == ['bulk insert'],
+            'one BULK INSERT per package')
+        expected = [tuple(mssql.bulk_value(value) or None for value in row)
+            for row in rows]
+        check(conn.calls[0][2] == expected, 'staging file contents')
+        check(os.listdir(bulkdir) == [], 'staging file removed')
+        # a terminator in the data falls back to fast_executemany
+        loader.load([(1, None, None, None, u'a\x1fb')])
+        check([call[0] for call in conn.calls[1:]] == ['setinputsizes',
+            'executemany'], 'fallback for terminators in the data')
+    finally:
+        shutil.rmtree(bulkdir)
+
+    print "Failures: {}".format(len(failures))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+    Skipping unchanged sources, skip_unchanged = in [sqlserver]
+
+    Every import of a regular file records a fingerprint of the file
+    in the table txt2sql_fingerprint of the target database, in the
+    same transaction as the rows. The fingerprint is an MD5 of the
+    size and modification time of the file, of SAMPLES blocks of
+    BLOCK bytes spread evenly over it (the whole file if it is
+    smaller than that) and of the [flatfile] settings that decide
+    what is loaded: fields, format, delimiter, encoding, ... So it
+    takes a few reads however large the file is.
+
+    An import of a file whose fingerprint is the one recorded for
+    the target table does nothing and reports 0 rows, as long as
+    the target table exists. A scheduler can rerun the import of an
+    extract that did not change at no cost. --force imports it
+    anyway, e.g. after the rows of the table were changed by other
+    means. Pipes, stdin and streams have no fingerprint and are
+    always imported.
+"""
+import os, stat, hashlib
+
+FINGERPRINT_TABLE = 'txt2sql_fingerprint'
+
+# blocks hashed per file
+SAMPLES = 16
+BLOCK = 65536
+
+# [flatfile] settings that change the table loaded from a file
+SETTINGS = ('fields', 'format', 'encoding', 'decoding_error_handler',
+    'delimiter', 'qualifier', 'escape', 'skiplines', 'key_fields',
+    'row_hash', 'indexes')
+
+COLUMNS = ('(target_table varchar(128) PRIMARY KEY, fingerprint char(32), '
+    'source varchar(1024), source_size bigint, total_rows bigint, '
+    'updated {})')
+
+def file_fingerprint(path, settings):
+    """
+    Hex fingerprint of the file at path and the settings (any
+    value with a stable repr()), None if path is not a regular file
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    size = st.st_size
+    digest = hashlib.md5(repr((size, st.st_mtime, settings)))
+    with open(path, 'rb') as f:
+        if size <= SAMPLES * BLOCK:
+            digest.update(f.read())
+        else:
+            # the first and the last block and evenly in between
+            for i in xrange(SAMPLES):
+                f.seek(i * (size - BLOCK) // (SAMPLES - 1))
+                digest.update(f.read(BLOCK))
+    return digest.hexdigest()
+
+def create_sql(servertype):
+    """
+    CREATE TABLE statement for the fingerprint table that does
+    nothing if the table already exists
+    """
+    if servertype == 'postgres':
+        return 'CREATE TABLE IF NOT EXISTS {} {}'.format(FINGERPRINT_TABLE,
+            COLUMNS.format('timestamp'))
+    return ("IF NOT EXISTS (SELECT 1 "
+        "from INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = '{0}') "
+        "CREATE TABLE {0} {1}").format(FINGERPRINT_TABLE,
+            COLUMNS.format('datetime2'))
+
+class Fingerprints(object):
+    """
+    Reads and writes the fingerprints of target tables over `cursor`.
+    Nothing is committed here, save() is committed together with the
+    rows of the import.
+    """
+    def __init__(self, cursor, servertype, ph):
+        self.cursor = cursor
+        self.servertype = servertype
+        self.ph = ph
+
+    def create(self):
+        self.cursor.execute(create_sql(self.servertype))
+
+    def unchanged(self, target_table, fingerprint):
+        """
+        The time of the import of target_table that recorded
+        fingerprint if the table still exists, None otherwise
+        """
+        self.cursor.execute(('SELECT updated FROM {} WHERE target_table = {} '
+            'AND fingerprint = {}').format(FINGERPRINT_TABLE, self.ph,
+            self.ph), (target_table, fingerprint))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        # postgres folds unquoted table names to lower case
+        self.cursor.execute(('SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES '
+            'WHERE LOWER(TABLE_NAME) = LOWER({})').format(self.ph),
+            (target_table,))
+        if not self.cursor.fetchone()[0]:
+            return None
+        return row[0]
+
+    def save(self, target_table, fingerprint, source, source_size,
+            total_rows):
+        self.cursor.execute('DELETE FROM {} WHERE target_table = {}'.format(
+            FINGERPRINT_TABLE, self.ph), (target_table,))
+        self.cursor.execute(('INSERT INTO {} (target_table,fingerprint,'
+            'source,source_size,total_rows,updated) '
+            'VALUES ({},{},{},{},{},CURRENT_TIMESTAMP)').format(
+            FINGERPRINT_TABLE, *([self.ph] * 5)), (target_table, fingerprint,
+            source, source_size, total_rows))
@@ -0,0 +1,791 @@
+# -*- coding: utf-8 -*-
+"""
+    Library API of import_txt_to_sql.py
+
+    An Importer holds the settings of a config file and a database
+    connection and imports any number of flat files with run(), so a
+    long-lived process pays interpreter startup, config parsing and
+    the connect only once:
+
+        from config import readconfig
+        from txt2sql import importer
+
+        config = readconfig.read_config(['-c', 'extracts.ini'],
+            require_source=False)
+        imp = importer.Importer(config)
+        for path in paths:
+            result = imp.run(path)
+            print result.table, result.rows, result.exceptions
+        imp.close()
+
+    An Importer runs one import at a time. Every run() commits once,
+    at its end, or rolls back and re-raises on errors. A new table is
+    loaded under another name, without indexes and on postgres with
+    unlogged = yes or keep as an UNLOGGED table. After the load its
+    indexes are built and its statistics updated, and it is renamed
+    to the target table by that commit, so readers see the old table
+    until then and a failed import leaves the target table as it was.
+    With key_fields in [flatfile] the rows are merged into the target
+    table instead, see upsert.py. With checkpoint = N in [sqlserver]
+    the import commits every N packages instead and can be continued
+    with --resume, see checkpoint.py. Files that did not change since
+    their last import into the target table are skipped, see
+    fingerprint.py.
+"""
+import os, re, time, decimal, collections
+from txt2sql import tokenizer, reader, pipeline, db, loaders, conversions
+from txt2sql import cache, batching, metrics, checkpoint, records, rejects
+from txt2sql import columnar, upsert, fingerprint
+from txt2sql.conversions import conv_to_pydate, conv_to_pytime, conv_to_pydec
+
+# result of Importer.run()
+ImportResult = collections.namedtuple('ImportResult', ['table', 'rows',
+    'exceptions', 'bytes', 'seconds'])
+
+def type_conversions(servertype):
+    """
+    Lookup table that converts the 1-character datatype
+    code in the config file to a SQL data type
+    and the corresponding python type conversion function,
+    and the parameter placeholder of the driver.
+    int(), decimal.Decimal(), and unicode() are from the
+    python builtin and decimal core libraries.
+    """
+    if servertype == 'postgres':
+        typeconv = {    'I':['integer',int],
+                        'F':['numeric', decimal.Decimal],
+                        'P':['numeric', conv_to_pydec],
+                        'C':['text', unicode],
+                        'D':['date', conv_to_pydate],
+                        'T':['time', conv_to_pytime],
+                        'N':['text', unicode],
+                        'STRING':['text', unicode]}
+        # we use different placeholder depending on driver
+        ph = r'%s'
+
+    elif servertype == 'mssql':
+        # MSSQL is still using legacy numerics, (38,14) leaves room
+        # for the 31 digits / 14 decimals of an ABAP packed number
+        typeconv = {    'I':['integer',int],
+                        'F':['numeric(38,14)', decimal.Decimal],
+                        'P':['numeric(38,14)', conv_to_pydec],
+                        'C':['nvarchar(max)', unicode],
+                        'D':['date', conv_to_pydate],
+                        'T':['time', conv_to_pytime],
+                        'N':['nvarchar(max)', unicode],
+                        'STRING':['nvarchar(max)', unicode]}
+        # we use different placeholder depending on driver
+        ph = '?'
+
+    else:
+        raise RuntimeError("servertype in config file's "
+                           "[sqlserver] section must be one of "
+                           "'postgres' or 'mssql'")
+    return typeconv, ph
+
+# text column types and their type with a length, see column_type()
+SIZED_TYPES = {'text': ('varchar({})', 10485760),
+               'nvarchar(max)': ('nvarchar({})', 4000)}
+
+def column_type(typeconv, field):
+    """
+    SQL type of the field spec [name, type(, width)]: the one in
+    typeconv, with the width as length for text types
+    """
+    sqltype = typeconv[field[1]][0]
+    if len(field) > 2 and sqltype in SIZED_TYPES:
+        sized, longest = SIZED_TYPES[sqltype]
+        if field[2] <= longest:
+            return sized.format(field[2])
+    return sqltype
+
+def table_name(source, target_table='', debug=False):
+    """
+    Target table name: target_table, or the basename of source if
+    that is empty, stripped of leading digits and of characters
+    that are not allowed unquoted
+    """
+    # if no target table was specified, then
+    # the default target table name should be the source
+    # file basename
+    if not target_table or target_table.strip() == '':
+        if source == '-' or not isinstance(source, basestring):
+            raise SystemExit('A target table must be specified with -t, '
+                'as an argument or in the .ini file when reading from stdin')
+        target_table = os.path.basename(source).split('.')[0]
+
+    # auto-validate the choice of table name
+    print "Stripping leading numerics from table name..."
+    target_table = re.sub(r'^[0-9]+(.*)', r'\1', target_table)
+    if debug:
+        print target_table
+    print "Replacing non alphanumerics with '_' from table name..."
+    target_table = re.sub(r'[^A-Za-z0-9]', '_', target_table)
+    if debug:
+        print target_table
+    print "Truncating table name length to 63 characters if necessary..."
+    if len(target_table) > 63:
+        target_table = target_table[:62]
+
+    print 'Resulting table name: %s' % target_table
+    return target_table
+
+class Importer(object):
+    """
+    Imports flat files described by a readconfig.Config over
+    `connection`, or over a new connection from the [sqlserver]
+    settings. logbase names the profiler output of --profile.
+    """
+    def __init__(self, config, connection=None, logbase='import_txt_to_sql'):
+        self.config = config
+        self.flatfile = config.flatfile
+        self.sqlserver = config.sqlserver
+        self.debug = config.debug['debug']
+        self.logbase = logbase
+        self.fields = self.flatfile['fields']
+        self.encoding = self.flatfile['encoding']
+        self.typeconv, self.ph = type_conversions(
+            self.sqlserver['servertype'])
+
+        # splits each line into fields based on qualifier and delimiter,
+        # or on the column offsets of a fixed-width file
+        self.tokenspec = tokenizer.tokenizer_spec(self.flatfile)
+        self.tokenize = tokenizer.from_spec(self.tokenspec)
+
+        # autogenerate SQL for table creation and
+        # row insertion
+        self.columns = [field[0] for field in self.fields]
+        self.sqltypes = [column_type(self.typeconv, field)
+            for field in self.fields]
+        self.columndefs = ('(' + ','.join(field[0] + ' ' + sqltype
+            for field, sqltype in zip(self.fields, self.sqltypes)) + ')')
+        # python conversion function for each field
+        self.converters = [self.typeconv[field[1]][1]
+            for field in self.fields]
+        self.cachespec = (self.flatfile['cachesize'],
+            self.flatfile['intern_fields'])
+        # key fields of an incremental import
+        self.keys = self.flatfile['key_fields']
+        # C and N key fields are empty when '' as well as NULL
+        self.textkeys = [field[0] for field, sqltype
+            in zip(self.fields, self.sqltypes) if field[0] in self.keys
+            and (sqltype == 'text' or 'char' in sqltype)]
+        indexed = set(self.keys)
+        for unique, columns in self.flatfile['indexes']:
+            indexed.update(columns)
+        for field, sqltype in zip(self.fields, self.sqltypes):
+            if field[0] in indexed and sqltype.endswith('(max)'):
+                raise SystemExit('Field {} needs a WIDTH, {} cannot '
+                    'be in an index'.format(field[0], sqltype))
+
+        if connection is None:
+            print "Connecting to database..."
+            connection = db.connect(self.sqlserver)
+        self.conn = connection
+
+    def close(self):
+        self.conn.close()
+
+    def create_table(self, cursor, table, unlogged=False):
+        """
+        Drops the table if it exists and creates it, on postgres
+        UNLOGGED if unlogged is set
+        """
+        servertype = self.sqlserver['servertype']
+        autodroptable = db.drop_table_sql(servertype, table)
+        createsql = db.create_table_sql(servertype, table, self.columndefs,
+            unlogged)
+        print autodroptable
+        cursor.execute(autodroptable)
+
+        if self.debug:
+            print createsql
+
+        cursor.execute(createsql)
+
+    def swap_table(self):
+        """
+        Replaces the target table with the loaded table
+        """
+        servertype = self.sqlserver['servertype']
+        print "Replacing table {} with {}".format(self.target_table,
+            self.load_table)
+        self.cursor.execute(db.drop_table_sql(servertype,
+            self.target_table))
+        self.cursor.execute(db.rename_table_sql(servertype, self.load_table,
+            self.target_table))
+        for number in xrange(1, len(self.flatfile['indexes']) + 1):
+            self.cursor.execute(db.rename_index_sql(servertype,
+                self.target_table,
+                db.index_name(self.load_table, 'ix%d' % number),
+                db.index_name(self.target_table, 'ix%d' % number)))
+
+    def create_indexes(self, table):
+        """
+        Creates the indexes configured with indexes= on table
+        """
+        for number, (unique, columns) in enumerate(
+                self.flatfile['indexes'], 1):
+            createsql = db.create_index_sql(self.sqlserver['servertype'],
+                db.index_name(table, 'ix%d' % number), table, columns,
+                unique)
+            print createsql
+            self.cursor.execute(createsql)
+
+    def build_table(self):
+        """
+        Finishes the loaded table before it replaces the target table:
+        builds its indexes, makes it logged with unlogged = yes and
+        updates its statistics
+        """
+        start = time.time()
+        self.create_indexes(self.load_table)
+        if self.unlogged and self.sqlserver['unlogged'] == 'yes':
+            self.cursor.execute('ALTER TABLE %s SET LOGGED' %
+                self.load_table)
+        self.cursor.execute(db.analyze_sql(self.sqlserver['servertype'],
+            self.load_table))
+        print "Built {} indexes and statistics of {} in {:.2f}s".format(
+            len(self.flatfile['indexes']), self.load_table,
+            time.time() - start)
+
+    def load_specs(self):
+        """
+        (copyspec, mssqlspec) for loaders.PackageLoader
+        """
+        # COPY ... FROM STDIN is only available with psycopg2 and
+        # BULK INSERT only with mssql, anything else falls back to the
+        # executemany INSERT path. mssql INSERTs use fast_executemany
+        # with parameter types from the field spec unless turned off
+        sqlserver = self.sqlserver
+        copyspec = None
+        mssqlspec = None
+        if sqlserver['servertype'] == 'postgres':
+            if sqlserver['loadmethod'] == 'copy':
+                import psycopg2.extensions
+                # (sqltypes, copyformat, encoding)
+                copyspec = (self.sqltypes, sqlserver['copyformat'],
+                    psycopg2.extensions.encodings[self.conn.encoding])
+            elif sqlserver['loadmethod'] == 'bulk':
+                print ("loadmethod = bulk is only supported for "
+                    "servertype = mssql, falling back to INSERT")
+        else:
+            if sqlserver['loadmethod'] == 'copy':
+                print ("loadmethod = copy is only supported for "
+                    "servertype = postgres, falling back to INSERT")
+            if sqlserver['loadmethod'] == 'bulk':
+                # (sqltypes, bulkdir)
+                mssqlspec = (self.sqltypes, sqlserver['bulkdir'])
+            elif sqlserver['fast_executemany']:
+                mssqlspec = (self.sqltypes, None)
+        return copyspec, mssqlspec
+
+    def run(self, source=None, target_table=None, replace=True):
+        """
+        Imports source (a path, '-' for stdin, or a binary stream;
+        default: the configured source) into target_table (default:
+        the configured one or the name of the source file). With
+        replace the table is dropped and created first, otherwise
+        rows are appended; incremental imports (key_fields) always
+        merge. An unchanged source is skipped unless --force is set.
+        Returns an ImportResult.
+        """
+        started = time.time()
+        if source is None:
+            source = self.flatfile['source']
+        if target_table is None:
+            target_table = table_name(source,
+                self.config.pgquery['target_table'], self.debug)
+
+        self.target_table = target_table
+        self.cursor = self.conn.cursor()
+        self.parallelloader = None
+        self.lines = None
+        try:
+            if self.unchanged(source):
+                return ImportResult(target_table, 0, 0, 0,
+                    time.time() - started)
+            total, exceptions = self.load(source, replace)
+            nbytes = self.lines.tell()
+        except:
+            if self.parallelloader is not None:
+                self.parallelloader.cleanup()
+            self.conn.rollback()
+            raise
+        finally:
+            # streams passed in are left open for the caller
+            if (self.lines is not None and isinstance(source, basestring)
+                    and source != '-'):
+                self.lines.close()
+        return ImportResult(target_table, total, exceptions, nbytes,
+            time.time() - started)
+
+    def unchanged(self, source):
+        """
+        Sets self.fingerprint to the fingerprint of source that is
+        recorded by the import, and returns True if the target table
+        was last imported from the same file with the same settings
+        """
+        self.fingerprint = None
+        if (not self.sqlserver['skip_unchanged'] or
+                not isinstance(source, basestring) or source == '-'):
+            return False
+        settings = [self.flatfile.get(name)
+            for name in fingerprint.SETTINGS]
+        settings.append(self.config.extra_line_breaks)
+        self.fingerprint = fingerprint.file_fingerprint(source, settings)
+        if self.fingerprint is None:
+            return False
+        self.fingerprints = fingerprint.Fingerprints(self.cursor,
+            self.sqlserver['servertype'], self.ph)
+        self.fingerprints.create()
+        self.conn.commit()
+        if self.config.force:
+            return False
+        updated = self.fingerprints.unchanged(self.target_table,
+            self.fingerprint)
+        if updated is None:
+            return False
+        print ("{} is unchanged since its import into {} at {}, "
+            "skipped. Use --force to import it anyway").format(source,
+            self.target_table, updated)
+        return True
+
+    def prepare(self, replace):
+        """
+        Sets self.load_table, the table the rows go into, creating it
+        if needed. Returns the Checkpoint to resume from or None.
+        """
+        sqlserver = self.sqlserver
+        self.checkpoints = None
+        resumed = None
+        if sqlserver['checkpoint']:
+            self.checkpoints = checkpoint.Checkpoints(self.cursor,
+                sqlserver['servertype'], self.ph)
+            self.checkpoints.create()
+            self.conn.commit()
+            if self.config.resume:
+                resumed = self.checkpoints.get(self.target_table)
+                if resumed is None:
+                    print ("No checkpoint for table {}, starting from the "
+                        "beginning").format(self.target_table)
+        # new tables are UNLOGGED on postgres with unlogged = yes or
+        # keep. crash recovery empties unlogged tables, checkpoints
+        # need logged ones
+        self.unlogged = (sqlserver['unlogged'] != 'no' and
+            sqlserver['servertype'] == 'postgres')
+        if self.unlogged and self.checkpoints is not None:
+            print ("unlogged = {} needs checkpoint = 0, loading a logged "
+                "table").format(sqlserver['unlogged'])
+            self.unlogged = False
+        if resumed is not None:
+            self.load_table = resumed.load_table
+        elif self.keys:
+            # the rows go into a staging table that is merged into
+            # the target table at the end. crash recovery empties
+            # unlogged tables, a checkpointed one has to be logged
+            self.load_table = db.stage_table_name(self.target_table)
+            self.create_table(self.cursor, self.load_table,
+                unlogged=self.checkpoints is None)
+            if self.checkpoints is not None:
+                self.conn.commit()
+        elif replace:
+            # the rows go into a new table that replaces the target
+            # table at the end
+            self.load_table = db.swap_table_name(self.target_table)
+            self.create_table(self.cursor, self.load_table, self.unlogged)
+            if self.checkpoints is not None:
+                self.conn.commit()
+        else:
+            self.load_table = self.target_table
+        return resumed
+
+    def package_done(self, offset, rowcounter, total, exceptions):
+        """
+        Commits with a checkpoint after every `checkpoint` packages.
+        offset and rowcounter are the byte offset and line number in
+        the source after the package.
+        """
+        self.packages += 1
+        if (self.checkpoints is None or
+                self.packages % self.sqlserver['checkpoint']):
+            return
+        start = time.time()
+        self.rejects.flush()
+        self.checkpoints.save(self.target_table, checkpoint.Checkpoint(
+            self.load_table, self.source_name, self.sizeof_file, offset,
+            rowcounter, total, exceptions, self.source_hash))
+        self.conn.commit()
+        self.stats.add('commit', time.time() - start)
+        print "Checkpoint: {} rows, line {}, byte {}".format(total,
+            rowcounter, offset)
+
+    def load_package(self, insertdata, nrows, serialized=False):
+        """
+        Sends a package of converted rows, or of rows serialized for
+        COPY by a parse worker, to the target table.
+        Returns the seconds it took.
+        """
+        start = time.time()
+        if self.parallelloader is not None:
+            self.parallelloader.load(insertdata, nrows, serialized)
+        elif serialized:
+            self.packageloader.load_serialized(insertdata)
+        else:
+            self.packageloader.load(insertdata)
+        seconds = time.time() - start
+        self.stats.add('load', seconds)
+        return seconds
+
+    def report_progress(self, total):
+        if self.sizeof_file:
+            print "Rows inserted: {}, {}% of file".format(total,
+                (self.lines.tell()*100)/self.sizeof_file)
+        else:
+            print "Rows inserted: {}, {} bytes read".format(total,
+                self.lines.tell())
+
+    def load(self, source, replace=True):
+        """
+        Reads, converts and loads the source into self.target_table,
+        then commits. Returns (rows inserted, exceptions).
+        """
+        flatfile = self.flatfile
+        sqlserver = self.sqlserver
+        fields = self.fields
+        encoding = self.encoding
+        decoding_error_handler = flatfile['decoding_error_handler']
+        logging_config = self.config.logging
+
+        # python conversion function for each field, compiled
+        # into a single function converting a whole row
+        # date, time and decimal conversions are memoized in LRU caches
+        # and the intern_fields text columns are dictionary-encoded
+        cachedconverters, caches = cache.wrap_converters(fields,
+            self.converters, *self.cachespec)
+        convert_row = conversions.compile_row_converter(cachedconverters,
+            encoding is not None)
+
+        resumed = self.prepare(replace)
+        copyspec, mssqlspec = self.load_specs()
+        self.packageloader = loaders.PackageLoader(self.cursor,
+            self.load_table, self.columns, self.ph, copyspec, mssqlspec)
+        if self.debug:
+            print self.packageloader.sql
+
+        # with columnar = yes packages are converted column by column
+        # with numpy, straight to COPY data, see txt2sql/columnar.py
+        columns = None
+        if flatfile['columnar']:
+            if copyspec is None:
+                print ("columnar = yes needs loadmethod = copy, "
+                    "converting row by row")
+            else:
+                columns = columnar.ColumnSerializer(self.converters,
+                    *copyspec, decoded=encoding is not None)
+
+        # with connections > 1, packages are spread over that many extra
+        # connections, each loading its own staging table, and merged into
+        # the target table before the final commit
+        connections = sqlserver['connections']
+        if connections > 1 and self.checkpoints is not None:
+            print ("Checkpoints need a single connection, "
+                "continuing with 1 connection")
+            connections = 1
+        if connections > 1:
+            print "Opening {} loader connections...".format(connections)
+            self.parallelloader = loaders.ParallelLoader(sqlserver,
+                self.load_table, self.columns, self.columndefs, self.ph,
+                copyspec, connections, mssqlspec, self.unlogged)
+
+        # open the source file for reading, it is read exactly once
+        # and progress is measured in bytes consumed. regular files are
+        # memory-mapped and only the lines that are imported get decoded
+        source_stream, self.sizeof_file = reader.open_source(source)
+        if self.sizeof_file is None:
+            print "File Size: unknown (reading from a pipe)"
+        else:
+            print "File Size: %d" % self.sizeof_file
+        f = self.lines = reader.open_lines(source_stream, self.sizeof_file,
+            encoding, decoding_error_handler)
+        # identifies the file of a checkpoint for --resume, pipes and
+        # streams only have their size
+        self.source_hash = None
+        if isinstance(source, basestring) and source != '-':
+            self.source_name = os.path.abspath(source)
+            if self.checkpoints is not None:
+                self.source_hash = fingerprint.file_fingerprint(source,
+                    None)
+        else:
+            self.source_name = repr(source)
+        self.packages = 0
+
+        # pkgsize autoscaling
+        # an explicit pkgsize is used as is. otherwise the first package
+        # is small and after that packages are sized to memory_limit and
+        # to the observed load time, see txt2sql/batching.py
+        memory_limit = flatfile['memory_limit']
+        # with parallel loader connections up to 2 packages per
+        # connection are queued at the same time
+        if connections > 1:
+            memory_limit /= 2 * connections
+        batches = batching.BatchController(flatfile.get('pkgsize'),
+            memory_limit)
+
+        # skip lines as specified in skiplines config in the
+        # [flatfile] section of the config file
+        rowcounter = 0
+        exceptioncounter = 0
+        total = 0 # total rows inserted
+        eof = False
+        if resumed is not None:
+            # continue after the last committed package
+            if (resumed.source_size is not None and
+                    self.sizeof_file is not None and
+                    resumed.source_size != self.sizeof_file) or (
+                    resumed.source_hash is not None and
+                    self.source_hash is not None and
+                    resumed.source_hash != self.source_hash):
+                raise SystemExit('{} has changed since the checkpoint '
+                    'of table {}, run the import without --resume'.format(
+                    self.source_name, self.target_table))
+            rowcounter = resumed.rowcounter
+            total = resumed.total_rows
+            exceptioncounter = resumed.exceptions
+            if f.seekable():
+                f.seek(resumed.byte_offset)
+            else:
+                # line by line without parsing, e.g. on a pipe
+                for i in xrange(rowcounter):
+                    try:
+                        f.skip()
+                    except UnicodeDecodeError:
+                        pass
+                    except StopIteration:
+                        eof = True
+                        break
+            print "Resuming at line {}, byte {}, {} rows loaded".format(
+                rowcounter, resumed.byte_offset, total)
+        elif 'skiplines' in flatfile:
+            if flatfile['skiplines'] > 0:
+                rowcounter = int(flatfile['skiplines'])
+                for i in xrange(int(flatfile['skiplines'])):
+                    try: # to read past the next line in the file
+                        f.skip()
+                    # ignore unicode errors on skiplines
+                    except UnicodeDecodeError:
+                        pass
+                    except StopIteration: # if EOF
+                        eof = True
+                        pass
+
+        # parse/convert in worker processes if requested and possible
+        workers = flatfile['workers']
+        if workers > 1 and not pipeline.can_parallelize(encoding):
+            print ("Parallel parsing needs an ASCII-compatible encoding, "
+                "continuing with 1 worker")
+            workers = 1
+        extra_line_breaks = self.config.extra_line_breaks
+        if extra_line_breaks and flatfile['format'] == 'fixed':
+            print "--extra-line-breaks is ignored for fixed-width files"
+            extra_line_breaks = False
+        if workers > 1 and extra_line_breaks:
+            # chunks are cut at line breaks, not at record boundaries
+            print ("Multi-line records (--extra-line-breaks) are parsed "
+                "by a single worker, continuing with 1 worker")
+            workers = 1
+
+        # with --extra-line-breaks lines are assembled into records,
+        # which keep the number of their first line
+        recordreader = None
+        tell = f.tell
+        if extra_line_breaks:
+            recordreader = records.RecordReader(f, len(fields),
+                flatfile['delimiter'], flatfile['qualifier'],
+                flatfile['escape'], self.tokenize, rowcounter)
+            tell = recordreader.tell
+
+        # stage timings, one JSON line per package to the metrics file
+        # (or to the log) and a summary table at the end
+        if logging_config['metrics_file']:
+            metrics_out = open(logging_config['metrics_file'], 'a')
+        elif logging_config['logging']:
+            import logging
+            metrics_out = metrics.LoggerStream(logging.getLogger('metrics'))
+        else:
+            metrics_out = None
+        stats = self.stats = metrics.Metrics(metrics_out, workers,
+            {'table': self.target_table})
+
+        # bad lines go to the reject file, or are only counted
+        reject_file = flatfile['reject_file']
+        if reject_file is not None:
+            reject_file = reject_file.replace('{table}', self.target_table)
+        self.rejects = rejects.Rejects(reject_file, encoding,
+            flatfile['max_errors'], resumed)
+
+        # --profile runs the import loop under cProfile
+        profile = None
+        if logging_config['profile'] is not None:
+            from txt2sql import profiling
+            profile = profiling.Profile(self.logbase,
+                logging_config['profile'])
+            profile.start()
+
+        try:
+            if workers > 1:
+                # the reader cuts the file into line-aligned chunks, the
+                # pool parses them and the packages are loaded here in
+                # file order. workers serialize straight to COPY format
+                # when COPY is used. a chunk is one package, its size in
+                # bytes follows batches
+                chunksize = lambda: max(65536, batches.next_bytes(65536))
+                initargs = (self.tokenspec, fields, self.converters,
+                    encoding, decoding_error_handler, copyspec,
+                    self.cachespec, columns is not None)
+                workercachestats = {}
+                offset = f.tell()
+                bytes_parsed = 0
+                for result in stats.timed(pipeline.parallel_parse(
+                        f, rowcounter, workers, chunksize, initargs), 'wait'):
+                    workercachestats[result.cachestats[0]] = (
+                        result.cachestats[1])
+                    self.rejects.add(result.rejected)
+                    self.rejects.check()
+                    exceptions = len(result.rejected)
+                    exceptioncounter += exceptions
+                    rowcounter += result.nrows + exceptions
+                    bytes_parsed += result.nbytes
+                    stats.add_timings(result.timings)
+                    stats.add_exceptions(result.exceptions)
+                    seconds = 0.0
+                    if result.nrows > 0:
+                        seconds = self.load_package(result.rows,
+                            result.nrows, copyspec is not None)
+                        total += result.nrows
+                        self.report_progress(total)
+                    batches.update(result.rows, result.nrows, seconds,
+                        rowcounter, bytes_parsed)
+                    stats.end_batch(result.nrows, result.nbytes)
+                    self.package_done(offset + bytes_parsed, rowcounter,
+                        total, exceptioncounter)
+                    if profile is not None:
+                        profile.batch_done()
+            else:
+                while not eof:
+                    lines = [] # (rowcounter, line) of the package's lines
+                    rejected = []
+                    seconds = 0.0
+                    start = time.time()
+                    bytes_before = tell()
+                    for dummy0 in xrange(batches.next_size()):
+                        if recordreader is not None:
+                            try:
+                                first, row = recordreader.next()
+                            except UnicodeDecodeError as e:
+                                # rejected under its first line
+                                rowcounter = recordreader.rowcounter
+                                rejected.append((recordreader.first,
+                                    'UnicodeDecodeError', str(e), e.object))
+                                continue
+                            except StopIteration:
+                                eof = True
+                                break
+                            rowcounter = recordreader.rowcounter
+                            lines.append((first, row))
+                            continue
+                        row = None
+                        rowcounter += 1
+                        try: # to read next line in file
+                            row = f.next()
+                        except UnicodeDecodeError as e:
+                            # e.object is the undecoded line
+                            rejected.append((rowcounter,
+                                'UnicodeDecodeError', str(e), e.object))
+                            continue
+                        except StopIteration: # if EOF
+                            eof = True
+                            break
+                        lines.append((rowcounter, row.rstrip('\r\n')))
+                    stats.add('read', time.time() - start)
+
+                    # this is the master array holding multiple
+                    # rows to insert (should be <= pkgsize)
+                    if columns is not None:
+                        insertdata, nrows = pipeline.convert_columns(lines,
+                            self.tokenize, fields, columns, rejected,
+                            stats.batch)
+                    else:
+                        insertdata, dummy0 = pipeline.convert_lines(lines,
+                            self.tokenize, fields, convert_row, rejected,
+                            stats.batch)
+                        nrows = len(insertdata)
+                    # short reads and conversion errors are
+                    # rejected by convert_lines
+                    if rejected:
+                        exceptioncounter += len(rejected)
+                        stats.add_exceptions(rejects.kinds(rejected))
+                        self.rejects.add(rejected)
+                        self.rejects.check()
+                    if nrows > 0: # I have data I need to insert
+                        seconds = self.load_package(insertdata, nrows,
+                            columns is not None)
+                        total += nrows
+                        self.report_progress(total)
+                    batches.update(insertdata, nrows, seconds,
+                        rowcounter, tell())
+                    stats.end_batch(nrows, tell() - bytes_before)
+                    if not eof:
+                        self.package_done(tell(), rowcounter, total,
+                            exceptioncounter)
+                    if profile is not None:
+                        profile.batch_done()
+            start = time.time()
+            if self.parallelloader is not None:
+                self.parallelloader.finish(self.cursor)
+            if self.keys:
+                upsert.merge(self.cursor, sqlserver['servertype'],
+                    self.target_table, self.load_table, self.columns,
+                    self.columndefs, self.keys, flatfile['row_hash'],
+                    self.textkeys)
+                self.create_indexes(self.target_table)
+            elif self.load_table != self.target_table:
+                self.build_table()
+                self.swap_table()
+            else:
+                self.create_indexes(self.target_table)
+            if self.fingerprint is not None:
+                self.fingerprints.save(self.target_table, self.fingerprint,
+                    self.source_name, self.sizeof_file, total)
+            if self.checkpoints is not None:
+                self.checkpoints.clear(self.target_table)
+        except:
+            if profile is not None:
+                profile.write()
+            if metrics_out is not None:
+                metrics_out.close()
+            self.rejects.close()
+            raise
+
+        # no partial commits
+        self.conn.commit()
+        stats.add('commit', time.time() - start)
+        if profile is not None:
+            profile.write()
+
+        if self.parallelloader is not None:
+            self.parallelloader.report()
+
+        if workers > 1:
+            cache.report(cache.merge_stats(workercachestats.values()))
+        else:
+            cache.report(cache.cache_stats(caches))
+
+        stats.finish()
+        if metrics_out is not None:
+            metrics_out.close()
+        self.rejects.close()
+        self.rejects.report()
+
+        print "Exceptions: {}".format(exceptioncounter)
+        return total, exceptioncounter
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+    Field spec inference for import_txt_to_sql.py --infer-fields
+
+    Reads a sample of the source, the first ROWS lines and ROWS
+    lines at random byte offsets (or simply the next ROWS lines if
+    the source cannot seek, e.g. a pipe or a compressed file), splits
+    them with the configured tokenizer and infers the ABAP type of
+    every column from its values:
+
+    D  dates, YYYYMMDD or YYYY-MM-DD (00000000 is an empty date)
+    T  times, HHMMSS or HH:MM:SS
+    N  digits with leading zeros (NUMC), kept as text
+    I  integers that fit a 32-bit integer column
+    P  decimals, with thousands separators or a trailing minus
+    F  decimals in exponent notation
+    C  anything else
+
+    N and C columns get a WIDTH, so they become varchar(WIDTH) or
+    nvarchar(WIDTH) columns instead of text or nvarchar(max). The
+    width is the length of the values if they all have the same
+    length (a fixed-length SAP field) and otherwise the power of two
+    at or above twice the longest value, as longer values may be
+    missing from the sample. Column names come from the header line
+    if skiplines is set, otherwise they are F001, F002, ...
+
+    The result is printed as a fields= line for the [flatfile]
+    section. Only the sampled lines are read, so this takes seconds
+    for any file size.
+"""
+import re, random, decimal, collections
+from txt2sql import reader, tokenizer, conversions
+
+DATE = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})$')
+TIME = re.compile(r'(\d{2}):?(\d{2}):?(\d{2})$')
+INTEGER = re.compile(r'-?\d+$')
+PACKED = re.compile(r'-?(\d{1,3}(,\d{3})+|\d*)(\.\d*)?-?$')
+FLOAT = re.compile(r'-?(\d+\.?\d*|\.\d+)[eE][-+]?\d+$')
+
+# an inferred column, empty and values count the sampled values
+Column = collections.namedtuple('Column', ['name', 'abap_type', 'width',
+    'example', 'empty', 'values'])
+
+def sample_lines(lines, size, count, seed=0):
+    """
+    Decoded lines of the reader `lines` of a source of size bytes,
+    see the module docstring
+    """
+    sample = []
+    def take(n):
+        for dummy0 in xrange(n):
+            try:
+                sample.append(lines.next().rstrip('\r\n'))
+            except UnicodeDecodeError:
+                continue
+            except StopIteration:
+                return False
+        return True
+    if not take(count):
+        return sample
+    if size and lines.seekable():
+        rng = random.Random(seed)
+        start = lines.tell()
+        if start >= size:
+            return sample
+        for offset in sorted(rng.randint(start, size - 1)
+                for dummy0 in xrange(count)):
+            lines.seek(offset)
+            try:
+                # the rest of the line the offset is in
+                lines.skip()
+                sample.append(lines.next().rstrip('\r\n'))
+            except (UnicodeDecodeError, StopIteration):
+                continue
+    else:
+        take(count)
+    return sample
+
+def is_date(value):
+    match = DATE.match(value)
+    if not match:
+        return False
+    if value.replace('-', '') == '00000000':
+        return True
+    return conversions.conv_to_pydate(value) is not None
+
+def is_time(value):
+    match = TIME.match(value)
+    return bool(match) and (int(match.group(1)) < 24 and
+        int(match.group(2)) < 60 and int(match.group(3)) < 60)
+
+def is_packed(value):
+    if not PACKED.match(value) or not re.search(r'\d', value):
+        return False
+    if value.startswith('-') and value.endswith('-'):
+        return False
+    try:
+        conversions.conv_to_pydec(value)
+    except decimal.InvalidOperation:
+        return False
+    return True
+
+def text_width(lengths):
+    """
+    WIDTH of a text column with values of these lengths
+    """
+    longest = max(lengths)
+    if min(lengths) == longest:
+        return longest
+    width = 1
+    while width < 2 * longest:
+        width *= 2
+    return width
+
+def infer_type(values):
+    """
+    (abap type, width or None) of a column with these values
+    """
+    nonempty = [value.strip() for value in values if value.strip()]
+    lengths = [len(value) for value in values if value.strip()]
+    if not nonempty:
+        return 'C', None
+    if all(is_date(value) for value in nonempty):
+        return 'D', None
+    if all(is_time(value) for value in nonempty) and (
+            ':' in nonempty[0] or min(lengths) == max(lengths) == 6):
+        return 'T', None
+    if all(INTEGER.match(value) for value in nonempty):
+        if any(len(value) > 1 and value.startswith('0')
+                for value in nonempty):
+            return 'N', text_width(lengths)
+        if all(-2**31 <= int(value) < 2**31 for value in nonempty):
+            return 'I', None
+        return 'P', None
+    if all(is_packed(value) for value in nonempty):
+        return 'P', None
+    if all(FLOAT.match(value) for value in nonempty):
+        return 'F', None
+    return 'C', text_width(lengths)
+
+def column_names(header, count):
+    """
+    Valid, unique column names from the header tokens
+    """
+    names = []
+    for i in xrange(count):
+        name = header[i].strip() if header and i < len(header) else ''
+        name = re.sub(r'[^A-Za-z0-9_]', '_', name).strip('_')
+        if not name or name[0].isdigit():
+            name = 'F%03d' % (i + 1) if not name else 'F' + name
+        unique = name
+        suffix = 2
+        while unique.lower() in (other.lower() for other in names):
+            unique = '%s_%d' % (name, suffix)
+            suffix += 1
+        names.append(unique)
+    return names
+
+def infer_columns(sample, tokenize, header=None):
+    """
+    Columns of the lines in sample, and the number of lines
+    skipped because their field count differs from the others
+    """
+    rows = [tokenize(line) for line in sample if line]
+    if not rows:
+        raise SystemExit('No lines to infer the fields from')
+    counts = collections.Counter(len(row) for row in rows)
+    ncolumns = counts.most_common(1)[0][0]
+    rows = [row for row in rows if len(row) == ncolumns]
+    names = column_names(header, ncolumns)
+    columns = []
+    for i, name in enumerate(names):
+        values = [row[i] for row in rows]
+        abap_type, width = infer_type(values)
+        nonempty = [value.strip() for value in values if value.strip()]
+        columns.append(Column(name, abap_type, width,
+            nonempty[0] if nonempty else u'',
+            len(values) - len(nonempty), len(values)))
+    return columns, sum(counts.values()) - len(rows)
+
+def format_fields(columns, linewidth=70):
+    """
+    fields= line for the config file, continued on indented lines
+    """
+    specs = [' '.join([column.name, column.abap_type] +
+        ([str(column.width)] if column.width else []))
+        for column in columns]
+    lines = []
+    line = 'fields='
+    for i, spec in enumerate(specs):
+        spec += ',' if i < len(specs) - 1 else ''
+        if len(line) + 1 + len(spec) > linewidth and line.strip() != 'fields=':
+            lines.append(line)
+            line = '   '
+        line += ' ' + spec
+    lines.append(line)
+    return '\n'.join(lines)
+
+def infer(config, count):
+    """
+    Samples the configured source, `count` lines at the start and
+    `count` more, and returns the inferred Columns
+    """
+    flatfile = config.flatfile
+    if flatfile['format'] == 'fixed':
+        raise SystemExit('--infer-fields needs a delimited source, the '
+            'columns of a fixed-width file cannot be inferred')
+    stream, size = reader.open_source(flatfile['source'])
+    lines = reader.open_lines(stream, size, flatfile['encoding'],
+        flatfile['decoding_error_handler'])
+    tokenize = tokenizer.make_tokenizer(flatfile['delimiter'],
+        flatfile['qualifier'], flatfile['escape'])
+    header = None
+    try:
+        for i in xrange(flatfile.get('skiplines') or 0):
+            try:
+                line = lines.next().rstrip('\r\n')
+            except UnicodeDecodeError:
+                continue
+            if header is None:
+                header = tokenize(line)
+        sample = sample_lines(lines, size, count)
+    except StopIteration:
+        sample = []
+    finally:
+        lines.close()
+    columns, skipped = infer_columns(sample, tokenize, header)
+    print "Inferred from {} sampled lines{}".format(len(sample),
+        ", {} with a different number of fields skipped".format(skipped)
+        if skipped else '')
+    return columns
+
+def report(columns, sqltype):
+    """
+    Prints the columns and the fields= line. sqltype(field) is the
+    SQL type of a field spec [name, type(, width)]
+    """
+    print "{:<30}{:<6}{:>7}  {:<16}{:>7}  {}".format('Field', 'Type',
+        'Width', 'SQL type', 'empty', 'Example')
+    for column in columns:
+        field = [column.name, column.abap_type] + (
+            [column.width] if column.width else [])
+        print "{:<30}{:<6}{:>7}  {:<16}{:>6.0f}%  {!r}".format(column.name,
+            column.abap_type, column.width or '', sqltype(field),
+            100.0 * column.empty / column.values if column.values else 0,
+            column.example[:40])
+    print
+    print format_fields(columns)
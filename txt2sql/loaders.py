@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+    Package loaders for import_txt_to_sql.py
+
+    PackageLoader sends packages of converted rows to a table over a
+    single cursor, with executemany() INSERTs, COPY or one of the
+    mssql load paths.
+
+    ParallelLoader spreads packages over several extra connections.
+    Each connection loads its packages into its own staging table;
+    finish() then merges the staging tables into the target table on
+    the caller's connection, so nothing reaches the target table
+    until the caller's single final commit.
+"""
+import sys, time, threading, Queue
+from txt2sql import db, pgcopy, mssql
+
+class PackageLoader(object):
+    """
+    Loads packages into `table` over `cursor`. If copyspec
+    (sqltypes, copyformat, encoding) is given, COPY is used. If
+    mssqlspec (sqltypes, bulkdir) is given, packages go through
+    BULK INSERT files in bulkdir or, if bulkdir is None, through
+    fast_executemany. Otherwise parameterized INSERTs with
+    placeholder `ph` are used.
+    """
+    def __init__(self, cursor, table, columns, ph, copyspec=None,
+            mssqlspec=None):
+        self.cursor = cursor
+        self.mssqlloader = None
+        if copyspec is not None:
+            self.copyloader = pgcopy.CopyLoader(cursor, table, columns,
+                *copyspec)
+            self.sql = self.copyloader.sql
+        elif mssqlspec is not None:
+            self.copyloader = None
+            sqltypes, bulkdir = mssqlspec
+            if bulkdir is not None:
+                self.mssqlloader = mssql.BulkFileLoader(cursor, table,
+                    columns, sqltypes, bulkdir)
+            else:
+                self.mssqlloader = mssql.FastInsertLoader(cursor, table,
+                    columns, sqltypes)
+            self.sql = self.mssqlloader.sql
+        else:
+            self.copyloader = None
+            self.sql = 'INSERT INTO %s ' % table
+            self.sql += ('(' + ','.join(columns) + ') VALUES (' +
+                ','.join(ph for column in columns) + ')')
+
+    def load(self, rows):
+        if self.copyloader is not None:
+            self.copyloader.load(rows)
+        elif self.mssqlloader is not None:
+            self.mssqlloader.load(rows)
+        else:
+            self.cursor.executemany(self.sql, rows)
+
+    def load_serialized(self, data):
+        """
+        Loads a package already serialized for COPY by a parse worker
+        """
+        self.copyloader.load_serialized(data)
+
+def staging_table_name(table, number):
+    suffix = '_load%d' % number
+    return table[:63 - len(suffix)] + suffix
+
+class LoaderThread(threading.Thread):
+    """
+    Takes (package, nrows, serialized) items off the shared queue
+    and loads them into its staging table until it gets None
+    """
+    def __init__(self, number, conn, loader, packages):
+        threading.Thread.__init__(self, name='loader%d' % number)
+        self.daemon = True
+        self.number = number
+        self.conn = conn
+        self.loader = loader
+        self.packages = packages
+        self.rows = 0
+        self.busy = 0.0
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.packages.get()
+            if item is None:
+                break
+            if self.error is not None:
+                # keep draining so the producer never blocks
+                continue
+            package, nrows, serialized = item
+            start = time.time()
+            try:
+                if serialized:
+                    self.loader.load_serialized(package)
+                else:
+                    self.loader.load(package)
+                self.rows += nrows
+            except Exception:
+                self.error = sys.exc_info()
+            self.busy += time.time() - start
+        if self.error is None:
+            try:
+                self.conn.commit()
+            except Exception:
+                self.error = sys.exc_info()
+
+class ParallelLoader(object):
+    """
+    Loads packages over `connections` new connections opened from
+    the [sqlserver] settings, each into its own staging table
+    created with `columndefs`, UNLOGGED on postgres if unlogged
+    is set.
+    """
+    def __init__(self, sqlserver, table, columns, columndefs, ph,
+            copyspec, connections, mssqlspec=None, unlogged=False):
+        self.servertype = sqlserver['servertype']
+        self.table = table
+        self.columns = columns
+        self.packages = Queue.Queue(2 * connections)
+        self.threads = []
+        self.merge_seconds = 0.0
+        try:
+            for number in xrange(connections):
+                staging = staging_table_name(table, number)
+                conn = db.connect(sqlserver)
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute(db.drop_table_sql(self.servertype,
+                        staging))
+                    cursor.execute(db.create_table_sql(self.servertype,
+                        staging, columndefs, unlogged))
+                    conn.commit()
+                except:
+                    # not in self.threads yet, cleanup() cannot see it
+                    self.close_failed(conn, staging)
+                    raise
+                thread = LoaderThread(number, conn,
+                    PackageLoader(cursor, staging, columns, ph, copyspec,
+                        mssqlspec),
+                    self.packages)
+                thread.staging = staging
+                self.threads.append(thread)
+        except:
+            self.cleanup()
+            raise
+        for thread in self.threads:
+            thread.start()
+
+    def close_failed(self, conn, staging):
+        """
+        Drops the staging table of a loader connection whose setup
+        failed, if it got created, and closes the connection
+        """
+        try:
+            conn.rollback()
+            conn.cursor().execute(db.drop_table_sql(self.servertype,
+                staging))
+            conn.commit()
+        except Exception:
+            pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def check(self):
+        """
+        Re-raises the first error hit by a loader thread
+        """
+        for thread in self.threads:
+            if thread.error is not None:
+                raise thread.error[0], thread.error[1], thread.error[2]
+
+    def load(self, package, nrows, serialized=False):
+        """
+        Queues a package, blocks while all connections are busy
+        """
+        self.check()
+        self.packages.put((package, nrows, serialized))
+
+    def finish(self, cursor):
+        """
+        Waits for the loader threads, then copies every staging table
+        into the target table and drops it using `cursor`. Nothing
+        is committed on the caller's connection.
+        """
+        for thread in self.threads:
+            self.packages.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.check()
+        start = time.time()
+        collist = ','.join(self.columns)
+        for thread in self.threads:
+            cursor.execute('INSERT INTO %s (%s) SELECT %s FROM %s' % (
+                self.table, collist, collist, thread.staging))
+            cursor.execute('DROP TABLE %s' % thread.staging)
+        self.merge_seconds = time.time() - start
+        for thread in self.threads:
+            thread.conn.close()
+
+    def cleanup(self):
+        """
+        Drops the staging tables after a failed import
+        """
+        started = [thread for thread in self.threads
+            if thread.ident is not None]
+        for thread in started:
+            self.packages.put(None)
+        for thread in started:
+            thread.join()
+        for thread in self.threads:
+            try:
+                thread.conn.rollback()
+                cursor = thread.conn.cursor()
+                cursor.execute(db.drop_table_sql(self.servertype,
+                    thread.staging))
+                thread.conn.commit()
+                thread.conn.close()
+            except Exception:
+                pass
+
+    def report(self):
+        """
+        Prints rows and throughput per connection
+        """
+        for thread in self.threads:
+            rate = thread.rows / thread.busy if thread.busy else 0
+            print ("Connection {}: {} rows in {:.1f}s, "
+                "{:.0f} rows/s").format(thread.number, thread.rows,
+                thread.busy, rate)
+        print "Staging table merge: {:.1f}s".format(self.merge_seconds)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+    Stage timing and throughput metrics for import_txt_to_sql.py
+
+    The import loop adds the seconds it spends in each stage to a
+    Metrics object and closes every package with end_batch(), which
+    writes one JSON line per package:
+
+        {"event": "batch", "batch": 3, "rows": 28623, "bytes": 5412960,
+         "seconds": {"read": 0.21, "tokenize": 0.35, ...},
+         "rows_per_sec": ..., "bytes_per_sec": ..., "total_rows": ...,
+         "exceptions": {"truncated row": 1}, "time": "..."}
+
+    and finish() writes a final "summary" line and prints a table of
+    where the time went. Stages:
+
+    read      reading and decoding lines (in the workers: splitting
+              and decoding chunks)
+    tokenize  splitting lines into fields
+    convert   converting fields to python types
+    wait      waiting for parse workers to deliver the next chunk
+    load      executemany()/COPY/BULK INSERT, or waiting for a free
+              loader connection
+    commit    merging staging tables and the final commit
+
+    If load and commit dominate, the import is database-bound;
+    otherwise it is CPU-bound on this machine.
+"""
+import time, json, datetime, collections
+
+STAGES = ['read', 'tokenize', 'convert', 'wait', 'load', 'commit']
+CPU_STAGES = ('read', 'tokenize', 'convert')
+DB_STAGES = ('load', 'commit')
+
+class LoggerStream(object):
+    """
+    File-like target writing each JSON line to a logging.Logger
+    """
+    def __init__(self, logger):
+        self.logger = logger
+
+    def write(self, line):
+        self.logger.info(line.rstrip('\n'))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class Metrics(object):
+    """
+    Collects stage seconds per package and in total. out is a
+    file-like object receiving the JSON lines, or None. labels
+    are added to every JSON line, e.g. the table in batch mode.
+    """
+    def __init__(self, out=None, workers=1, labels=None):
+        self.out = out
+        self.workers = workers
+        self.labels = labels or {}
+        self.started = time.time()
+        self.totals = dict.fromkeys(STAGES, 0.0)
+        self.batch = dict.fromkeys(STAGES, 0.0)
+        self.exceptions = collections.Counter()
+        self.batch_exceptions = collections.Counter()
+        self.batches = 0
+        self.rows = 0
+        self.bytes = 0
+
+    def add(self, stage, seconds):
+        self.batch[stage] += seconds
+
+    def add_timings(self, timings):
+        """
+        Adds a {stage: seconds} dict, e.g. from a parse worker
+        """
+        for stage, seconds in timings.items():
+            self.batch[stage] += seconds
+
+    def timed(self, iterable, stage):
+        """
+        Iterates over iterable, adding the time spent waiting
+        for each item to stage
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(stage, time.time() - start)
+            yield item
+
+    def exception(self, kind, count=1):
+        self.batch_exceptions[kind] += count
+
+    def add_exceptions(self, exceptions):
+        """
+        Adds a {type: count} dict
+        """
+        self.batch_exceptions.update(exceptions)
+
+    def write(self, record):
+        if self.out is not None:
+            record.update(self.labels)
+            record['time'] = datetime.datetime.now().isoformat()
+            self.out.write(json.dumps(record, sort_keys=True) + '\n')
+            self.out.flush()
+
+    def end_batch(self, rows, nbytes):
+        """
+        Closes the current package of `rows` rows read from
+        `nbytes` source bytes and writes its JSON line
+        """
+        self.batches += 1
+        self.rows += rows
+        self.bytes += nbytes
+        elapsed = sum(self.batch.values())
+        self.write({'event': 'batch',
+                    'batch': self.batches,
+                    'rows': rows,
+                    'bytes': nbytes,
+                    'seconds': dict((stage, round(seconds, 6))
+                        for stage, seconds in self.batch.items() if seconds),
+                    'rows_per_sec': round(rows / elapsed, 1)
+                        if elapsed else None,
+                    'bytes_per_sec': round(nbytes / elapsed, 1)
+                        if elapsed else None,
+                    'total_rows': self.rows,
+                    'exceptions': dict(self.batch_exceptions)})
+        for stage, seconds in self.batch.items():
+            self.totals[stage] += seconds
+        self.batch = dict.fromkeys(STAGES, 0.0)
+        self.exceptions.update(self.batch_exceptions)
+        self.batch_exceptions = collections.Counter()
+
+    def finish(self):
+        """
+        Folds in anything added after the last package (the final
+        commit), writes the summary JSON line and prints the table
+        """
+        for stage, seconds in self.batch.items():
+            self.totals[stage] += seconds
+        self.batch = dict.fromkeys(STAGES, 0.0)
+        self.exceptions.update(self.batch_exceptions)
+        self.batch_exceptions = collections.Counter()
+        wall = time.time() - self.started
+        self.write({'event': 'summary',
+                    'batches': self.batches,
+                    'rows': self.rows,
+                    'bytes': self.bytes,
+                    'wall_seconds': round(wall, 3),
+                    'seconds': dict((stage, round(seconds, 6))
+                        for stage, seconds in self.totals.items()),
+                    'rows_per_sec': round(self.rows / wall, 1)
+                        if wall else None,
+                    'bytes_per_sec': round(self.bytes / wall, 1)
+                        if wall else None,
+                    'exceptions': dict(self.exceptions)})
+        self.report(wall)
+
+    def report(self, wall):
+        print "{:<10}{:>10}{:>8}".format('Stage', 'seconds', '%')
+        for stage in STAGES:
+            seconds = self.totals[stage]
+            if seconds or stage not in ('wait', 'commit'):
+                print "{:<10}{:>10.2f}{:>7.1f}%".format(stage, seconds,
+                    100.0 * seconds / wall if wall else 0)
+        if self.workers > 1:
+            print ("(read, tokenize and convert are summed over "
+                "{} workers)").format(self.workers)
+        print "{:<10}{:>10.2f}  {:.0f} rows/s, {:.2f} MB/s".format('wall',
+            wall, self.rows / wall if wall else 0,
+            self.bytes / 1048576.0 / wall if wall else 0)
+        db = sum(self.totals[stage] for stage in DB_STAGES)
+        if self.workers > 1:
+            cpu = self.totals['wait']
+        else:
+            cpu = sum(self.totals[stage] for stage in CPU_STAGES)
+        print "Bound by: {} ({:.0f}% database, {:.0f}% parsing)".format(
+            'database' if db > cpu else 'parsing',
+            100.0 * db / wall if wall else 0,
+            100.0 * cpu / wall if wall else 0)
+        for kind, count in sorted(self.exceptions.items()):
+            print "Exceptions ({}): {}".format(kind, count)
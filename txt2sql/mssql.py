@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+    Fast load paths for servertype = mssql
+
+    FastInsertLoader sends packages with pyodbc's fast_executemany,
+    which binds the whole package as parameter arrays in one round
+    trip instead of one INSERT per row. Parameter types and sizes are
+    set with setinputsizes() from the field spec, so pyodbc does not
+    have to guess them from the first row (and re-bind when a later
+    row has a None or a longer string).
+
+    BulkFileLoader writes each package to a staging file in the
+    character (widechar) format of bcp and loads it with
+    BULK INSERT. The file has to be written to a directory the
+    server can read, e.g. a share that is local to the server.
+
+    Needs a driver that supports parameter arrays, like
+    ODBC Driver 17 for SQL Server (see driver in [sqlserver]).
+"""
+import os, io, re, decimal, datetime, itertools
+
+# ODBC SQL data type codes, the same values as the pyodbc constants
+SQL_NUMERIC = 2
+SQL_INTEGER = 4
+SQL_TYPE_DATE = 91
+SQL_TYPE_TIME = 92
+SQL_WVARCHAR = -9
+
+def input_size(sqltype):
+    """
+    (sql_type, column_size, decimal_digits) setinputsizes() hint for
+    a column type from the mssql typeconv dict. A column_size of 0
+    binds (n)varchar(max).
+    """
+    sqltype = sqltype.strip().lower()
+    if sqltype == 'integer':
+        return (SQL_INTEGER, 0, 0)
+    if sqltype == 'date':
+        return (SQL_TYPE_DATE, 10, 0)
+    if sqltype == 'time':
+        return (SQL_TYPE_TIME, 8, 0)
+    match = re.match(r'(?:numeric|decimal)\s*\((\d+)\s*,\s*(\d+)\)$',
+        sqltype)
+    if match:
+        return (SQL_NUMERIC, int(match.group(1)), int(match.group(2)))
+    match = re.match(r'n?varchar\s*\((\d+|max)\)$', sqltype)
+    if match:
+        if match.group(1) == 'max':
+            return (SQL_WVARCHAR, 0, 0)
+        return (SQL_WVARCHAR, int(match.group(1)), 0)
+    raise ValueError('no parameter size hint for type %r' % sqltype)
+
+def insert_sql(table, columns):
+    return 'INSERT INTO %s (%s) VALUES (%s)' % (table, ','.join(columns),
+        ','.join('?' for column in columns))
+
+class FastInsertLoader(object):
+    """
+    Loads packages with fast_executemany and typed parameters
+    """
+    def __init__(self, cursor, table, columns, sqltypes):
+        self.cursor = cursor
+        self.sql = insert_sql(table, columns)
+        self.sizes = [input_size(sqltype) for sqltype in sqltypes]
+        cursor.fast_executemany = True
+
+    def load(self, rows):
+        self.cursor.setinputsizes(self.sizes)
+        self.cursor.executemany(self.sql, rows)
+
+# bcp character format terminators, control characters that do
+# not appear in SAP extracts. Empty fields are loaded as NULL
+FIELD_TERMINATOR = u'\x1f'
+ROW_TERMINATOR = u'\x1e\n'
+
+def bulk_value(value):
+    """
+    Text of a converted value in a bcp character format file
+    """
+    if value is None:
+        return u''
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, decimal.Decimal):
+        # never in exponent notation
+        return unicode(format(value, 'f'))
+    if isinstance(value, (datetime.date, datetime.time)):
+        return unicode(value.isoformat())
+    return unicode(value)
+
+class BulkFileLoader(object):
+    """
+    Loads packages by writing them to a UTF-16 staging file in
+    `directory` and running BULK INSERT on it. Packages with a
+    terminator character in a text value are sent with `fallback`,
+    a FastInsertLoader, instead.
+    """
+    counter = itertools.count()
+
+    def __init__(self, cursor, table, columns, sqltypes, directory):
+        self.cursor = cursor
+        self.table = table
+        self.directory = directory
+        self.fallback = FastInsertLoader(cursor, table, columns, sqltypes)
+        self.sql = ("BULK INSERT {} FROM '{{}}' WITH ("
+            "DATAFILETYPE = 'widechar', FIELDTERMINATOR = '0x1f', "
+            "ROWTERMINATOR = '0x1e0a', KEEPNULLS, TABLOCK)").format(table)
+
+    def write(self, rows, path):
+        """
+        Writes rows in bcp widechar format, returns False if a value
+        contains a terminator character
+        """
+        with io.open(path, 'w', encoding='utf-16-le', newline='') as out:
+            for row in rows:
+                values = [bulk_value(value) for value in row]
+                line = FIELD_TERMINATOR.join(values)
+                if (line.count(FIELD_TERMINATOR) != len(values) - 1 or
+                        u'\x1e' in line):
+                    return False
+                out.write(line + ROW_TERMINATOR)
+        return True
+
+    def load(self, rows):
+        path = os.path.abspath(os.path.join(self.directory,
+            '%s_%d_%d.dat' % (self.table, os.getpid(), next(self.counter))))
+        try:
+            if self.write(rows, path):
+                self.cursor.execute(self.sql.format(path.replace("'", "''")))
+            else:
+                self.fallback.load(rows)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
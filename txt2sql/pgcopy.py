@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+    PostgreSQL COPY ... FROM STDIN loader.
+
+    Rows that have already been through the typeconv conversions in
+    import_txt_to_sql.py are serialized to COPY text or binary format
+    and streamed to the server with cursor.copy_expert(), so a whole
+    batch costs one round trip instead of one per row.
+"""
+import io, struct, datetime
+
+# COPY text format escapes, see
+# https://www.postgresql.org/docs/current/static/sql-copy.html
+NULL_TEXT = '\\N'
+
+# COPY binary format framing
+BINARY_HEADER = 'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+BINARY_TRAILER = struct.pack('!h', -1)
+BINARY_NULL = struct.pack('!i', -1)
+
+PG_EPOCH = datetime.date(2000, 1, 1)
+
+
+class CopyBuffer(object):
+    """
+    File-like object handed to cursor.copy_expert().
+
+    psycopg2 calls read(size) until an empty string comes back; the
+    buffer is refilled from the row iterator on every call, so only
+    about `size` bytes of serialized data are held at any time.
+    """
+    def __init__(self, rows, serializer, header='', trailer=''):
+        self.rows = iter(rows)
+        self.serializer = serializer
+        self.buf = header
+        self.trailer = trailer
+        self.eof = False
+
+    def read(self, size=-1):
+        parts = [self.buf]
+        length = len(self.buf)
+        while (size is None or size < 0 or length < size) and not self.eof:
+            try:
+                data = self.serializer(self.rows.next())
+            except StopIteration:
+                self.eof = True
+                data = self.trailer
+            parts.append(data)
+            length += len(data)
+        data = ''.join(parts)
+        if size is None or size < 0 or length <= size:
+            self.buf = ''
+            return data
+        self.buf = data[size:]
+        return data[:size]
+
+
+def escape_text(value):
+    """
+    Escapes backslash and the COPY text delimiters in a byte string
+    """
+    if '\\' in value:
+        value = value.replace('\\', '\\\\')
+    if '\t' in value:
+        value = value.replace('\t', '\\t')
+    if '\n' in value:
+        value = value.replace('\n', '\\n')
+    if '\r' in value:
+        value = value.replace('\r', '\\r')
+    return value
+
+
+def numeric_to_binary(value):
+    """
+    Packs a decimal.Decimal into the PostgreSQL numeric wire format:
+    ndigits, weight, sign, dscale followed by base-10000 digits
+    """
+    sign, digits, exp = value.as_tuple()
+    if not isinstance(exp, (int, long)):
+        if value.is_nan():
+            return struct.pack('!hhHh', 0, 0, 0xC000, 0)
+        raise ValueError('numeric cannot hold {0!r}'.format(value))
+    dscale = max(0, -exp)
+    digits = ''.join(str(digit) for digit in digits)
+    if exp > 0:
+        digits += '0' * exp
+        exp = 0
+    point = len(digits) + exp
+    if point < 0:
+        digits = '0' * -point + digits
+        point = 0
+    intpart = digits[:point]
+    fracpart = digits[point:]
+    intpart = '0' * (-len(intpart) % 4) + intpart
+    fracpart = fracpart + '0' * (-len(fracpart) % 4)
+    groups = [int(intpart[i:i+4]) for i in xrange(0, len(intpart), 4)]
+    weight = len(groups) - 1
+    groups += [int(fracpart[i:i+4]) for i in xrange(0, len(fracpart), 4)]
+    # strip leading and trailing zero groups
+    start = 0
+    while start < len(groups) and groups[start] == 0:
+        start += 1
+        weight -= 1
+    end = len(groups)
+    while end > start and groups[end-1] == 0:
+        end -= 1
+    groups = groups[start:end]
+    if not groups:
+        weight = 0
+    return struct.pack('!hhHh%dH' % len(groups), len(groups), weight,
+        0x4000 if sign else 0x0000, dscale, *groups)
+
+
+def make_text_formatters(encoding):
+    """
+    Lookup table of sql type -> callable returning the COPY text
+    representation of a converted (non-NULL) value
+    """
+    def text(value):
+        if isinstance(value, unicode):
+            value = value.encode(encoding)
+        return escape_text(value)
+    return {'integer': str,
+            'numeric': str,
+            'text': text,
+            'varchar': text,
+            'date': datetime.date.isoformat,
+            'time': datetime.time.isoformat}
+
+
+def make_binary_formatters(encoding):
+    """
+    Lookup table of sql type -> callable returning the COPY binary
+    field payload of a converted (non-NULL) value
+    """
+    int4 = struct.Struct('!i').pack
+    int8 = struct.Struct('!q').pack
+    def text(value):
+        if isinstance(value, unicode):
+            value = value.encode(encoding)
+        return value
+    def date(value):
+        return int4((value - PG_EPOCH).days)
+    def time(value):
+        return int8(((value.hour * 60 + value.minute) * 60 +
+            value.second) * 1000000 + value.microsecond)
+    return {'integer': int4,
+            'numeric': numeric_to_binary,
+            'text': text,
+            'varchar': text,
+            'date': date,
+            'time': time}
+
+
+class CopySerializer(object):
+    """
+    Serializes converted rows to COPY `copyformat` ('text' or
+    'binary') byte strings. `sqltypes` are the column types used in
+    CREATE TABLE, i.e. typeconv[field[1]][0] for each field.
+
+    Kept separate from CopyLoader so that parse workers can
+    serialize rows without a database cursor.
+    """
+    def __init__(self, sqltypes, copyformat='text', encoding='utf8'):
+        if copyformat == 'binary':
+            formatters = make_binary_formatters(encoding)
+            self.header = BINARY_HEADER
+            self.trailer = BINARY_TRAILER
+            self.serialize = self.serialize_binary
+        elif copyformat == 'text':
+            formatters = make_text_formatters(encoding)
+            self.header = ''
+            self.trailer = ''
+            self.serialize = self.serialize_text
+        else:
+            raise ValueError("copyformat must be 'text' or 'binary'")
+        try:
+            # varchar(N) columns take the same values as varchar
+            self.formatters = [formatters[sqltype.split('(')[0]]
+                for sqltype in sqltypes]
+        except KeyError as e:
+            raise ValueError('COPY does not support column type '
+                '{}'.format(e))
+
+    def serialize_text(self, row):
+        return '\t'.join([NULL_TEXT if value is None else fmt(value)
+            for fmt, value in zip(self.formatters, row)]) + '\n'
+
+    def serialize_binary(self, row):
+        parts = [struct.pack('!h', len(row))]
+        for fmt, value in zip(self.formatters, row):
+            if value is None:
+                parts.append(BINARY_NULL)
+            else:
+                data = fmt(value)
+                parts.append(struct.pack('!i', len(data)))
+                parts.append(data)
+        return ''.join(parts)
+
+    def serialize_rows(self, rows):
+        """
+        Serializes a whole batch, without header and trailer
+        """
+        return ''.join([self.serialize(row) for row in rows])
+
+
+class CopyLoader(object):
+    """
+    Loads batches of converted rows into `table` using
+    COPY ... FROM STDIN in either 'text' or 'binary' format.
+    """
+    def __init__(self, cursor, table, columns, sqltypes,
+            copyformat='text', encoding='utf8', bufsize=65536):
+        self.cursor = cursor
+        self.bufsize = bufsize
+        self.serializer = CopySerializer(sqltypes, copyformat, encoding)
+        collist = ','.join(columns)
+        if copyformat == 'binary':
+            self.sql = 'COPY %s (%s) FROM STDIN WITH BINARY' % (
+                table, collist)
+        else:
+            self.sql = 'COPY %s (%s) FROM STDIN' % (table, collist)
+
+    def load(self, rows):
+        buf = CopyBuffer(rows, self.serializer.serialize,
+            self.serializer.header, self.serializer.trailer)
+        self.cursor.copy_expert(self.sql, buf, self.bufsize)
+
+    def load_serialized(self, data):
+        """
+        Loads a batch already serialized by CopySerializer.serialize_rows
+        """
+        buf = io.BytesIO(self.serializer.header + data +
+            self.serializer.trailer)
+        self.cursor.copy_expert(self.sql, buf, self.bufsize)
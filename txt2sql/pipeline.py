@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+    Row parsing shared by the serial import loop and the parallel
+    parse/convert stage of import_txt_to_sql.py
+
+    In parallel mode the source is cut into line-aligned byte chunks
+    which a multiprocessing pool decodes, tokenizes and converts.
+    The main process submits at most `maxpending` chunks ahead of
+    the one it is loading, and collects results in submission order,
+    so rows reach the database in file order and rowcounter stays
+    correct for every source line.
+"""
+import os, time, collections, multiprocessing
+from txt2sql import tokenizer, reader, conversions, cache, pgcopy, rejects
+from txt2sql import columnar
+
+# parse_chunk() result. rows is a list of tuples or, with a COPY
+# serializer, a serialized byte string, nbytes the size of the chunk,
+# exceptions counts the bad lines by type, rejected lists them for
+# rejects.Rejects, timings are the seconds spent per metrics stage and
+# cachestats is (pid, cache.cache_stats()) of the worker
+ChunkResult = collections.namedtuple('ChunkResult', ['rows', 'nrows',
+    'exceptions', 'rejected', 'nbytes', 'timings', 'cachestats'])
+
+def convert_lines(lines, tokenize, fields, convert_row, rejected,
+        timings=None):
+    """
+    Tokenizes (rowcounter, stripped line) pairs and converts their
+    fields to python datatypes with a
+    conversions.compile_row_converter() function. Returns the row
+    tuples and the number of rejected lines, truncated rows and rows
+    with values that cannot be converted, which are appended to
+    rejected as (rowcounter, kind, reason, line). If timings is a
+    dict, the seconds spent tokenizing and converting are added to it.
+    """
+    start = time.time()
+    tokenized = [tokenize(line) for rowcounter, line in lines]
+    tokenized_at = time.time()
+    nfields = len(fields)
+    rows = []
+    nrejected = len(rejected)
+    for (rowcounter, rowstrip), row_ in zip(lines, tokenized):
+        if len(row_) < nfields: # short read of the line
+            rejected.append((rowcounter, 'truncated row',
+                'truncated row, {} of {} fields, after field {}'.format(
+                len(row_), nfields, fields[len(row_)-1][0]), rowstrip))
+            continue
+        try:
+            rows.append(convert_row(row_))
+        except (ValueError, ArithmeticError) as e:
+            rejected.append((rowcounter, 'conversion error',
+                'conversion error: {}'.format(e), rowstrip))
+    if timings is not None:
+        timings['tokenize'] = (timings.get('tokenize', 0.0) +
+            tokenized_at - start)
+        timings['convert'] = (timings.get('convert', 0.0) +
+            time.time() - tokenized_at)
+    return rows, len(rejected) - nrejected
+
+def convert_columns(lines, tokenize, fields, serializer, rejected,
+        timings=None):
+    """
+    Like convert_lines(), but converts the rows column by column
+    with a columnar.ColumnSerializer. Returns the COPY data of the
+    rows and their number.
+    """
+    start = time.time()
+    tokenized = [tokenize(line) for rowcounter, line in lines]
+    tokenized_at = time.time()
+    nfields = len(fields)
+    rows = []
+    numbers = [] # index into lines of each row
+    for i, row_ in enumerate(tokenized):
+        if len(row_) < nfields: # short read of the line
+            rejected.append((lines[i][0], 'truncated row',
+                'truncated row, {} of {} fields, after field {}'.format(
+                len(row_), nfields, fields[len(row_)-1][0]), lines[i][1]))
+            continue
+        rows.append(row_)
+        numbers.append(i)
+    data, errors = serializer.serialize(rows)
+    for index, message in errors:
+        rowcounter, rowstrip = lines[numbers[index]]
+        rejected.append((rowcounter, 'conversion error', message, rowstrip))
+    if timings is not None:
+        timings['tokenize'] = (timings.get('tokenize', 0.0) +
+            tokenized_at - start)
+        timings['convert'] = (timings.get('convert', 0.0) +
+            time.time() - tokenized_at)
+    return data, len(rows) - len(errors)
+
+def read_chunks(stream, chunksize, rowcounter):
+    """
+    Yields (rowcounter, data) tuples of about chunksize bytes cut
+    at line boundaries. rowcounter is the number of source lines
+    before the first line in data. chunksize can be a function
+    returning the size of the next chunk.
+    """
+    while True:
+        if callable(chunksize):
+            data = stream.read(chunksize())
+        else:
+            data = stream.read(chunksize)
+        if not data:
+            return
+        if not data.endswith('\n'):
+            data += stream.readline()
+        yield rowcounter, data
+        rowcounter += data.count('\n')
+        if not data.endswith('\n'):
+            rowcounter += 1
+
+# per-process parse configuration, set by init_worker()
+worker = {}
+
+def init_worker(tokenspec, fields, converters, encoding, errors,
+        copyspec=None, cachespec=(0, ()), columns=False):
+    """
+    Pool initializer. tokenspec is a tokenizer.tokenizer_spec().
+    If copyspec (sqltypes, copyformat, encoding)
+    is given, chunks are returned already serialized for COPY, with
+    columns converted column by column (columnar = yes).
+    cachespec is (cachesize, intern_fields) for
+    cache.wrap_converters(), each worker keeps its own caches.
+    """
+    worker['tokenize'] = tokenizer.from_spec(tokenspec)
+    worker['fields'] = fields
+    worker['columns'] = None
+    if columns and copyspec is not None:
+        worker['columns'] = columnar.ColumnSerializer(converters,
+            *copyspec, decoded=encoding is not None)
+    converters, worker['caches'] = cache.wrap_converters(fields,
+        converters, *cachespec)
+    worker['convert_row'] = conversions.compile_row_converter(converters,
+        encoding is not None)
+    worker['encoding'] = encoding
+    worker['errors'] = errors
+    if copyspec is not None:
+        worker['serializer'] = pgcopy.CopySerializer(*copyspec)
+    else:
+        worker['serializer'] = None
+
+def parse_chunk(task):
+    """
+    Decodes, tokenizes and converts every line of a chunk.
+    Returns a ChunkResult.
+    """
+    rowcounter, data = task
+    encoding = worker['encoding']
+    errors = worker['errors']
+    timings = {}
+    rejected = []
+    start = time.time()
+    lines = []
+    for line in data.split('\n'):
+        rowcounter += 1
+        if encoding is not None:
+            try:
+                line = line.decode(encoding, errors)
+            except UnicodeDecodeError as e:
+                rejected.append((rowcounter, 'UnicodeDecodeError', str(e),
+                    line))
+                continue
+        lines.append((rowcounter, line.rstrip('\r\n')))
+    if data.endswith('\n'):
+        # nothing after the last line break
+        lines.pop()
+    timings['read'] = time.time() - start
+    if worker['columns'] is not None:
+        rows, nrows = convert_columns(lines, worker['tokenize'],
+            worker['fields'], worker['columns'], rejected, timings)
+    else:
+        rows, dummy0 = convert_lines(lines, worker['tokenize'],
+            worker['fields'], worker['convert_row'], rejected, timings)
+        nrows = len(rows)
+        if worker['serializer'] is not None:
+            start = time.time()
+            rows = worker['serializer'].serialize_rows(rows)
+            timings['convert'] += time.time() - start
+    cachestats = (os.getpid(), cache.cache_stats(worker['caches']))
+    return ChunkResult(rows, nrows, rejects.kinds(rejected), rejected,
+        len(data), timings, cachestats)
+
+def parallel_parse(stream, rowcounter, workers, chunksize, initargs,
+        maxpending=None):
+    """
+    Yields parse_chunk() results for the whole stream in file order
+    using a pool of `workers` processes. No more than maxpending
+    (default 2 * workers) chunks are in flight at any time.
+    """
+    if maxpending is None:
+        maxpending = 2 * workers
+    pool = multiprocessing.Pool(workers, init_worker, initargs)
+    try:
+        pending = collections.deque()
+        for task in read_chunks(stream, chunksize, rowcounter):
+            pending.append(pool.apply_async(parse_chunk, (task,)))
+            if len(pending) >= maxpending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def can_parallelize(encoding):
+    """
+    Chunks are cut at b'\\n', which needs an ASCII-compatible
+    encoding
+    """
+    if encoding is None:
+        return True
+    return reader.is_ascii_compatible(encoding)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+    Profiling hook for the import loop of import_txt_to_sql.py
+
+    With --profile the import loop runs under cProfile, for the
+    whole run or, with --profile N, for the first N packages only.
+    At the end <base>.prof (a pstats dump, for pstats, snakeviz,
+    gprof2dot, ...) and <base>.profile.txt (the top functions by
+    cumulative and by own time) are written next to the .log file.
+
+    Where cProfile is not available a sampling profiler based on
+    signal.setitimer() is used instead, which only writes the text
+    report. Parse worker processes are not profiled.
+
+    Without --profile nothing of this is imported or called.
+"""
+import sys, time, collections
+
+class SamplingProfiler(object):
+    """
+    Samples the stack of the main thread every `interval` seconds of
+    CPU time and counts each function on top of the stack (own time)
+    and anywhere in the stack (cumulative time)
+    """
+    def __init__(self, interval=0.005):
+        import signal
+        self.signal = signal
+        self.interval = interval
+        self.own = collections.Counter()
+        self.cumulative = collections.Counter()
+        self.samples = 0
+
+    def sample(self, signum, frame):
+        self.samples += 1
+        seen = set()
+        top = True
+        while frame is not None:
+            code = frame.f_code
+            function = '{}:{}({})'.format(code.co_filename,
+                code.co_firstlineno, code.co_name)
+            if top:
+                self.own[function] += 1
+                top = False
+            if function not in seen:
+                seen.add(function)
+                self.cumulative[function] += 1
+            frame = frame.f_back
+
+    def enable(self):
+        self.signal.signal(self.signal.SIGPROF, self.sample)
+        self.signal.setitimer(self.signal.ITIMER_PROF, self.interval,
+            self.interval)
+
+    def disable(self):
+        self.signal.setitimer(self.signal.ITIMER_PROF, 0, 0)
+        self.signal.signal(self.signal.SIGPROF, self.signal.SIG_DFL)
+
+    def print_report(self, out, top):
+        for title, counts in (('cumulative', self.cumulative),
+                ('own', self.own)):
+            out.write('{} samples of {:.0f}ms, top {} by {} time\n'.format(
+                self.samples, self.interval * 1000, top, title))
+            for function, count in counts.most_common(top):
+                out.write('{:>8} {:>6.1f}%  {}\n'.format(count,
+                    100.0 * count / self.samples if self.samples else 0,
+                    function))
+            out.write('\n')
+
+class Profile(object):
+    """
+    Profiles from start() until stop() or until batch_done() was
+    called `batches` times (0 profiles the whole run)
+    """
+    def __init__(self, base, batches=0, top=30):
+        self.base = base
+        self.batches = batches
+        self.top = top
+        self.done = 0
+        self.running = False
+        self.seconds = 0.0
+        try:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.kind = 'cProfile'
+        except ImportError:
+            self.profiler = SamplingProfiler()
+            self.kind = 'sampling'
+
+    def start(self):
+        self.started = time.time()
+        self.running = True
+        self.profiler.enable()
+
+    def stop(self):
+        if self.running:
+            self.profiler.disable()
+            self.running = False
+            self.seconds = time.time() - self.started
+
+    def batch_done(self):
+        self.done += 1
+        if self.batches and self.done >= self.batches:
+            self.stop()
+
+    def write(self):
+        """
+        Stops profiling and writes the dump and the report
+        """
+        self.stop()
+        report = self.base + '.profile.txt'
+        with open(report, 'w') as out:
+            out.write('{} profile of {}, {} packages, {:.1f}s\n\n'.format(
+                self.kind, ' '.join(sys.argv), self.done if not self.batches
+                else min(self.done, self.batches), self.seconds))
+            if self.kind == 'cProfile':
+                import pstats
+                self.profiler.dump_stats(self.base + '.prof')
+                stats = pstats.Stats(self.profiler, stream=out)
+                stats.sort_stats('cumulative').print_stats(self.top)
+                stats.sort_stats('tottime').print_stats(self.top)
+                print "Profile written to {}.prof and {}".format(self.base,
+                    report)
+            else:
+                self.profiler.print_report(out, self.top)
+                print "Profile written to {}".format(report)
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+    Source file readers for import_txt_to_sql.py
+
+    The source is read exactly once, as a binary stream, and the
+    number of bytes consumed is tracked so that progress can be
+    reported against the file size without counting lines first.
+    A source of '-' reads from stdin, e.g.
+
+        zcat extract.gz | python import_txt_to_sql.py -y - mytable
+
+    Regular files in an ASCII-compatible encoding are memory-mapped
+    and split into lines at the byte level, see open_lines().
+    Compressed sources are decompressed while they are read, see
+    compression.py.
+"""
+import os, sys, io, stat, codecs, mmap
+from txt2sql import compression
+
+class ByteCounter(object):
+    """
+    Wraps a binary stream and counts the bytes read through it.
+    head are bytes already read from the stream, they are
+    returned first.
+    """
+    def __init__(self, stream, head=''):
+        self.stream = stream
+        self.head = head
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = ''
+        if self.head:
+            if size < 0:
+                data, self.head = self.head, ''
+            else:
+                data, self.head = self.head[:size], self.head[size:]
+                size -= len(data)
+        if size:
+            data += self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = ''
+        if self.head:
+            end = self.head.find('\n') + 1 or len(self.head)
+            if 0 <= size < end:
+                end = size
+            data, self.head = self.head[:end], self.head[end:]
+            if self.head or len(data) == size:
+                # the line or the size ends within head
+                self.bytes_read += len(data)
+                return data
+            if size > 0:
+                size -= len(data)
+        data += self.stream.readline(size)
+        self.bytes_read += len(data)
+        return data
+
+    def fileno(self):
+        return self.stream.fileno()
+
+    def seekable(self):
+        try:
+            return self.stream.seekable()
+        except AttributeError:
+            return False
+
+    def seek(self, offset):
+        self.stream.seek(offset)
+        self.bytes_read = offset
+
+    def close(self):
+        self.stream.close()
+
+def peek(stream, size):
+    """
+    Returns the first size bytes of stream and the bytes consumed
+    to get them, which is '' if the stream could be rewound
+    """
+    try:
+        seekable = stream.seekable()
+    except AttributeError:
+        seekable = False
+    if seekable:
+        pos = stream.tell()
+        head = stream.read(size)
+        stream.seek(pos)
+        return head, ''
+    head = stream.read(size)
+    return head, head
+
+def open_source(source):
+    """
+    Opens `source` for binary reading, '-' means stdin, and an
+    object with a read() method is read as it is. Compressed
+    sources are decompressed.
+    Returns (stream, size) where size is None if the source
+    is a pipe and its size cannot be known up front.
+    """
+    if hasattr(source, 'read'):
+        stream = source
+        name = getattr(source, 'name', '')
+    elif source == '-':
+        if sys.platform == 'win32':
+            import msvcrt
+            msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+        stream = sys.stdin
+        name = ''
+    else:
+        stream = io.open(source, 'rb')
+        name = source
+    try:
+        st = os.fstat(stream.fileno())
+    except (AttributeError, EnvironmentError, io.UnsupportedOperation):
+        # in-memory streams have no file descriptor
+        size = None
+    else:
+        if stat.S_ISREG(st.st_mode) and not (stream is source and
+                stream.tell() != 0):
+            size = st.st_size
+        else:
+            # a stream that is not read from its start cannot be mapped
+            size = None
+    head, consumed = peek(stream, compression.HEADSIZE)
+    raw = ByteCounter(stream, consumed)
+    kind = compression.detect(head, name if isinstance(name, basestring)
+        else '')
+    if kind is not None:
+        return compression.open_compressed(raw, stream, kind, size)
+    return raw, size
+
+def is_ascii_compatible(encoding):
+    """
+    True if lines in `encoding` end with a plain b'\\n', so the
+    binary stream can be split into lines before decoding
+    """
+    try:
+        return u'\n'.encode(encoding) == '\n'
+    except (LookupError, UnicodeError):
+        return False
+
+class LineReader(object):
+    """
+    Iterates over the lines of a ByteCounter stream.
+
+    For ASCII-compatible encodings (cp1252, utf8, ...) each line is
+    split off the binary stream and decoded on its own, so a decoding
+    error raises UnicodeDecodeError for that line only and the next
+    call continues with the following line. Other encodings (utf16)
+    go through a codecs.StreamReader. An encoding of None returns the
+    raw byte strings. skip() consumes a line without decoding it
+    where the encoding allows.
+    """
+    def __init__(self, stream, encoding, errors='strict'):
+        self.stream = stream
+        self.encoding = encoding
+        self.errors = errors
+        if encoding is None:
+            self._next = self.skip = self.next_raw
+        elif is_ascii_compatible(encoding):
+            self._next = self.next_decoded
+            self.skip = self.next_raw
+        else:
+            self.streamreader = codecs.getreader(encoding)(stream, errors)
+            self._next = self.skip = self.streamreader.next
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self._next()
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def readline(self, size=-1):
+        return self.stream.readline(size)
+
+    def next_raw(self):
+        line = self.stream.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def next_decoded(self):
+        line = self.stream.readline()
+        if not line:
+            raise StopIteration
+        return line.decode(self.encoding, self.errors)
+
+    def tell(self):
+        """
+        Bytes of the source consumed so far
+        """
+        return self.stream.bytes_read
+
+    def seekable(self):
+        """
+        True if seek() works: the stream is seekable and tell()
+        is exact, which it is not behind a codecs.StreamReader
+        """
+        return (not hasattr(self, 'streamreader') and
+            self.stream.seekable())
+
+    def seek(self, offset):
+        """
+        Continues reading at byte offset, a value of tell()
+        """
+        self.stream.seek(offset)
+
+    def close(self):
+        self.stream.close()
+
+class MmapLineReader(object):
+    """
+    LineReader over a memory-mapped regular file.
+
+    Line boundaries are found with mmap.find() on the raw bytes and
+    each line is handed out as a zero-copy buffer() of the map, which
+    is only decoded when the line is actually returned by next().
+    Lines consumed with skip() are never decoded. Needs an encoding
+    of None or an ASCII-compatible one, like the per-line decoding
+    of LineReader, and reports UnicodeDecodeError the same way.
+    """
+    def __init__(self, stream, encoding, errors='strict'):
+        self.stream = stream
+        self.encoding = encoding
+        self.errors = errors
+        self.map = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.map)
+        # continue where the stream is, normally at 0
+        self.pos = stream.bytes_read
+
+    def __iter__(self):
+        return self
+
+    def next_view(self):
+        """
+        Returns the next line, including its line break, as a
+        read-only buffer into the map
+        """
+        pos = self.pos
+        if pos >= self.size:
+            raise StopIteration
+        end = self.map.find('\n', pos)
+        if end < 0:
+            end = self.size
+        else:
+            end += 1
+        self.pos = end
+        return buffer(self.map, pos, end - pos)
+
+    def next(self):
+        view = self.next_view()
+        if self.encoding is None:
+            return str(view)
+        return unicode(view, self.encoding, self.errors)
+
+    def skip(self):
+        self.next_view()
+
+    def read(self, size=-1):
+        """
+        File-like read of the remaining bytes, for pipeline.read_chunks()
+        """
+        pos = self.pos
+        if size < 0:
+            end = self.size
+        else:
+            end = min(self.size, pos + size)
+        self.pos = end
+        return self.map[pos:end]
+
+    def readline(self, size=-1):
+        try:
+            return str(self.next_view())
+        except StopIteration:
+            return ''
+
+    def tell(self):
+        """
+        Bytes of the source consumed so far
+        """
+        return self.pos
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset):
+        self.pos = offset
+
+    def close(self):
+        self.map.close()
+        self.stream.close()
+
+def open_lines(stream, size, encoding, errors='strict'):
+    """
+    Returns a MmapLineReader for non-empty regular files (size known)
+    in an ASCII-compatible encoding, a LineReader otherwise
+    """
+    if (size and (encoding is None or is_ascii_compatible(encoding))):
+        try:
+            return MmapLineReader(stream, encoding, errors)
+        except (mmap.error, ValueError, EnvironmentError):
+            pass
+    return LineReader(stream, encoding, errors)
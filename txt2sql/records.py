@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+    Multi-line records for import_txt_to_sql.py --extra-line-breaks
+
+    Some extracts contain line breaks inside field values, e.g. long
+    texts in a qualified field. With --extra-line-breaks the source
+    lines are assembled into records: a line is joined with the next
+    one while a qualified field is still open at its end, or while
+    the record has fewer fields than the field spec. Line breaks
+    inside a qualified field are kept in the field value, the ones
+    between two fields or in an unqualified field are dropped.
+
+    Every physical line is scanned once for its qualifiers and
+    delimiters and the scan state is carried to the next line, and
+    the lines of a record are joined once, so long records cost no
+    more than the same text on a single line. Records keep the
+    number of their first source line for error messages, while
+    rowcounter and tell() count every physical line, so checkpoints
+    and progress work as without the option.
+
+    A record is given up after MAXLINES lines, e.g. for a stray
+    qualifier: its first line is returned on its own, to be reported
+    as a truncated row, and the following lines are assembled again.
+
+    A line that cannot be decoded is scanned with its undecodable
+    bytes replaced, so the record it is in ends where it would have
+    ended, and the whole record is rejected under its first line
+    number. A record is never glued to the rest of a rejected one.
+"""
+import collections
+
+# most physical lines in one record
+MAXLINES = 1000
+
+def scan_qualified(line, delim, qual, escape, state):
+    """
+    Continues the scan of a record with the next physical line,
+    following the rules of tokenizer.split_qualified().
+    state is (delimiters outside of qualifiers so far, inside a
+    qualified field, at the start of a field); returns the state
+    after line.
+    """
+    ndelims, inqual, fieldstart = state
+    pos = 0
+    while True:
+        if inqual:
+            # look for the closing qualifier, escaped ones are literal.
+            # at the start of a line the character before the
+            # qualifier is the line break of the previous line
+            while True:
+                end = line.find(qual, pos)
+                if end == -1:
+                    return ndelims, True, False
+                pos = end + 1
+                if not escape or end == 0 or line[end-1] != escape:
+                    break
+            inqual = False
+        elif fieldstart and line.startswith(qual, pos):
+            pos += 1
+            inqual = True
+            continue
+        # unqualified (part of a) field: runs up to the next delimiter
+        end = line.find(delim, pos)
+        if end == -1:
+            return ndelims, False, fieldstart and pos == len(line)
+        ndelims += 1
+        pos = end + 1
+        fieldstart = True
+
+class RecordReader(object):
+    """
+    Iterates over the records of a reader.LineReader or
+    MmapLineReader `lines` as (number of the first line, record
+    without its final line break) for a field spec of nfields
+    fields. rowcounter is the number of source lines before the
+    first line read, and after a record the number of its last line;
+    first is the number of its first line.
+    """
+    def __init__(self, lines, nfields, delim, qual, escape, tokenize,
+            rowcounter=0, maxlines=MAXLINES):
+        self.lines = lines
+        self.nfields = nfields
+        self.delim = delim
+        self.qual = qual
+        self.escape = escape
+        self.tokenize = tokenize
+        self.maxlines = maxlines
+        self.rowcounter = rowcounter
+        self.first = rowcounter
+        self.offset = lines.tell()
+        # lines read ahead of a given up record, (line number,
+        # offset after the line, line, UnicodeDecodeError or None)
+        self.pending = collections.deque()
+        self.lastread = rowcounter
+        # multi-character delimiters and qualifiers equal to the
+        # delimiter are split by the legacy tokenizer, the field
+        # count of those records comes from the tokenizer itself
+        self.legacy = len(delim) != 1 or (qual and qual == delim)
+
+    def __iter__(self):
+        return self
+
+    def readline(self):
+        """
+        (line number, offset after the line, line, error) of the next
+        line. A line that cannot be decoded is returned decoded with
+        replacements, with its UnicodeDecodeError as error.
+        """
+        if self.pending:
+            return self.pending.popleft()
+        self.lastread += 1
+        error = None
+        try:
+            line = self.lines.next()
+        except StopIteration:
+            self.lastread -= 1
+            raise
+        except UnicodeDecodeError as e:
+            error = e
+            line = unicode(e.object, self.lines.encoding, 'replace')
+        return self.lastread, self.lines.tell(), line, error
+
+    def complete(self, parts, state):
+        """
+        Scans the last line of parts and drops its line break if
+        the record continues outside of a qualified field.
+        Returns (record complete, scan state)
+        """
+        line = parts[-1]
+        if self.legacy:
+            record = ''.join(parts) if len(parts) > 1 else line
+            complete = (len(self.tokenize(record.rstrip('\r\n'))) >=
+                self.nfields)
+            if not complete:
+                parts[-1] = line.rstrip('\r\n')
+            return complete, None
+        if state is None:
+            state = (0, False, True)
+        fieldstart = state[2]
+        if not self.qual or (self.qual not in line and not state[1]):
+            state = (state[0] + line.count(self.delim), False, False)
+        else:
+            state = scan_qualified(line, self.delim, self.qual,
+                self.escape, state)
+        if state[1]:
+            return False, state
+        if state[0] + 1 >= self.nfields:
+            return True, state
+        # the next line continues the last field
+        line = parts[-1] = line.rstrip('\r\n')
+        return False, (state[0], False,
+            line.endswith(self.delim) if line else fieldstart)
+
+    def next(self):
+        """
+        Returns the next record. A record with a line that cannot be
+        decoded raises UnicodeDecodeError, with first and rowcounter
+        set to the numbers of its first and last line.
+        """
+        if self.pending or self.legacy:
+            return self.assemble(*self.readline())
+        # most lines are a record of their own, they take no detour
+        self.lastread += 1
+        error = None
+        try:
+            line = self.lines.next()
+        except StopIteration:
+            self.lastread -= 1
+            raise
+        except UnicodeDecodeError as e:
+            error = e
+            line = unicode(e.object, self.lines.encoding, 'replace')
+        if not self.qual or self.qual not in line:
+            complete = line.count(self.delim) + 1 >= self.nfields
+        else:
+            ndelims, inqual, dummy0 = scan_qualified(line, self.delim,
+                self.qual, self.escape, (0, False, True))
+            complete = not inqual and ndelims + 1 >= self.nfields
+        if complete:
+            self.first = self.rowcounter = self.lastread
+            self.offset = None
+            if error is not None:
+                raise error
+            return self.lastread, line.rstrip('\r\n')
+        return self.assemble(self.lastread, self.lines.tell(), line, error)
+
+    def assemble(self, first, offset, line, error=None):
+        """
+        Returns the record starting with line number first, which
+        ends at offset
+        """
+        self.first = first
+        parts = [line]
+        lines = [(first, offset, line, error)]
+        complete, state = self.complete(parts, None)
+        while not complete:
+            if len(parts) >= self.maxlines:
+                # give up, the first line is returned on its own
+                self.pending.extendleft(reversed(lines[1:]))
+                parts = parts[:1]
+                offset = lines[0][1]
+                break
+            try:
+                number, offset, line, error = self.readline()
+            except StopIteration:
+                # the last record of the source is incomplete
+                break
+            parts.append(line)
+            lines.append((number, offset, line, error))
+            complete, state = self.complete(parts, state)
+        self.rowcounter = first + len(parts) - 1
+        self.offset = offset
+        for dummy0, dummy1, dummy2, error in lines[:len(parts)]:
+            if error is not None:
+                raise error
+        if len(parts) == 1:
+            return first, parts[0].rstrip('\r\n')
+        return first, ''.join(parts).rstrip('\r\n')
+
+    def tell(self):
+        """
+        Bytes of the source up to the end of the last record
+        """
+        if self.offset is None:
+            # nothing was read ahead
+            return self.lines.tell()
+        return self.offset
+
+# Consistency tests
+# compares the field counts of the scan to the tokenizer on
+# generated multi-line records
+# usage: python -m txt2sql.records [iterations]
+if __name__ == "__main__":
+    import sys, random
+    from txt2sql import tokenizer
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(0)
+
+    class Lines(object):
+        def __init__(self, lines):
+            self.lines = iter(lines)
+            self.pos = 0
+        def next(self):
+            line = self.lines.next()
+            self.pos += len(line)
+            return line
+        def tell(self):
+            return self.pos
+
+    class EncodedLines(Lines):
+        encoding = 'utf8'
+        def next(self):
+            return Lines.next(self).decode(self.encoding)
+
+    failures = 0
+    for delim, qual, escape in [(u'|', u'"', u'\\'), (u'\t', u'"', u'"'),
+            (u'|', u'', u''), (u'||', u'"', u''), (u'|', u'|', u'')]:
+        tokenize = tokenizer.make_tokenizer(delim, qual, escape)
+        alphabet = [c for c in (delim, qual, escape) if c] + [u'a', u' ',
+            u'\n', u'\r\n']
+        for dummy0 in xrange(iterations):
+            text = u''.join(rng.choice(alphabet)
+                for dummy1 in xrange(rng.randint(1, 40)))
+            nfields = rng.randint(1, 5)
+            lines = text.splitlines(True)
+            records = RecordReader(Lines(lines), nfields, delim, qual,
+                escape, tokenize, maxlines=4)
+            joined = []
+            numbers = []
+            try:
+                while True:
+                    numbers.append(records.next()[0])
+                    joined.append(records.rowcounter)
+            except StopIteration:
+                pass
+            # every line is in exactly one record, in order
+            if [last + 1 for last in joined[:-1]] != numbers[1:] or (
+                    joined and joined[-1] != len(lines)) or (
+                    records.tell() != len(text)):
+                failures += 1
+                if failures <= 20:
+                    print "LINES {!r} {}: {} {}".format(text, nfields,
+                        numbers, joined)
+            # the scan counts the fields the tokenizer splits
+            state = None
+            parts = []
+            for line in lines:
+                parts.append(line)
+                complete, state = records.complete(parts, state)
+                record = u''.join(parts).rstrip('\r\n')
+                fields = len(tokenize(record))
+                if (state is None and complete != (fields >= nfields) or
+                        state is not None and state[0] + 1 != fields):
+                    failures += 1
+                    if failures <= 20:
+                        print "SCAN {!r} {}: {} {}".format(record,
+                            nfields, complete, fields)
+        print "delim={!r} qual={!r} escape={!r}: {} records".format(delim,
+            qual, escape, iterations)
+
+    # a line that cannot be decoded rejects its whole record, under
+    # its first line, and the next record starts after it
+    tokenize = tokenizer.make_tokenizer(u'|', u'"', u'')
+    for lines, expected in [
+            (['1|1|20150101|"a\n', 'b\xff\n', 'c"\n', '2|2|20150102|d\n'],
+                [(1, 3, None), (4, 4, u'2|2|20150102|d')]),
+            (['1|1|"a\xff\n', 'b"|x\n', '2|2|20150102|d\n'],
+                [(1, 2, None), (3, 3, u'2|2|20150102|d')]),
+            (['\xff|1|2|3\n', '2|2|20150102|"d\n', 'e"\n'],
+                [(1, 1, None), (2, 3, u'2|2|20150102|"d\ne"')]),
+            ]:
+        records = RecordReader(EncodedLines(lines), 4, u'|', u'"', u'',
+            tokenize)
+        result = []
+        while True:
+            try:
+                record = records.next()[1]
+            except UnicodeDecodeError:
+                record = None
+            except StopIteration:
+                break
+            result.append((records.first, records.rowcounter, record))
+        if result != expected or records.tell() != len(''.join(lines)):
+            failures += 1
+            print "DECODE {!r}: {}".format(lines, result)
+    print "Failures: {}".format(failures)
+    sys.exit(1 if failures else 0)
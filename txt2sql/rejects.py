@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+    Rejected rows of import_txt_to_sql.py
+
+    Lines that cannot be imported (truncated rows, lines that cannot
+    be decoded, values that cannot be converted) are collected as
+    (line number, kind, reason, line) tuples by the parse loop and
+    written here in bulk, so a bad extract costs about as much as a
+    clean one.
+
+    With reject_file = PATH in [flatfile] (or --reject-file) every
+    rejected line is written to PATH, one entry per line:
+
+        line number<TAB>reason<TAB>the line as it was in the source
+
+    in the encoding of the source, so the lines can be cut out,
+    fixed and imported with the same config file. Lines that could
+    not be decoded are written as their original bytes. {table} in
+    PATH is replaced by the target table, for batch mode. A resumed
+    import keeps the entries up to its checkpoint and continues the
+    file, any other import replaces it.
+
+    Without a reject file the first PRINTED rejected lines are
+    printed and the rest is only counted. Either way the number of
+    rejected lines by kind is in the metrics and printed at the end
+    of the import.
+
+    With max_errors = N the import is aborted with TooManyErrors and
+    rolled back as soon as more than N lines were rejected, before
+    the package containing the last of them is loaded.
+"""
+import os, codecs, collections
+
+# rejected lines printed when there is no reject file
+PRINTED = 10
+
+# buffer of the reject file
+BUFSIZE = 1048576
+
+class TooManyErrors(Exception):
+    pass
+
+def kinds(rejects):
+    """
+    {kind: number of lines} of a list of rejects
+    """
+    return dict(collections.Counter(kind for dummy0, kind, dummy1, dummy2
+        in rejects))
+
+class Rejects(object):
+    """
+    Writes and counts the rejected lines of an import. encoding
+    is the source encoding, None for undecoded byte strings.
+    """
+    def __init__(self, path, encoding, max_errors=None, resumed=None):
+        self.path = path
+        self.max_errors = max_errors
+        # a resumed import continues after the Checkpoint resumed
+        self.resumed = resumed
+        self.errors = resumed.exceptions if resumed is not None else 0
+        self.written = 0
+        self.out = None
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            if resumed is not None and os.path.exists(path):
+                self.out = open(path, 'r+b', BUFSIZE)
+                self.truncate(resumed.rowcounter)
+            else:
+                self.out = open(path, 'wb', BUFSIZE)
+        if encoding is None:
+            self.encode = lambda text: text.encode('ascii', 'replace') \
+                if isinstance(text, unicode) else text
+        else:
+            # only the first call writes a byte order mark
+            encoder = codecs.getincrementalencoder(encoding)('replace')
+            self.encode = encoder.encode
+
+    def truncate(self, rowcounter):
+        """
+        Drops the entries after line rowcounter, which were written
+        after the last checkpoint and rolled back, and an entry cut
+        off by a crash
+        """
+        offset = 0
+        for entry in self.out:
+            number = entry.split('\t', 1)[0]
+            if (number.isdigit() and int(number) > rowcounter or
+                    not entry.endswith('\n')):
+                break
+            offset += len(entry)
+        self.out.seek(offset)
+        self.out.truncate()
+
+    def add(self, rejects):
+        """
+        Records the (line number, kind, reason, line) tuples of
+        rejects, in line order. line is the decoded line without its
+        line break, or the raw bytes of a line that could not be
+        decoded.
+        """
+        for rowcounter, dummy0, reason, line in sorted(rejects):
+            self.errors += 1
+            if not isinstance(line, unicode):
+                line = line.rstrip('\r\n')
+            if self.out is not None:
+                reason = reason.replace('\t', ' ').replace('\n', ' ')
+                self.out.write(self.encode(u'{}\t{}\t'.format(rowcounter,
+                    reason)))
+                if isinstance(line, unicode):
+                    line = self.encode(line)
+                self.out.write(line)
+                self.out.write(self.encode(u'\n'))
+                self.written += 1
+            elif self.errors <= PRINTED:
+                print "Rejected line {}: {}".format(rowcounter, reason)
+                print "Raw Row: {}".format(repr(line))
+                if self.errors == PRINTED:
+                    print ("Further rejected lines are only counted, set "
+                        "reject_file to keep them")
+
+    def check(self):
+        """
+        Raises TooManyErrors if more lines than max_errors were
+        rejected
+        """
+        if self.max_errors is not None and self.errors > self.max_errors:
+            raise TooManyErrors('{} rejected lines, more than max_errors = '
+                '{}{}'.format(self.errors, self.max_errors,
+                ', see ' + self.path if self.path else ''))
+
+    def flush(self):
+        """
+        Writes out the buffer, before a checkpoint is committed
+        """
+        if self.out is not None:
+            self.out.flush()
+
+    def report(self):
+        if self.written:
+            print "{} rejected lines written to {}".format(self.written,
+                self.path)
+
+    def close(self):
+        if self.out is None:
+            return
+        self.out.close()
+        self.out = None
+        if not self.written and self.resumed is None:
+            # no stale reject file of an earlier import
+            os.remove(self.path)
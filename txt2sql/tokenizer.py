@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+    Delimited line tokenizer for import_txt_to_sql.py
+
+    Splits a line (already stripped of its line ending) into a list
+    of field strings. Lines without a qualifier are split with
+    str.split(); lines containing the qualifier are scanned field by
+    field with str.find(), so no per-character Python loop runs in
+    either case. The behavior is identical to the original
+    character loop, which is kept here as split_line_legacy() for
+    unusual configurations and for conformance checks:
+
+    - a qualifier opens a qualified field only as the first character
+      of a field
+    - inside a qualified field, delimiters are literal and the next
+      qualifier closes the field, unless the character before it is
+      the escape character, in which case the qualifier is dropped
+      and the field stays open
+    - characters after a closing qualifier are appended to the field
+      up to the next delimiter
+    - stray qualifiers inside an unqualified field are kept
+
+    Fixed-width files (format = fixed) are cut at the column offsets
+    of the field spec instead, see make_fixed_tokenizer().
+"""
+
+# fixed-width values of these types keep their leading blanks
+TEXT_TYPES = ('C', 'STRING')
+
+def split_line_legacy(rowstrip, delim, qual, escape):
+    """
+    The original per-character parse loop of import_txt_to_sql.py
+    """
+    fieldvalue = []
+    row_ = []
+    isqualified = False
+    rowstriplen = len(rowstrip)
+    # parse the line based on qualifier and delimiter
+    # tested if all fields in the line is in the format
+    # qualFIELDqualdelimqualFIELDqual
+    for pos in xrange(rowstriplen):
+        if rowstrip[pos] == qual:
+            # found qualifier
+            if pos == 0: # i'm on the first char of str
+                isqualified = True
+            elif not isqualified and rowstrip[pos-1] == delim:
+                # wasn't qualified and the previous char was delim
+                isqualified = True
+            elif isqualified and rowstrip[pos-1] == escape:
+                # was qualified and preivous char was escape char
+                isqualified = True
+            elif isqualified:
+                isqualified = False
+            else:
+                # there is a qual char in the string but this field was not qual
+                fieldvalue.append(rowstrip[pos])
+        elif rowstrip[pos] == delim and isqualified is False:
+            row_.append(u''.join(fieldvalue))
+            fieldvalue = []
+        else:
+            fieldvalue.append(rowstrip[pos]) # build the string for this field
+    # capture the last group
+    row_.append(u''.join(fieldvalue))
+    return row_
+
+def split_qualified(line, delim, qual, escape):
+    """
+    Splits a line that contains at least one qualifier character.
+    delim and qual must be single, distinct characters.
+    """
+    row_ = []
+    parts = []
+    pos = 0
+    fieldstart = True
+    while True:
+        if fieldstart and line.startswith(qual, pos):
+            # qualified field: everything up to the closing
+            # qualifier is literal, escaped qualifiers are dropped
+            pos += 1
+            while True:
+                end = line.find(qual, pos)
+                if end == -1:
+                    # qualifier never closed, the field runs
+                    # to the end of the line
+                    parts.append(line[pos:])
+                    row_.append(u''.join(parts))
+                    return row_
+                parts.append(line[pos:end])
+                pos = end + 1
+                if not escape or line[end-1] != escape:
+                    break
+            fieldstart = False
+        # unqualified (part of a) field: runs up to the next delimiter
+        end = line.find(delim, pos)
+        if end == -1:
+            parts.append(line[pos:])
+            row_.append(u''.join(parts))
+            return row_
+        parts.append(line[pos:end])
+        row_.append(u''.join(parts))
+        parts = []
+        pos = end + 1
+        fieldstart = True
+
+def make_tokenizer(delim, qual, escape):
+    """
+    Returns a callable that splits a stripped line into a list of
+    fields for the given delimiter, qualifier and escape character
+    """
+    if len(delim) != 1 or (qual and qual == delim):
+        # multi-character or empty delimiters (--override) and
+        # qualifiers equal to the delimiter never occur in real
+        # extracts, keep the original semantics for them
+        def tokenize(line):
+            return split_line_legacy(line, delim, qual, escape)
+    elif not qual:
+        def tokenize(line):
+            return line.split(delim)
+    else:
+        def tokenize(line):
+            if qual not in line:
+                return line.split(delim)
+            return split_qualified(line, delim, qual, escape)
+    return tokenize
+
+def fixed_layout(fields):
+    """
+    (start, end, strip method) of each fixed-width field spec
+    [name, type, width(, start)]. start is the 1-based column of the
+    field, without it the field follows the previous one. Text
+    fields lose their trailing blanks, all other fields their
+    leading and trailing blanks.
+    """
+    layout = []
+    end = 0
+    for field in fields:
+        start = field[3] - 1 if len(field) > 3 else end
+        end = start + field[2]
+        layout.append((start, end,
+            'rstrip' if field[1] in TEXT_TYPES else 'strip'))
+    return layout
+
+def make_fixed_tokenizer(layout):
+    """
+    Returns a callable that cuts a stripped line into fields at the
+    offsets of a fixed_layout(). The slices are compiled into the
+    function, so a line is cut without looking at its characters.
+    A line may end within the last field, whose trailing blanks are
+    often cut off, but a line that ends before the last field starts
+    only returns the fields starting in it and is a truncated row.
+    """
+    laststart = max(start for start, end, strip in layout)
+
+    def short(line):
+        return [getattr(line[start:end], strip)()
+            for start, end, strip in layout
+            if start < len(line)] or [line]
+
+    namespace = {'short': short}
+    source = ('def tokenize(line):\n'
+        '    if len(line) < {}:\n'
+        '        return short(line)\n'
+        '    return [{}]\n').format(laststart, ', '.join(
+            'line[{}:{}].{}()'.format(start, end, strip)
+            for start, end, strip in layout))
+    exec source in namespace
+    return namespace['tokenize']
+
+def tokenizer_spec(flatfile):
+    """
+    Picklable arguments of from_spec() for the [flatfile] settings
+    """
+    if flatfile.get('format') == 'fixed':
+        return ('fixed', fixed_layout(flatfile['fields']))
+    return ('delimited', flatfile['delimiter'], flatfile['qualifier'],
+        flatfile['escape'])
+
+def from_spec(spec):
+    """
+    The tokenizer of a tokenizer_spec()
+    """
+    if spec[0] == 'fixed':
+        return make_fixed_tokenizer(spec[1])
+    return make_tokenizer(*spec[1:])
+
+# Conformance tests
+# compares make_tokenizer() to the original loop on generated lines
+# usage: python -m txt2sql.tokenizer [iterations]
+if __name__ == "__main__":
+    import sys, random, itertools
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(0)
+    configs = [
+        (u'|', u'\x02', u''),
+        (u'|', u'"', u'\\'),
+        (u'\t', u'"', u'"'),
+        (u',', u'"', u','),
+        (u'|', u'', u''),
+        (u'|', u'|', u''),
+        (u'||', u'"', u''),
+        (u'‖', u'\x02', u'\\'),
+        ]
+    failures = 0
+    for delim, qual, escape in configs:
+        tokenize = make_tokenizer(delim, qual, escape)
+        alphabet = [c for c in (delim, qual, escape) if c] + [
+            u'a', u'b', u' ', u'\xe9']
+        # every short line exhaustively, then random long ones
+        lines = [u''.join(chars) for length in xrange(6)
+            for chars in itertools.product(alphabet, repeat=length)]
+        lines += [u''.join(rng.choice(alphabet)
+            for dummy0 in xrange(rng.randint(0, 60)))
+            for dummy1 in xrange(iterations)]
+        for line in lines:
+            expected = split_line_legacy(line, delim, qual, escape)
+            actual = tokenize(line)
+            if actual != expected:
+                failures += 1
+                if failures <= 20:
+                    print "MISMATCH {!r}: {!r} != {!r}".format(
+                        (delim, qual, escape, line), actual, expected)
+        print "delim={!r} qual={!r} escape={!r}: {} lines".format(
+            delim, qual, escape, len(lines))
+
+    # fixed-width fields against slicing one field at a time
+    fields = [['a', 'N', 3], ['b', 'C', 5], ['c', 'P', 4, 11], ['d', 'C', 2]]
+    layout = fixed_layout(fields)
+    tokenize = make_fixed_tokenizer(layout)
+    for dummy0 in xrange(iterations):
+        line = u''.join(rng.choice(u' ab1') for dummy1 in xrange(
+            rng.randint(0, 20)))
+        expected = [line[start:end].rstrip() if field[1] == 'C' else
+            line[start:end].strip() for field, (start, end, dummy1)
+            in zip(fields, layout) if start < len(line)]
+        if len(line) >= layout[-1][0]:
+            expected = [line[start:end].rstrip() if field[1] == 'C' else
+                line[start:end].strip() for field, (start, end, dummy1)
+                in zip(fields, layout)]
+        actual = tokenize(line)
+        if actual != (expected or [line]):
+            failures += 1
+            if failures <= 20:
+                print "MISMATCH fixed {!r}: {!r} != {!r}".format(line,
+                    actual, expected)
+    print "fixed width {!r}: {} lines".format(layout, iterations)
+    print "Failures: {}".format(failures)
+    sys.exit(1 if failures else 0)
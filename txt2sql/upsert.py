@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+    Incremental imports, key_fields = in [flatfile] (or --key-fields)
+
+    Instead of replacing the target table, an incremental import
+    loads the source into a staging table and merges it into the
+    target table with a single statement before the commit:
+
+        postgres  INSERT ... SELECT ... ON CONFLICT (keys) DO UPDATE
+        mssql     MERGE ... WHEN MATCHED ... WHEN NOT MATCHED
+
+    Rows with a new key are inserted, rows with a known key replace
+    the target row. Rows that are not in the source stay in the
+    target table, so a delta extract can be merged like a full one.
+    Rows with an empty key field (NULL, or '' in a text field) are
+    left out, of the rows with the same key only one is merged (on postgres
+    the last one loaded).
+
+    With row_hash = yes (or --row-hash) the target table has a
+    row_hash column with a hash of all columns, and a row is only
+    updated if its hash changed, so the unchanged rows of a nightly
+    extract are never written to the target table. On mssql this
+    uses HASHBYTES over rows of any length, SQL Server 2016 or later.
+
+    The target table is created if it does not exist. It gets a
+    unique index on the key fields, which ON CONFLICT needs and
+    MERGE uses to find the rows, and the row_hash column if they
+    are missing. Key fields of type C or N need a WIDTH on mssql,
+    an nvarchar(max) column cannot be in an index.
+
+    On postgres the staging table is UNLOGGED, it is only read once
+    by the merge. With checkpoint = N it is a normal table, as crash
+    recovery empties unlogged tables and --resume needs its rows.
+"""
+from txt2sql import db
+
+ROW_HASH = 'row_hash'
+
+# type of the row_hash column
+HASH_TYPES = {'postgres': 'char(32)', 'mssql': 'binary(16)'}
+
+def create_target_sql(servertype, table, columndefs):
+    """
+    CREATE TABLE statement for the target table that does nothing
+    if the table already exists
+    """
+    if servertype == 'postgres':
+        return 'CREATE TABLE IF NOT EXISTS {} {}'.format(table, columndefs)
+    return ("IF NOT EXISTS (SELECT 1 "
+        "from INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = '{0}') "
+        "CREATE TABLE {0} {1}").format(table, columndefs)
+
+def key_index_sql(servertype, table, keys):
+    """
+    CREATE UNIQUE INDEX statement for the key fields that does
+    nothing if the index already exists
+    """
+    return db.create_index_sql(servertype, db.index_name(table, 'key'),
+        table, keys, unique=True)
+
+def hash_column_sql(servertype, table):
+    """
+    ALTER TABLE statement adding the row_hash column if it is missing
+    """
+    if servertype == 'postgres':
+        return 'ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} {}'.format(table,
+            ROW_HASH, HASH_TYPES[servertype])
+    return ("IF COL_LENGTH('{0}', '{1}') IS NULL "
+        "ALTER TABLE {0} ADD {1} {2}").format(table, ROW_HASH,
+        HASH_TYPES[servertype])
+
+def hash_sql(servertype, columns):
+    """
+    SQL expression of the row hash of columns
+    """
+    if servertype == 'postgres':
+        return 'md5(ROW({})::text)'.format(','.join(columns))
+    # NULL and empty text hash differently
+    return "HASHBYTES('MD5', CONCAT({}))".format(", N'|', ".join(
+        "COALESCE(N'=' + CONVERT(nvarchar(max), {}), N'-')".format(column)
+        for column in columns))
+
+def empty_sql(key, textkeys):
+    """
+    Condition that key is empty, '' counts as empty in textkeys
+    """
+    if key in textkeys:
+        return "({0} IS NULL OR {0} = '')".format(key)
+    return key + ' IS NULL'
+
+def filled_sql(key, textkeys):
+    """
+    Condition that key is not empty
+    """
+    if key in textkeys:
+        return "{} <> ''".format(key)
+    return key + ' IS NOT NULL'
+
+def source_sql(servertype, stage, columns, keys, row_hash, textkeys=()):
+    """
+    SELECT of the rows of the staging table to merge: one per key,
+    without empty keys, with their row hash
+    """
+    order = 'ctid DESC' if servertype == 'postgres' else '(SELECT NULL)'
+    selected = list(columns)
+    if row_hash:
+        selected.append('{} AS {}'.format(hash_sql(servertype, columns),
+            ROW_HASH))
+    return ('SELECT {} FROM (SELECT {}, ROW_NUMBER() OVER (PARTITION BY {} '
+        'ORDER BY {}) AS txt2sql_row FROM {} WHERE {}) s '
+        'WHERE txt2sql_row = 1').format(
+            ','.join(columns + ([ROW_HASH] if row_hash else [])),
+            ','.join(selected), ','.join(keys), order, stage,
+            ' AND '.join(filled_sql(key, textkeys) for key in keys))
+
+def merge_sql(servertype, table, stage, columns, keys, row_hash,
+        textkeys=()):
+    """
+    Statement merging the staging table into the target table
+    """
+    targets = columns + ([ROW_HASH] if row_hash else [])
+    updated = [column for column in targets if column not in keys]
+    source = source_sql(servertype, stage, columns, keys, row_hash,
+        textkeys)
+    if servertype == 'postgres':
+        sql = 'INSERT INTO {} AS t ({}) {} ON CONFLICT ({}) '.format(table,
+            ','.join(targets), source, ','.join(keys))
+        if not updated:
+            return sql + 'DO NOTHING'
+        sql += 'DO UPDATE SET {}'.format(','.join(
+            '{0} = EXCLUDED.{0}'.format(column) for column in updated))
+        if row_hash:
+            sql += ' WHERE t.{0} IS DISTINCT FROM EXCLUDED.{0}'.format(
+                ROW_HASH)
+        return sql
+    sql = 'MERGE INTO {} WITH (HOLDLOCK) AS t USING ({}) AS s ON {} '.format(
+        table, source, ' AND '.join('t.{0} = s.{0}'.format(key)
+        for key in keys))
+    if updated:
+        sql += 'WHEN MATCHED {}THEN UPDATE SET {} '.format(
+            'AND (t.{0} IS NULL OR t.{0} <> s.{0}) '.format(ROW_HASH)
+            if row_hash else '', ','.join('t.{0} = s.{0}'.format(column)
+            for column in updated))
+    return sql + ('WHEN NOT MATCHED BY TARGET THEN INSERT ({}) '
+        'VALUES ({});').format(','.join(targets),
+        ','.join('s.' + column for column in targets))
+
+def merge(cursor, servertype, table, stage, columns, columndefs, keys,
+        row_hash=False, textkeys=()):
+    """
+    Creates or completes the target table, merges the staging table
+    into it and drops the staging table. textkeys are the text
+    columns among keys. Nothing is committed.
+    Returns the number of rows inserted or updated.
+    """
+    cursor.execute(create_target_sql(servertype, table, columndefs))
+    cursor.execute(key_index_sql(servertype, table, keys))
+    if row_hash:
+        cursor.execute(hash_column_sql(servertype, table))
+    cursor.execute('SELECT COUNT(*) FROM {} WHERE {}'.format(stage,
+        ' OR '.join(empty_sql(key, textkeys) for key in keys)))
+    emptykeys = cursor.fetchone()[0]
+    if emptykeys:
+        print "{} rows with an empty key field are not merged".format(
+            emptykeys)
+    cursor.execute(merge_sql(servertype, table, stage, columns, keys,
+        row_hash, textkeys))
+    merged = cursor.rowcount
+    print "Merged {} into {}: {} rows inserted or updated".format(stage,
+        table, merged)
+    cursor.execute(db.drop_table_sql(servertype, stage))
+    return merged